@@ -7,17 +7,34 @@ Includes RAG System with Vector Database for document processing
 import os
 import json
 import hashlib
-from typing import Dict, List
+import heapq
+import time
+from collections import Counter
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple
 from dotenv import load_dotenv
 from datetime import datetime
 import re
+from compaction import compaction_scheduler
+from vector_store import new_user_store, vector_store
+from metrics import registry, span, timed
+from json_stream import JSONArrayStream
+from model_router import TIERS, model_router
+from map_reduce import (MAP_MAX_SECTIONS, MAP_REDUCE_THRESHOLD, merge_items, pick_sections,
+                        quota, run_sections, split_sections)
+from query_cache import query_cache
+from lru_cache import LRUCache
+from sharding import merge_top_k, shard_ranges, shard_searcher
+from rerank import fetch_count, rerank
+from ingestion import ChunkStage, Chunk, IngestTarget, ProgressFn, ingest, pdf_pages, text_pages
 
 # Groq client (using Groq instead of OpenAI per user request)
 try:
     from groq import Groq
     GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+    # Optional override, e.g. a local stand-in server for load tests
+    GROQ_BASE_URL = os.getenv('GROQ_BASE_URL') or None
     if GROQ_API_KEY:
-        groq_client = Groq(api_key=GROQ_API_KEY)
+        groq_client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL)
         GROQ_AVAILABLE = True
     else:
         groq_client = None
@@ -41,8 +58,22 @@ load_dotenv()
 # Previous OpenAI configuration removed; using Groq exclusively now.
 OPENAI_AVAILABLE = False  # Explicitly disable OpenAI usage
 
-# Vector Database Storage (in-memory for MVP - use Pinecone/Weaviate/Chroma in production)
-vector_store = {}  # Format: {user_id: {"documents": [], "embeddings": [], "metadata": []}}
+STREAM_FIRST_ITEM = registry.histogram(
+    'app_stream_first_item_seconds', 'Time from request to the first streamed flashcard/question', ('kind',))
+STREAM_ITEMS = registry.counter('app_stream_items_total', 'Flashcards/questions streamed to clients', ('kind',))
+
+# Vector Database Storage (shared across workers via SQLite, one row per document - use Pinecone/Weaviate/Chroma in production)
+# vector_store.get(user_id) -> {"documents": [], "embeddings": [], "metadata": [], "tombstones": set()}
+
+# Per-worker search matrices for each user's shards: user_id -> (user_data, shards)
+_shard_matrices = LRUCache(capacity=64)
+
+def _is_live(user_data: Dict, metadata: Dict) -> bool:
+    """True if a chunk's document has not been tombstoned"""
+    return metadata['doc_id'] not in user_data.get('tombstones', ())
+
+def _schedule_compaction(user_id: str) -> None:
+    compaction_scheduler.schedule(f"vector_store:{user_id}", lambda: compact_vector_store(user_id))
 
 def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
     """
@@ -62,30 +93,53 @@ def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]
     if len(text) <= chunk_size:
         return [text]
     
-    chunks = []
-    start = 0
+    # Same chunker as the ingestion pipeline (breaks at a sentence end or newline where possible)
+    stage = ChunkStage(chunk_size, overlap)
+    return [chunk.text for chunk in [*stage.process(next(text_pages(text))), *stage.finish()]]
+
+class _VectorStoreTarget(IngestTarget):
+    """Ingestion target for the shared in-memory vector store: hash embeddings, one atomic write at commit"""
     
-    while start < len(text):
-        end = start + chunk_size
-        
-        # Try to break at sentence boundary
-        if end < len(text):
-            # Look for sentence endings
-            last_period = text.rfind('.', start, end)
-            last_newline = text.rfind('\n', start, end)
-            last_break = max(last_period, last_newline)
-            
-            if last_break > start:
-                end = last_break + 1
-        
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        
-        # Move start position with overlap
-        start = end - overlap if end < len(text) else end
+    name = 'vector_store'
+    chunk_size = 500
+    chunk_overlap = 50
     
-    return chunks
+    def __init__(self, user_id: str, filename: str, doc_id: str, replace: bool):
+        self.user_id = user_id
+        self.filename = filename
+        self.doc_id = doc_id
+        self.replace = replace
+        self.rows: List[Tuple[Chunk, List[float]]] = []
+        self.replaced: Set[str] = set()
+        self.user_data: Optional[Dict] = None
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [get_embedding(text) for text in texts]
+    
+    def write(self, chunks: List[Chunk], vectors: List[Any]) -> None:
+        # Buffered: the document is written as one row, in commit()
+        self.rows.extend(zip(chunks, vectors))
+    
+    def commit(self) -> None:
+        metadatas = []
+        for idx, (chunk, _) in enumerate(self.rows):
+            metadata = {
+                'doc_id': self.doc_id,
+                'filename': self.filename,
+                'chunk_index': idx,
+                'total_chunks': len(self.rows),
+                'page': chunk.page,
+                'timestamp': datetime.now().isoformat()
+            }
+            metadatas.append(metadata)
+        
+        # One document row, written with the tombstoning of a replaced copy in one transaction
+        self.replaced = vector_store.add_document(
+            self.user_id, self.doc_id, self.filename,
+            [chunk.text for chunk, _ in self.rows], [vector for _, vector in self.rows], metadatas,
+            replace_filename=self.filename if self.replace else None
+        )
+        self.user_data = vector_store.get(self.user_id, new_user_store())
 
 def get_embedding(text: str, model: str = "deterministic-hash-embedding") -> List[float]:
     """Deterministic embedding fallback (hash-based) since Groq model used for chat only."""
@@ -125,10 +179,39 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
         
         return float(dot_product / (norm1 * norm2))
 
+def _shard_index(user_id: str, user_data: Dict) -> List[Tuple[List[int], object]]:
+    """
+    Live chunk indices and row-normalized float32 embedding matrix for each shard
+    
+    Built once per decoded copy of the user's store (any ingest, delete or
+    compaction produces a new copy) and kept per worker.
+    """
+    entry = _shard_matrices.get(user_id)
+    if entry is not None and entry[0] is user_data:
+        return entry[1]
+    
+    shards = []
+    for start, end in shard_ranges(len(user_data['embeddings'])):
+        live = [idx for idx in range(start, end) if _is_live(user_data, user_data['metadata'][idx])]
+        if not live:
+            continue
+        matrix = np.asarray([user_data['embeddings'][idx] for idx in live], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0  # zero vectors keep similarity 0, as in cosine_similarity
+        shards.append((live, matrix / norms))
+    
+    # Holding user_data in the entry keeps the identity check above sound
+    _shard_matrices.put(user_id, (user_data, shards))
+    return shards
+
 def retrieve_relevant_chunks(query: str, user_id: str, top_k: int = 3) -> List[Dict]:
     """
     Retrieve most relevant chunks for a query using vector similarity
     
+    The store is searched shard by shard in parallel; each shard yields its own
+    over-fetched candidates, the partial lists are heap-merged and the merged
+    candidates are re-ranked with MMR down to top_k.
+    
     Args:
         query: User query
         user_id: User identifier
@@ -137,38 +220,83 @@ def retrieve_relevant_chunks(query: str, user_id: str, top_k: int = 3) -> List[D
     Returns:
         List of relevant chunks with metadata
     """
-    if user_id not in vector_store or not vector_store[user_id]['embeddings']:
+    user_data = vector_store.get(user_id)
+    if not user_data or not user_data['embeddings']:
         return []
     
     # Get query embedding
-    query_embedding = get_embedding(query)
+    with span('embedding'):
+        query_embedding = get_embedding(query)
+    
+    fetch_k = fetch_count(top_k)
+    
+    with span('vector_search'):
+        if NUMPY_AVAILABLE and np is not None:
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            query_norm = np.linalg.norm(query_vector)
+            if query_norm:
+                query_vector = query_vector / query_norm
+            
+            def search_shard(shard: Tuple[List[int], object]) -> List[Tuple[float, int]]:
+                live, matrix = shard
+                scores = matrix @ query_vector
+                top = np.arange(len(live))
+                if fetch_k < len(live):
+                    top = np.argpartition(-scores, fetch_k - 1)[:fetch_k]
+                # Highest score first, ties in store order
+                top = top[np.lexsort((top, -scores[top]))]
+                return [(float(scores[i]), live[i]) for i in top]
+            
+            shards = _shard_index(user_id, user_data)
+        else:
+            def search_shard(shard: Tuple[int, int]) -> List[Tuple[float, int]]:
+                start, end = shard
+                scored = [
+                    (cosine_similarity(query_embedding, user_data['embeddings'][idx]), idx)
+                    for idx in range(start, end)
+                    if _is_live(user_data, user_data['metadata'][idx])
+                ]
+                return heapq.nsmallest(fetch_k, scored, key=lambda item: (-item[0], item[1]))
+            
+            shards = shard_ranges(len(user_data['embeddings']))
+        
+        partials = shard_searcher.map(search_shard, shards, store='vector_store')
+        top = merge_top_k(partials, fetch_k, key=lambda item: item[0])
     
-    # Calculate similarities
-    user_data = vector_store[user_id]
-    similarities = []
+    with span('mmr'):
+        top = rerank(query_embedding, top, [user_data['embeddings'][idx] for _, idx in top], top_k,
+                     store='vector_store')
     
-    for idx, doc_embedding in enumerate(user_data['embeddings']):
-        similarity = cosine_similarity(query_embedding, doc_embedding)
-        similarities.append({
+    return [
+        {
             'index': idx,
             'similarity': similarity,
             'chunk': user_data['documents'][idx],
             'metadata': user_data['metadata'][idx]
-        })
-    
-    # Sort by similarity and return top_k
-    similarities.sort(key=lambda x: x['similarity'], reverse=True)
-    return similarities[:top_k]
+        }
+        for similarity, idx in top
+    ]
 
 class AIService:
     """AI Service for processing educational content with RAG support (Groq)"""
     
     def __init__(self):
-        # Use Groq OSS model as requested
-        self.model = "openai/gpt-oss-120b"
+        # Use Groq OSS model as requested (default tier; model_router picks per call)
+        self.model = TIERS['large']
         # Embeddings: Groq does not expose this model for embeddings; using deterministic hash fallback
         self.embedding_model = "deterministic-hash-embedding"
+    
+    def _chat(self, task: str, size: int = 0, **kwargs):
+        """
+        Groq chat completion on the model and reasoning effort the router picks
+        for this task and input size (see model_router.TASK_POLICY)
+        """
+        return model_router.complete(
+            task, size,
+            lambda model, effort: groq_client.chat.completions.create(model=model, reasoning_effort=effort, **kwargs)
+        )
         
+    @timed('ai.process_with_ai')
     def process_with_ai(self, text: str, task: str = "general") -> Dict:
         """
         Main AI processing function
@@ -196,8 +324,8 @@ class AIService:
             
             prompt = prompts.get(task, prompts['general'])
             
-            response = groq_client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'general', len(text),
                 messages=[
                     {"role": "system", "content": "You are a helpful educational AI assistant."},
                     {"role": "user", "content": prompt}
@@ -205,7 +333,6 @@ class AIService:
                 temperature=0.7,
                 max_completion_tokens=800,
                 top_p=1,
-                reasoning_effort="medium",
                 stream=False
             )
             content = response.choices[0].message.content
@@ -221,10 +348,9 @@ class AIService:
                 'status': 'failed'
             }
     
-    def generate_quiz(self, content: str, num_questions: int = 5) -> Dict:
-        """Generate quiz questions from content"""
-        try:
-            prompt = f"""Generate exactly {num_questions} multiple-choice quiz questions from this content.
+    def _quiz_messages(self, content: str, num_questions: int) -> List[Dict]:
+        """Chat messages asking for a JSON array of multiple-choice questions"""
+        prompt = f"""Generate exactly {num_questions} multiple-choice quiz questions from this content.
 
             Return ONLY a valid JSON array with this exact format:
             [
@@ -244,19 +370,54 @@ class AIService:
             Content: {content}
             
             IMPORTANT: Return ONLY the JSON array, no other text."""
-            
+        
+        return [
+            {"role": "system", "content": "You are an expert quiz generator. Always respond with valid JSON only."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _map_reduce_items(self, task: str, content: str, num_items: int,
+                          generate: Callable[[str, int], Dict], field: str, count_field: str,
+                          key: Callable[[Dict], str]) -> Dict:
+        """
+        Generate items (questions, cards) for long content section by section
+        
+        Each section is asked for its share of num_items (plus some slack) in
+        parallel; the lists are interleaved so every part of the document is
+        represented, and duplicates across sections are dropped.
+        """
+        sections = pick_sections(split_sections(content), min(num_items, MAP_MAX_SECTIONS))
+        per_section = quota(num_items, len(sections))
+        results = run_sections(task, lambda section: generate(section, per_section), sections)
+        
+        lists = [r[field] for r in results if r.get('status') == 'success' and isinstance(r.get(field), list)]
+        if not lists:
+            failed = next((r for r in results if r.get('status') != 'success'), None)
+            return failed or {'status': 'failed', 'error': f'No section returned parseable {field}'}
+        
+        items = merge_items(lists, key, num_items)
+        return {
+            'status': 'success',
+            field: items,
+            count_field: len(items),
+            'sections': len(sections)
+        }
+    
+    @timed('ai.generate_quiz')
+    def generate_quiz(self, content: str, num_questions: int = 5) -> Dict:
+        """Generate quiz questions from content (long content is map-reduced over sections)"""
+        if len(content) > MAP_REDUCE_THRESHOLD:
+            return self._map_reduce_items('quiz', content, num_questions, self.generate_quiz,
+                                          'quiz', 'num_questions', key=lambda q: q.get('question'))
+        try:
             if not GROQ_AVAILABLE or groq_client is None:
                 return {'status': 'failed', 'error': 'Groq client unavailable'}
-            response = groq_client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert quiz generator. Always respond with valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
+            response = self._chat(
+                'quiz', len(content),
+                messages=self._quiz_messages(content, num_questions),
                 temperature=0.7,
                 max_completion_tokens=1200,
                 top_p=1,
-                reasoning_effort="medium",
                 stream=False
             )
             
@@ -288,10 +449,9 @@ class AIService:
                 'error': str(e)
             }
     
-    def create_flashcards(self, content: str, num_cards: int = 5) -> Dict:
-        """Generate flashcards from content"""
-        try:
-            prompt = f"""Generate exactly {num_cards} flashcards from this educational content.
+    def _flashcard_messages(self, content: str, num_cards: int) -> List[Dict]:
+        """Chat messages asking for a JSON array of flashcards"""
+        prompt = f"""Generate exactly {num_cards} flashcards from this educational content.
 
             Return ONLY a valid JSON array with this exact format:
             [
@@ -306,19 +466,27 @@ class AIService:
             Content: {content}
             
             IMPORTANT: Return ONLY the JSON array, no other text."""
-            
+        
+        return [
+            {"role": "system", "content": "You are an expert flashcard creator. Always respond with valid JSON only."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    @timed('ai.create_flashcards')
+    def create_flashcards(self, content: str, num_cards: int = 5) -> Dict:
+        """Generate flashcards from content (long content is map-reduced over sections)"""
+        if len(content) > MAP_REDUCE_THRESHOLD:
+            return self._map_reduce_items('flashcards', content, num_cards, self.create_flashcards,
+                                          'flashcards', 'num_cards', key=lambda card: card.get('front'))
+        try:
             if not GROQ_AVAILABLE or groq_client is None:
                 return {'status': 'failed', 'error': 'Groq client unavailable'}
-            response = groq_client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert flashcard creator. Always respond with valid JSON only."},
-                    {"role": "user", "content": prompt}
-                ],
+            response = self._chat(
+                'flashcards', len(content),
+                messages=self._flashcard_messages(content, num_cards),
                 temperature=0.7,
                 max_completion_tokens=2000,
                 top_p=1,
-                reasoning_effort="medium",
                 stream=False
             )
             
@@ -350,6 +518,76 @@ class AIService:
                 'error': str(e)
             }
     
+    def _stream_json_array(self, kind: str, task: str, size: int, messages: List[Dict],
+                           max_tokens: int) -> Iterator[Dict]:
+        """
+        Stream a completion that should be a JSON array, parsing it as it arrives
+        
+        Yields {'type': kind, 'index': i, 'item': {...}} as soon as each array
+        element closes, then one {'type': 'done', ...} event. Elements completed
+        before a truncated or failed stream are still delivered.
+        """
+        if not GROQ_AVAILABLE or groq_client is None:
+            yield {'type': 'done', 'status': 'failed', 'error': 'Groq client unavailable', 'count': 0}
+            return
+        
+        started = time.perf_counter()
+        parser = JSONArrayStream()
+        count = 0
+        finish_reason = None
+        error = None
+        try:
+            # The span covers time to the first byte; generation continues below
+            stream = self._chat(
+                task, size,
+                messages=messages,
+                temperature=0.7,
+                max_completion_tokens=max_tokens,
+                top_p=1,
+                stream=True
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = getattr(choice, 'finish_reason', None) or finish_reason
+                fragment = getattr(choice.delta, 'content', None)
+                if not fragment:
+                    continue
+                for item in parser.feed(fragment):
+                    if count == 0:
+                        STREAM_FIRST_ITEM.observe(time.perf_counter() - started, kind=kind)
+                    STREAM_ITEMS.inc(kind=kind)
+                    yield {'type': kind, 'index': count, 'item': item}
+                    count += 1
+        except Exception as e:
+            error = str(e)
+        
+        done = {
+            'type': 'done',
+            'status': 'success' if count else 'failed',
+            'count': count,
+            # Cut off by the token limit, a dropped connection or an unclosed array
+            'truncated': finish_reason == 'length' or error is not None or not parser.closed
+        }
+        if error is not None:
+            done['error'] = error
+        elif not count:
+            done['error'] = 'No complete items in the response'
+            done['text'] = parser.text.strip()
+        yield done
+    
+    def stream_flashcards(self, content: str, num_cards: int = 5) -> Iterator[Dict]:
+        """Streaming create_flashcards: one 'flashcard' event per card, then 'done'"""
+        return self._stream_json_array('flashcard', 'flashcards_stream', len(content),
+                                       self._flashcard_messages(content, num_cards), 2000)
+    
+    def stream_quiz(self, content: str, num_questions: int = 5) -> Iterator[Dict]:
+        """Streaming generate_quiz: one 'question' event per question, then 'done'"""
+        return self._stream_json_array('question', 'quiz_stream', len(content),
+                                       self._quiz_messages(content, num_questions), 1200)
+    
+    @timed('ai.generate_wrong_answers')
     def generate_wrong_answers(self, question: str, correct_answer: str, context: str = "", num_distractors: int = 3) -> Dict:
         """Generate realistic wrong answers (distractors) for multiple choice questions"""
         try:
@@ -377,8 +615,8 @@ class AIService:
             if not GROQ_AVAILABLE or groq_client is None:
                 return {'status': 'failed', 'error': 'Groq client unavailable'}
             
-            response = groq_client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'distractors', len(question) + len(correct_answer) + len(context),
                 messages=[
                     {"role": "system", "content": "You are an expert educator creating challenging multiple choice questions. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
@@ -386,7 +624,6 @@ class AIService:
                 temperature=0.8,
                 max_completion_tokens=500,
                 top_p=1,
-                reasoning_effort="medium",
                 stream=False
             )
             
@@ -425,8 +662,11 @@ class AIService:
                 'error': str(e)
             }
     
+    @timed('ai.analyze_difficulty')
     def analyze_difficulty(self, content: str) -> Dict:
-        """Analyze content difficulty level"""
+        """Analyze content difficulty level (long content is map-reduced over sections)"""
+        if len(content) > MAP_REDUCE_THRESHOLD:
+            return self._analyze_sections(content)
         try:
             prompt = f"""Analyze this educational content and return ONLY a JSON object with this format:
             {{
@@ -443,8 +683,8 @@ class AIService:
             
             if not GROQ_AVAILABLE or groq_client is None:
                 return {'status': 'failed', 'error': 'Groq client unavailable'}
-            response = groq_client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'analyze', len(content),
                 messages=[
                     {"role": "system", "content": "You are an educational content analyst. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
@@ -452,7 +692,6 @@ class AIService:
                 temperature=0.5,
                 max_completion_tokens=600,
                 top_p=1,
-                reasoning_effort="medium",
                 stream=False
             )
             
@@ -480,7 +719,73 @@ class AIService:
                 'error': str(e)
             }
     
-    def process_document_for_rag(self, content: str, filename: str, user_id: str) -> Dict:
+    def _analyze_sections(self, content: str) -> Dict:
+        """
+        Analyze long content section by section and combine the results
+        
+        Difficulty is the length-weighted median of the sections' ratings, key
+        concepts are ranked by how many sections name them, and study time is
+        summed (scaled up when only a sample of the sections was analyzed).
+        """
+        all_sections = split_sections(content)
+        sections = pick_sections(all_sections, MAP_MAX_SECTIONS)
+        results = run_sections('analyze', self.analyze_difficulty, sections)
+        
+        analyzed = [
+            (section, r['analysis']) for section, r in zip(sections, results)
+            if r.get('status') == 'success' and isinstance(r.get('analysis'), dict)
+        ]
+        if not analyzed:
+            failed = next((r for r in results if r.get('status') != 'success'), None)
+            return failed or {'status': 'failed', 'error': 'No section returned a parseable analysis'}
+        
+        levels = ['beginner', 'intermediate', 'advanced']
+        weighted = sorted(
+            (levels.index(a['difficulty']) if a.get('difficulty') in levels else 1, len(section))
+            for section, a in analyzed
+        )
+        half, running, difficulty = sum(w for _, w in weighted) / 2, 0, 1
+        for level, weight in weighted:
+            running += weight
+            if running >= half:
+                difficulty = level
+                break
+        
+        concepts = Counter()
+        display = {}
+        for _, a in analyzed:
+            for concept in a.get('key_concepts') or []:
+                if isinstance(concept, str) and concept.strip():
+                    display.setdefault(concept.strip().lower(), concept.strip())
+                    concepts[concept.strip().lower()] += 1
+        
+        minutes = []
+        for _, a in analyzed:
+            match = re.search(r'\d+', str(a.get('estimated_study_time', '')))
+            if match:
+                minutes.append(int(match.group()))
+        analyzed_chars = sum(len(section) for section, _ in analyzed)
+        total_chars = sum(len(section) for section in all_sections)
+        study_time = round(sum(minutes) * total_chars / analyzed_chars) if minutes else None
+        
+        reading_levels = Counter(a.get('reading_level') for _, a in analyzed if a.get('reading_level'))
+        reasoning = next(
+            (a.get('reasoning') for _, a in analyzed if a.get('difficulty') == levels[difficulty]), None
+        )
+        return {
+            'status': 'success',
+            'analysis': {
+                'difficulty': levels[difficulty],
+                'reading_level': reading_levels.most_common(1)[0][0] if reading_levels else None,
+                'key_concepts': [display[c] for c, _ in concepts.most_common(8)],
+                'estimated_study_time': str(study_time) if study_time is not None else None,
+                'reasoning': f"Combined from {len(analyzed)} sections. {reasoning or ''}".strip()
+            },
+            'sections': len(sections)
+        }
+    
+    @timed('ai.process_document_for_rag')
+    def process_document_for_rag(self, content: str, filename: str, user_id: str, replace: bool = False) -> Dict:
         """
         Process document for RAG: chunk, embed, and store in vector DB
         
@@ -488,50 +793,58 @@ class AIService:
             content: Document text content
             filename: Name of the document
             user_id: User identifier
+            replace: Tombstone earlier uploads with the same filename first
             
         Returns:
             Dict with processing results
         """
-        try:
-            # Initialize user's vector store if not exists
-            if user_id not in vector_store:
-                vector_store[user_id] = {
-                    'documents': [],
-                    'embeddings': [],
-                    'metadata': []
-                }
-            
-            # Chunk the document
-            chunks = chunk_text(content, chunk_size=500, overlap=50)
-            
-            print(f"📄 Processing document: {filename}")
-            print(f"📦 Created {len(chunks)} chunks")
+        print(f"📄 Processing document: {filename}")
+        return self._ingest(text_pages(content), filename, user_id, replace)
+    
+    @timed('ai.process_pdf_for_rag')
+    def process_pdf_for_rag(self, stream: BinaryIO, filename: str, user_id: str, replace: bool = False,
+                            progress: Optional[ProgressFn] = None) -> Dict:
+        """
+        Parse a PDF from a seekable binary stream into the vector DB, page by page
+        
+        Args:
+            stream: Binary file object; read from the start
+            filename: Name of the document
+            user_id: User identifier
+            replace: Tombstone earlier uploads with the same filename first
+            progress: Optional callback(stage, fraction) for background jobs
             
-            # Generate embeddings for each chunk
+        Returns:
+            Dict with processing results (plus pages_processed and total_characters)
+        """
+        return self._ingest(pdf_pages(stream, progress), filename, user_id, replace, progress)
+    
+    def _ingest(self, pages, filename: str, user_id: str, replace: bool,
+                progress: Optional[ProgressFn] = None) -> Dict:
+        """Run the ingestion pipeline (see ingestion.py) into the user's vector store entry"""
+        try:
             doc_id = hashlib.md5(f"{user_id}_{filename}_{datetime.now()}".encode()).hexdigest()[:12]
+            target = _VectorStoreTarget(user_id, filename, doc_id, replace)
+            stats = ingest(pages, target, progress)
             
-            for idx, chunk in enumerate(chunks):
-                # Get embedding
-                embedding = get_embedding(chunk)
-                
-                # Store in vector database
-                vector_store[user_id]['documents'].append(chunk)
-                vector_store[user_id]['embeddings'].append(embedding)
-                vector_store[user_id]['metadata'].append({
-                    'doc_id': doc_id,
-                    'filename': filename,
-                    'chunk_index': idx,
-                    'total_chunks': len(chunks),
-                    'timestamp': datetime.now().isoformat()
-                })
+            query_cache.bump('vector_store', user_id)
+            if target.replaced:
+                _schedule_compaction(user_id)
+            
+            total_documents = len(vector_store.live_documents(user_id))
+            print(f"📦 Stored {stats['chunks']} chunks ({stats['duplicates_dropped']} near-duplicates dropped)")
             
             return {
                 'status': 'success',
                 'doc_id': doc_id,
                 'filename': filename,
-                'chunks_processed': len(chunks),
-                'total_documents': len(set(m['doc_id'] for m in vector_store[user_id]['metadata'])),
-                'message': f'Successfully processed {filename} into {len(chunks)} chunks'
+                'chunks_processed': stats['chunks'],
+                'duplicates_dropped': stats['duplicates_dropped'],
+                'pages_processed': stats['pages'],
+                'total_characters': stats['characters'],
+                'total_documents': total_documents,
+                'replaced_doc_ids': sorted(target.replaced),
+                'message': f"Successfully processed {filename} into {stats['chunks']} chunks"
             }
             
         except Exception as e:
@@ -540,6 +853,40 @@ class AIService:
                 'error': str(e)
             }
     
+    @timed('ai.delete_document')
+    def delete_document(self, user_id: str, doc_id: Optional[str] = None, filename: Optional[str] = None) -> Dict:
+        """
+        Logically delete documents by doc_id and/or filename
+        
+        Matching documents are tombstoned immediately so searches skip them;
+        their chunks are physically removed by background compaction.
+        
+        Args:
+            user_id: User identifier
+            doc_id: Document id returned at upload time
+            filename: Delete every document uploaded under this filename
+            
+        Returns:
+            Dict with the tombstoned doc_ids
+        """
+        if doc_id is None and filename is None:
+            return {'status': 'failed', 'error': 'doc_id or filename is required'}
+        
+        try:
+            matched, chunks = vector_store.tombstone(user_id, doc_id, filename)
+        except Exception as e:
+            return {'status': 'failed', 'error': str(e)}
+        if matched:
+            query_cache.bump('vector_store', user_id)
+            _schedule_compaction(user_id)
+        
+        return {
+            'status': 'success',
+            'deleted_doc_ids': sorted(matched),
+            'chunks_deleted': chunks
+        }
+    
+    @timed('ai.query_rag_system')
     def query_rag_system(self, query: str, user_id: str, top_k: int = 3) -> Dict:
         """
         Query the RAG system to get context-aware answers
@@ -553,8 +900,15 @@ class AIService:
             Dict with answer and sources
         """
         try:
+            # Same question against an unchanged collection: reuse the answer
+            cache_key = query_cache.key('vector_store', 'answer', user_id, query, top_k)
+            cached = query_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
             # Check if user has any documents
-            if user_id not in vector_store or not vector_store[user_id]['documents']:
+            user_data = vector_store.get(user_id)
+            if not user_data or not any(_is_live(user_data, m) for m in user_data['metadata']):
                 return {
                     'status': 'failed',
                     'error': 'No documents found. Please upload documents first using /api/rag/upload'
@@ -588,8 +942,8 @@ class AIService:
             
             if not GROQ_AVAILABLE or groq_client is None:
                 return {'status': 'failed', 'error': 'Groq client unavailable'}
-            response = groq_client.chat.completions.create(
-                model=self.model,
+            response = self._chat(
+                'rag_answer', len(context),
                 messages=[
                     {"role": "system", "content": "You are a helpful AI assistant that answers questions based on provided context. Always cite your sources."},
                     {"role": "user", "content": prompt}
@@ -597,7 +951,6 @@ class AIService:
                 temperature=0.7,
                 max_completion_tokens=700,
                 top_p=1,
-                reasoning_effort="medium",
                 stream=False
             )
             answer = response.choices[0].message.content
@@ -613,13 +966,15 @@ class AIService:
                 for chunk in relevant_chunks
             ]
             
-            return {
+            result = {
                 'status': 'success',
                 'answer': answer,
                 'sources': sources,
                 'num_sources': len(sources),
                 'query': query
             }
+            query_cache.put(cache_key, result)
+            return result
             
         except Exception as e:
             return {
@@ -643,13 +998,44 @@ def generate_flashcards(content: str, num_cards: int = 5) -> Dict:
     """Generate flashcards wrapper"""
     return ai_service.create_flashcards(content, num_cards)
 
+def stream_quiz(content: str, num_questions: int = 5) -> Iterator[Dict]:
+    """Stream quiz questions wrapper"""
+    return ai_service.stream_quiz(content, num_questions)
+
+def stream_flashcards(content: str, num_cards: int = 5) -> Iterator[Dict]:
+    """Stream flashcards wrapper"""
+    return ai_service.stream_flashcards(content, num_cards)
+
 def analyze_difficulty(content: str) -> Dict:
     """Analyze content difficulty wrapper"""
     return ai_service.analyze_difficulty(content)
 
-def process_document_for_rag(content: str, filename: str, user_id: str) -> Dict:
+def process_document_for_rag(content: str, filename: str, user_id: str, replace: bool = False) -> Dict:
     """Process document for RAG wrapper"""
-    return ai_service.process_document_for_rag(content, filename, user_id)
+    return ai_service.process_document_for_rag(content, filename, user_id, replace)
+
+def process_pdf_for_rag(stream: BinaryIO, filename: str, user_id: str, replace: bool = False,
+                        progress: Optional[ProgressFn] = None) -> Dict:
+    """Process PDF for RAG wrapper"""
+    return ai_service.process_pdf_for_rag(stream, filename, user_id, replace, progress)
+
+def delete_rag_document(user_id: str, doc_id: Optional[str] = None, filename: Optional[str] = None) -> Dict:
+    """Delete RAG document wrapper"""
+    return ai_service.delete_document(user_id, doc_id, filename)
+
+def compact_vector_store(user_id: str) -> int:
+    """
+    Physically drop tombstoned chunks from a user's in-memory store
+    
+    Returns:
+        Number of chunks reclaimed
+    """
+    # Searches in flight keep the view they already hold
+    return vector_store.compact(user_id)
+
+def complete(task: str, messages: List[Dict], size: int = 0, **kwargs):
+    """Routed Groq chat completion wrapper (returns the raw response)"""
+    return ai_service._chat(task, size, messages=messages, **kwargs)
 
 def query_rag_system(query: str, user_id: str, top_k: int = 3) -> Dict:
     """Query RAG system wrapper"""
@@ -657,7 +1043,8 @@ def query_rag_system(query: str, user_id: str, top_k: int = 3) -> Dict:
 
 def get_rag_stats(user_id: str) -> Dict:
     """Get RAG system statistics for a user"""
-    if user_id not in vector_store:
+    user_data = vector_store.get(user_id)
+    if user_data is None:
         return {
             'status': 'success',
             'total_documents': 0,
@@ -665,17 +1052,21 @@ def get_rag_stats(user_id: str) -> Dict:
             'documents': []
         }
     
-    user_data = vector_store[user_id]
     
     # Get unique documents
     doc_ids = set()
     documents = {}
     
+    total_chunks = 0
     for metadata in user_data['metadata']:
+        if not _is_live(user_data, metadata):
+            continue
+        total_chunks += 1
         doc_id = metadata['doc_id']
         if doc_id not in doc_ids:
             doc_ids.add(doc_id)
             documents[doc_id] = {
+                'doc_id': doc_id,
                 'filename': metadata['filename'],
                 'chunks': 0,
                 'uploaded': metadata['timestamp']
@@ -685,7 +1076,7 @@ def get_rag_stats(user_id: str) -> Dict:
     return {
         'status': 'success',
         'total_documents': len(doc_ids),
-        'total_chunks': len(user_data['documents']),
+        'total_chunks': total_chunks,
         'documents': list(documents.values())
     }
 
@@ -0,0 +1,254 @@
+"""
+analytics.py
+Activity rollups for advanced analytics, maintained incrementally from the XP ledger
+Each user, and the whole platform, has one row of fixed-size integer arrays (XP
+per day, flashcards / quizzes / documents per week, active users per day, streak
+state) packed into a BLOB. Ledger flushes fold their events into these rows in
+the same transaction, so a report is one primary-key read and never touches
+the raw events or user records.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from metrics import registry
+from shared_state import transaction
+from user_store import UserStore
+
+# Window kept per daily and per weekly series
+ROLLUP_DAYS = int(os.getenv('ROLLUP_DAYS', '90'))
+ROLLUP_WEEKS = int(os.getenv('ROLLUP_WEEKS', '52'))
+
+GLOBAL_SCOPE = 'global'
+EPOCH = date(1970, 1, 1)
+
+
+class Series(NamedTuple):
+    name: str
+    kind: Optional[str]  # ledger kind summed into the series (None: first activity of a user per day)
+    bucket_days: int     # 1 = daily, 7 = weekly (weeks start on Monday)
+    slots: int
+
+
+USER_SERIES = (
+    Series('xp_per_day', 'xp', 1, ROLLUP_DAYS),
+    Series('flashcards_per_week', 'flashcards_reviewed', 7, ROLLUP_WEEKS),
+    Series('quizzes_per_week', 'quizzes_completed', 7, ROLLUP_WEEKS),
+    Series('documents_per_week', 'documents_processed', 7, ROLLUP_WEEKS),
+)
+GLOBAL_SERIES = USER_SERIES + (Series('active_users_per_day', None, 1, ROLLUP_DAYS),)
+
+# Header slots: streak state of the scope (for the global scope, days with any activity)
+LAST_ACTIVE_DAY, CURRENT_STREAK, LONGEST_STREAK, ACTIVE_DAYS = range(4)
+HEADER_SIZE = 4
+
+ROLLUP_UPDATES = registry.counter('app_rollup_updates_total', 'Rollup rows rewritten by ledger flushes')
+ROLLUP_RESETS = registry.counter('app_rollup_resets_total', 'Rollup rows discarded because their layout changed')
+
+
+def user_scope(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+def day_number(timestamp: float) -> int:
+    """Days since the Unix epoch (UTC)"""
+    return int(timestamp // 86400)
+
+
+def bucket_of(day: int, bucket_days: int) -> int:
+    # 1970-01-01 was a Thursday; shift by 3 so weekly buckets start on Monday
+    return day if bucket_days == 1 else (day + 3) // 7
+
+
+def bucket_start(bucket: int, bucket_days: int) -> date:
+    day = bucket if bucket_days == 1 else bucket * 7 - 3
+    return EPOCH + timedelta(days=day)
+
+
+class Rollup:
+    """
+    One scope's arrays in a single array('q') (64-bit, so sums can't overflow):
+    [header][last bucket of each series][slots of series 0][slots of series 1]...
+    Slot slots-1 of a series holds its last bucket, older buckets sit to its left.
+    """
+
+    def __init__(self, series: Tuple[Series, ...], data: Optional[bytes] = None):
+        self.series = series
+        self.size = HEADER_SIZE + len(series) + sum(s.slots for s in series)
+        self.ints = array('q')
+        if data and len(data) == self.ints.itemsize * self.size:
+            self.ints.frombytes(data)
+        elif data and len(data) == 4 * self.size:
+            # Written as 32-bit integers by older versions
+            self.ints = array('q', array('i', data))
+        else:
+            if data:
+                ROLLUP_RESETS.inc()  # ROLLUP_DAYS / ROLLUP_WEEKS changed since it was written
+            self.ints = array('q', [0]) * self.size
+        self.offsets = []
+        offset = HEADER_SIZE + len(series)
+        for s in series:
+            self.offsets.append(offset)
+            offset += s.slots
+
+    def to_bytes(self) -> bytes:
+        return self.ints.tobytes()
+
+    def add(self, index: int, day: int, amount: int) -> None:
+        s = self.series[index]
+        bucket = bucket_of(day, s.bucket_days)
+        end_slot = HEADER_SIZE + index
+        start = self.offsets[index]
+        end = self.ints[end_slot]
+        if bucket > end:
+            # Slide the window forward, zero-filling the new buckets
+            shift = min(bucket - end, s.slots)
+            self.ints[start:start + s.slots] = (
+                self.ints[start + shift:start + s.slots] + array('q', [0]) * shift
+            )
+            self.ints[end_slot] = end = bucket
+        age = end - bucket
+        if age < s.slots:
+            self.ints[start + s.slots - 1 - age] += amount
+
+    def window(self, index: int, today: int, count: int) -> List[Dict]:
+        """The last count buckets up to today, oldest first"""
+        s = self.series[index]
+        current = bucket_of(today, s.bucket_days)
+        end = self.ints[HEADER_SIZE + index]
+        start = self.offsets[index]
+        points = []
+        for bucket in range(current - min(count, s.slots) + 1, current + 1):
+            age = end - bucket
+            value = self.ints[start + s.slots - 1 - age] if 0 <= age < s.slots else 0
+            points.append({'start': bucket_start(bucket, s.bucket_days).isoformat(), 'value': value})
+        return points
+
+    def touch(self, day: int) -> bool:
+        """Record activity on a day; True if it is the scope's first activity that day"""
+        last = self.ints[LAST_ACTIVE_DAY]
+        if day <= last:
+            # Same day, or an older event flushed late by another worker
+            return False
+        self.ints[CURRENT_STREAK] = self.ints[CURRENT_STREAK] + 1 if day == last + 1 else 1
+        self.ints[LONGEST_STREAK] = max(self.ints[LONGEST_STREAK], self.ints[CURRENT_STREAK])
+        self.ints[ACTIVE_DAYS] += 1
+        self.ints[LAST_ACTIVE_DAY] = day
+        return True
+
+    def streak(self, today: int) -> Dict:
+        last = self.ints[LAST_ACTIVE_DAY]
+        return {
+            # A streak survives until the end of the day after the last activity
+            'current': self.ints[CURRENT_STREAK] if last >= today - 1 else 0,
+            'longest': self.ints[LONGEST_STREAK],
+            'active_days': self.ints[ACTIVE_DAYS],
+            'last_active': (EPOCH + timedelta(days=last)).isoformat() if last else None
+        }
+
+
+class ActivityRollups:
+    """Reads and incremental updates of the activity_rollups table (in users.db, next to the ledger)"""
+
+    def __init__(self, store: Optional[UserStore] = None):
+        self.store = store or UserStore()
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = self.store.conn
+        if not getattr(self._local, 'ready', False):
+            self.create_table(conn)
+            self._local.ready = True
+        return conn
+
+    @staticmethod
+    def create_table(conn: sqlite3.Connection) -> None:
+        """Create the table if missing; call outside a transaction, where a rollback can't undo it"""
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS activity_rollups (
+                scope TEXT PRIMARY KEY,
+                data BLOB NOT NULL
+            )"""
+        )
+
+    def apply(self, conn: sqlite3.Connection, events: Iterable[Tuple]) -> None:
+        """
+        Fold ledger events (user_id, kind, amount, source, created_at) into the rollups
+        Call inside the transaction that writes the events, once create_table() has run.
+        """
+        events = sorted(events, key=lambda event: event[4])
+        if not events:
+            return
+        scopes = {user_scope(event[0]) for event in events} | {GLOBAL_SCOPE}
+        placeholders = ', '.join('?' * len(scopes))
+        stored = dict(conn.execute(
+            f"SELECT scope, data FROM activity_rollups WHERE scope IN ({placeholders})", tuple(scopes)
+        ).fetchall())
+        rollups = {
+            scope: Rollup(GLOBAL_SERIES if scope == GLOBAL_SCOPE else USER_SERIES, stored.get(scope))
+            for scope in scopes
+        }
+
+        platform = rollups[GLOBAL_SCOPE]
+        active_index = len(GLOBAL_SERIES) - 1
+        for user_id, kind, amount, _, created_at in events:
+            day = day_number(created_at)
+            rollup = rollups[user_scope(user_id)]
+            if rollup.touch(day):
+                platform.add(active_index, day, 1)
+            platform.touch(day)
+            for index, s in enumerate(USER_SERIES):
+                if s.kind == kind:
+                    rollup.add(index, day, amount)
+                    platform.add(index, day, amount)
+
+        conn.executemany(
+            """INSERT INTO activity_rollups (scope, data) VALUES (?, ?)
+               ON CONFLICT (scope) DO UPDATE SET data = excluded.data""",
+            [(scope, rollup.to_bytes()) for scope, rollup in rollups.items()]
+        )
+        ROLLUP_UPDATES.inc(len(rollups))
+
+    def backfill(self, batch_size: int = 500) -> int:
+        """Build the rollups from the ledger once, when the table is still empty"""
+        conn = self._conn()
+        with transaction(conn):
+            if conn.execute("SELECT 1 FROM activity_rollups LIMIT 1").fetchone():
+                return 0
+            applied = 0
+            last_seq = 0
+            while True:
+                rows = conn.execute(
+                    """SELECT seq, user_id, kind, amount, source, created_at FROM xp_events
+                       WHERE seq > ? ORDER BY seq LIMIT ?""",
+                    (last_seq, batch_size)
+                ).fetchall()
+                if not rows:
+                    return applied
+                self.apply(conn, [row[1:] for row in rows])
+                applied += len(rows)
+                last_seq = rows[-1][0]
+
+    def report(self, scope: str, days: int = 30, weeks: int = 12, now: Optional[float] = None) -> Optional[Dict]:
+        """Series and streak of a scope (user_scope(user_id) or GLOBAL_SCOPE), or None if it has no activity yet"""
+        row = self._conn().execute("SELECT data FROM activity_rollups WHERE scope = ?", (scope,)).fetchone()
+        if row is None:
+            return None
+        series = GLOBAL_SERIES if scope == GLOBAL_SCOPE else USER_SERIES
+        rollup = Rollup(series, row[0])
+        today = day_number(now if now is not None else time.time())
+        report = {
+            s.name: rollup.window(index, today, days if s.bucket_days == 1 else weeks)
+            for index, s in enumerate(series)
+        }
+        report['streak'] = rollup.streak(today)
+        return report
+
+
+# Global instance
+activity_rollups = ActivityRollups()
@@ -4,19 +4,35 @@ Main Flask application for CS Girlies Hackathon project
 Backend API with AI integration, RAG, Flashcards, and XP System
 """
 
-from flask import Flask, request, jsonify
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Request, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 import json
 from datetime import datetime
-from rag_service import rag_service
+import contextvars
+import importlib.util
+import io
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
 
+# Uploads stay in memory up to this size and only spill to a temp file past it
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv('UPLOAD_SPOOL_MAX_BYTES', str(8 * 1024 * 1024)))
+
+class SpooledRequest(Request):
+    """Request whose file uploads are buffered in a SpooledTemporaryFile sized by UPLOAD_SPOOL_MAX_BYTES"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, mode='rb+')
+
 app = Flask(__name__)
+app.request_class = SpooledRequest
 CORS(app)  # Enable CORS for frontend communication
 
 # Configuration
@@ -24,18 +40,57 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Import services
-from ai_service import (
-    process_with_ai,
-    generate_flashcards,
-    generate_quiz,
-    analyze_difficulty,
-    process_document_for_rag,
-    query_rag_system,
-    get_rag_stats,
-    generate_wrong_answers
-)
-from user_service import user_service
+# Import services (lazy proxies; each subsystem initializes on first use)
+from services import ai, rag_service, user_service, startup_report, warmup, warmup_in_background
+
+# Warm subsystems in the background so the first request does not pay for it
+if os.getenv('WARMUP_ON_START', 'false').lower() == 'true':
+    warmup_in_background()
+
+# Request metrics (Prometheus text at /metrics; optional Server-Timing breakdown per response)
+from metrics import REQUEST_DURATION, REQUESTS_TOTAL, registry, server_timing_header, span, start_request
+from profiler import profiler
+from jobs import job_queue
+from query_cache import query_cache
+from model_router import model_router
+from rate_limit import admission
+from http_cache import conditional_response, encode_json
+from leaderboard import leaderboard_snapshot
+from analytics import ROLLUP_DAYS, ROLLUP_WEEKS
+from lru_cache import LRUCache
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+
+def pdf_available():
+    """Whether pypdf (or PyPDF2) is installed, checked without importing it so startup stays lazy"""
+    return any(importlib.util.find_spec(name) is not None for name in ('pypdf', 'PyPDF2'))
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    start_request()
+    g.profile = profiler.begin(_route_label())
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    profiler.end(g.pop('profile', None), _route_label(), request.method)
+    labels = {
+        'method': request.method,
+        'route': _route_label(),
+        'status': str(response.status_code)
+    }
+    REQUEST_DURATION.observe(elapsed, **labels)
+    REQUESTS_TOTAL.inc(**labels)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = server_timing_header(elapsed)
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
 
 # XP System Configuration
 XP_CONFIG = {
@@ -46,6 +101,8 @@ XP_CONFIG = {
     'document_upload': 25,
     'daily_login': 20
 }
+# Largest client-supplied bonus accepted by /api/xp/award (larger ones are capped)
+MAX_XP_BONUS = int(os.getenv('MAX_XP_BONUS', '50'))
 
 LEVEL_THRESHOLDS = [0, 100, 250, 500, 1000, 2000, 3500, 5500, 8000, 12000, 17000]
 
@@ -71,7 +128,8 @@ def award_xp(user_id, activity_type, bonus=0):
     new_level = calculate_level(new_xp)
     
     # Update XP
-    user_service.add_xp(user_id, xp_earned)
+    with span('user_store_upsert'):
+        user_service.add_xp(user_id, xp_earned, activity_type)
     user = user_service.get_user(user_id)  # Refresh
     
     level_up = new_level > old_level
@@ -85,10 +143,11 @@ def award_xp(user_id, activity_type, bonus=0):
         if new_level >= 5 and 'advanced_analytics' not in unlocked_features:
             unlocked_features.append('advanced_analytics')
         
-        user_service.update_user(user_id, {
-            'level': new_level,
-            'unlocked_features': unlocked_features
-        })
+        with span('user_store_upsert'):
+            user_service.update_user(user_id, {
+                'level': new_level,
+                'unlocked_features': unlocked_features
+            })
     
     return {
         'xp_earned': xp_earned,
@@ -111,7 +170,40 @@ def home():
                      '/api/rag/upload', '/api/rag/query', '/api/xp/award', '/api/user/progress']
     })
 
+@app.route('/api/startup', methods=['GET'])
+def startup():
+    """
+    Startup-time report per subsystem (does not initialize anything)
+    Returns: { "app_import_seconds": 0.12, "subsystems": {"rag": {"initialized": false, ...}, ...} }
+    """
+    return jsonify({
+        'status': 'success',
+        'app_import_seconds': round(APP_IMPORT_SECONDS, 4),
+        'subsystems': startup_report()
+    })
+
+@app.route('/api/startup/warmup', methods=['POST'])
+def warmup_endpoint():
+    """
+    Initialize subsystems now instead of on first use
+    Expects: { "services": ["ai", "rag", "users"] } (optional, default all)
+    Returns: { "subsystems": {...} }
+    """
+    data = request.get_json(silent=True) or {}
+    services = data.get('services')
+    if services is not None and (not isinstance(services, list) or not all(isinstance(name, str) for name in services)):
+        return jsonify({'status': 'failed', 'error': 'services must be a list of service names'}), 400
+    try:
+        subsystems = warmup(services)
+    except ValueError as e:
+        return jsonify({'status': 'failed', 'error': str(e)}), 400
+    return jsonify({
+        'status': 'success',
+        'subsystems': subsystems
+    })
+
 @app.route('/api/process', methods=['POST'])
+@admission.limit('generate')
 def process_text():
     """
     Main endpoint to process user input with AI
@@ -131,7 +223,7 @@ def process_text():
         user_id = data.get('user_id', 'default_user')
         
         # Process with AI
-        result = process_with_ai(user_text, task)
+        result = ai.process_with_ai(user_text, task)
         
         if result.get('status') == 'success':
             # Award XP for using the AI
@@ -146,12 +238,33 @@ def process_text():
             'status': 'failed'
         }), 500
 
+def _ndjson_response(events, reward):
+    """
+    Stream generator events as newline-delimited JSON, one object per line
+    reward(count) runs once, after the last item, and its result rides on the final 'done' event
+    """
+    def generate():
+        for event in events:
+            if event['type'] == 'done' and event['status'] == 'success':
+                event['xp_data'] = reward(event['count'])
+            yield json.dumps(event) + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        # Keep proxies (nginx) from buffering the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/flashcards/generate', methods=['POST'])
+@admission.limit('generate')
 def generate_flashcards_endpoint():
     """
     Generate flashcards from user input
-    Expects: { "content": "text to generate cards from", "num_cards": 5, "user_id": "user123" }
+    Expects: { "content": "text to generate cards from", "num_cards": 5, "user_id": "user123", "stream": false }
     Returns: { "flashcards": [...], "xp_data": {...} }
+    With "stream": true, returns NDJSON: {"type": "flashcard", "index": 0, "item": {...}} per card,
+    then {"type": "done", "status": "success", "count": 5, "truncated": false, "xp_data": {...}}
     """
     try:
         data = request.get_json()
@@ -170,9 +283,17 @@ def generate_flashcards_endpoint():
             return jsonify({
                 'error': 'num_cards must be between 1 and 20'
             }), 400
+        num_cards = int(num_cards)  # XP and stats are recorded as integers
+        
+        if data.get('stream'):
+            def reward(count):
+                xp_data = award_xp(user_id, 'flashcard_review', bonus=count * 2)
+                user_service.update_stats(user_id, 'flashcards_reviewed', count)
+                return xp_data
+            return _ndjson_response(ai.stream_flashcards(content, num_cards), reward)
         
         # Generate flashcards
-        result = generate_flashcards(content, num_cards)
+        result = ai.generate_flashcards(content, num_cards)
         
         if result.get('status') == 'success':
             # Award XP for generating flashcards
@@ -180,8 +301,7 @@ def generate_flashcards_endpoint():
             result['xp_data'] = xp_data
             
             # Update user stats
-            user = get_user_progress(user_id)
-            user['flashcards_reviewed'] += num_cards
+            user_service.update_stats(user_id, 'flashcards_reviewed', num_cards)
         
         return jsonify(result), 200
         
@@ -193,11 +313,14 @@ def generate_flashcards_endpoint():
 
 
 @app.route('/api/quiz/generate', methods=['POST'])
+@admission.limit('generate')
 def generate_quiz_endpoint():
     """
     Generate quiz questions from content
-    Expects: { "content": "text", "num_questions": 5, "user_id": "user123" }
+    Expects: { "content": "text", "num_questions": 5, "user_id": "user123", "stream": false }
     Returns: { "quiz": {...}, "xp_data": {...} }
+    With "stream": true, returns NDJSON: {"type": "question", "index": 0, "item": {...}} per question,
+    then {"type": "done", ...} as for flashcards
     """
     try:
         data = request.get_json()
@@ -217,16 +340,22 @@ def generate_quiz_endpoint():
                 'error': 'num_questions must be between 1 and 20'
             }), 400
         
+        if data.get('stream'):
+            def reward(count):
+                xp_data = award_xp(user_id, 'quiz_completion')
+                user_service.update_stats(user_id, 'quizzes_completed')
+                return xp_data
+            return _ndjson_response(ai.stream_quiz(content, num_questions), reward)
+        
         # Generate quiz
-        result = generate_quiz(content, num_questions)
+        result = ai.generate_quiz(content, num_questions)
         
         if result.get('status') == 'success':
             # Award XP
             xp_data = award_xp(user_id, 'quiz_completion')
             result['xp_data'] = xp_data
             
-            user = get_user_progress(user_id)
-            user['quizzes_completed'] += 1
+            user_service.update_stats(user_id, 'quizzes_completed')
         
         return jsonify(result), 200
         
@@ -237,6 +366,7 @@ def generate_quiz_endpoint():
         }), 500
 
 @app.route('/api/quiz/generate-distractors', methods=['POST'])
+@admission.limit('generate')
 def generate_distractors_endpoint():
     """
     Generate realistic wrong answers for a multiple choice question
@@ -268,7 +398,7 @@ def generate_distractors_endpoint():
             }), 400
         
         # Generate wrong answers
-        result = generate_wrong_answers(question, correct_answer, context, num_distractors)
+        result = ai.generate_wrong_answers(question, correct_answer, context, num_distractors)
         
         return jsonify(result), 200
         
@@ -279,6 +409,7 @@ def generate_distractors_endpoint():
         }), 500
 
 @app.route('/api/analyze', methods=['POST'])
+@admission.limit('generate')
 def analyze_content():
     """
     Endpoint for content analysis
@@ -296,7 +427,7 @@ def analyze_content():
         content = data['content']
         
         # Analyze content
-        result = analyze_difficulty(content)
+        result = ai.analyze_difficulty(content)
         
         return jsonify(result), 200
         
@@ -307,9 +438,59 @@ def analyze_content():
         }), 500
 
 
+def _job_accepted(job):
+    """202 response for an enqueued background job"""
+    return jsonify({
+        'status': 'queued',
+        'job_id': job['job_id'],
+        'status_url': f"/api/jobs/{job['job_id']}"
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll a background ingestion job
+    Returns: { "job": {"state": "queued|running|succeeded|failed", "stage": "indexing", "progress": 0.4, "result": {...}} }
+    """
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': f'Job not found: {job_id}', 'status': 'failed'}), 404
+        
+        return jsonify({'status': 'success', 'job': job}), 200
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """
+    Recent background jobs
+    Query params: ?user_id=user123&limit=20
+    Returns: { "jobs": [...] }
+    """
+    try:
+        user_id = request.args.get('user_id')
+        limit = int(request.args.get('limit', 20))
+        
+        return jsonify({'status': 'success', 'jobs': job_queue.recent(user_id, limit)}), 200
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
 @app.route('/api/rag/upload', methods=['POST'])
+@admission.limit('upload')
 def upload_document():
-    """Upload PDF using improved RAG system"""
+    """Upload PDF using improved RAG system (ingested in the background; poll the returned job)"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -323,35 +504,49 @@ def upload_document():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'error': 'Only PDF files supported'}), 400
         
-        # Save file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            file.save(tmp_file.name)
-            tmp_path = tmp_file.name
-        
-        # Process with improved RAG
-        result = rag_service.process_pdf(tmp_path, user_id)
-        
-        # Clean up temp file
-        os.unlink(tmp_path)
-        
-        if result['status'] == 'success':
-            # Award XP
-            xp_data = award_xp(user_id, 'document_upload', 
-                              bonus=result.get('chunks_processed', 0) * 2)
-            result['xp_data'] = xp_data
+        # Optional: replace an earlier upload by doc_id, or by filename with replace=true
+        replace_doc_id = request.form.get('replace_doc_id')
+        replace = request.form.get('replace', 'false').lower() == 'true'
+        
+        # Take ownership of the spooled upload buffer (no temp-file copy); Flask would
+        # otherwise close it when the request ends, before the ingestion job reads it
+        stream = file.stream
+        file.stream = io.BytesIO()
+        filename = file.filename
+        
+        def ingest(progress):
+            # Process with improved RAG, parsing straight from the buffer
+            try:
+                if replace_doc_id:
+                    result = rag_service.replace_document(stream, user_id, replace_doc_id,
+                                                          filename=filename, progress=progress)
+                else:
+                    result = rag_service.process_pdf_stream(stream, user_id, filename,
+                                                            replace=replace, progress=progress)
+            finally:
+                stream.close()
+            
+            if result['status'] == 'success':
+                # Award XP once the document is searchable
+                progress('awarding_xp', 0.95)
+                result['xp_data'] = award_xp(user_id, 'document_upload',
+                                             bonus=result.get('chunks_processed', 0) * 2)
+            return result
         
-        return jsonify(result), 200
+        job = job_queue.submit('rag_upload', user_id, ingest, filename=filename)
+        return _job_accepted(job)
         
     except Exception as e:
         return jsonify({'status': 'failed', 'error': str(e)}), 500
 
 
 @app.route('/api/rag/upload-pdf', methods=['POST'])
+@admission.limit('upload')
 def upload_pdf_from_path():
     """
     Load and process a PDF file from local path for RAG
     Expects: { "pdf_path": "C:\\path\\to\\file.pdf", "user_id": "user123" }
-    Returns: { "doc_id": "...", "chunks_processed": 10, "xp_data": {...} }
+    Returns: 202 { "job_id": "...", "status_url": "/api/jobs/..." }; the job result has doc_id, chunks_processed, xp_data
     """
     try:
         data = request.get_json()
@@ -363,6 +558,7 @@ def upload_pdf_from_path():
         
         pdf_path = data['pdf_path']
         user_id = data.get('user_id', 'default_user')
+        replace = bool(data.get('replace', False))
         
         # Check if file exists
         if not os.path.exists(pdf_path):
@@ -379,44 +575,30 @@ def upload_pdf_from_path():
                 'current_level': user['level']
             }), 403
         
-        # Try to extract text from PDF
-        try:
-            import PyPDF2
-            
-            with open(pdf_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                
-                # Extract text from all pages
-                text_content = ""
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text() or ""
-                    text_content += page_text + "\n\n"
-                
-                if not text_content.strip():
-                    return jsonify({
-                        'error': 'Could not extract text from PDF. The PDF might be image-based or encrypted.'
-                    }), 400
-                
-                filename = os.path.basename(pdf_path)
-                
-                # Process document for RAG
-                result = process_document_for_rag(text_content, filename, user_id)
-                
-                if result.get('status') == 'success':
-                    # Award XP for document upload
-                    xp_data = award_xp(user_id, 'document_upload', bonus=result.get('chunks_processed', 0) * 2)
-                    result['xp_data'] = xp_data
-                    result['pages_processed'] = len(pdf_reader.pages)
-                    
-                    user['documents_processed'] += 1
-                
-                return jsonify(result), 200
-                
-        except ImportError:
+        if not pdf_available():
             return jsonify({
-                'error': 'PyPDF2 not installed. Run: pip install PyPDF2',
+                'error': 'PDF support not installed. Run: pip install pypdf',
                 'suggestion': 'Or send PDF content as text using /api/rag/upload endpoint'
             }), 500
+        
+        filename = os.path.basename(pdf_path)
+        
+        def ingest(progress):
+            # Parsed, chunked, embedded and stored page by page by the ingestion pipeline
+            with open(pdf_path, 'rb') as pdf_file:
+                result = ai.process_pdf_for_rag(pdf_file, filename, user_id, replace=replace, progress=progress)
+            
+            if result.get('status') == 'success':
+                # Award XP for document upload
+                progress('awarding_xp', 0.95)
+                result['xp_data'] = award_xp(user_id, 'document_upload', bonus=result.get('chunks_processed', 0) * 2)
+                
+                user_service.update_stats(user_id, 'documents_processed')
+            
+            return result
+        
+        job = job_queue.submit('rag_upload_pdf', user_id, ingest, filename=filename)
+        return _job_accepted(job)
             
     except Exception as e:
         return jsonify({
@@ -426,6 +608,7 @@ def upload_pdf_from_path():
 
 
 @app.route('/api/rag/load-smol-training', methods=['POST'])
+@admission.limit('upload')
 def load_smol_training_pdf():
     """
     Load the specific Smol Training PDF for RAG
@@ -455,47 +638,29 @@ def load_smol_training_pdf():
                 'current_level': user['level']
             }), 403
         
-        # Try to extract text from PDF
-        try:
-            import PyPDF2
-            
-            with open(pdf_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                
-                # Extract text from all pages with simple page markers
-                text_content = ""
-                total_pages = len(pdf_reader.pages)
-                for i, page in enumerate(pdf_reader.pages, start=1):
-                    page_text = page.extract_text() or ""
-                    text_content += f"\n\n=== Page {i}/{total_pages} ===\n\n" + page_text
-                
-                if not text_content.strip():
-                    return jsonify({
-                        'error': 'Could not extract text from PDF. The PDF might be image-based or encrypted.'
-                    }), 400
-                
-                filename = os.path.basename(pdf_path)
-                
-                # Process document for RAG
-                result = process_document_for_rag(text_content, filename, user_id)
-                
-                if result.get('status') == 'success':
-                    # Award XP for document upload
-                    xp_data = award_xp(user_id, 'document_upload', bonus=result.get('chunks_processed', 0) * 2)
-                    result['xp_data'] = xp_data
-                    result['pages_processed'] = total_pages
-                    result['total_characters'] = len(text_content)
-                    result['document_name'] = 'Smol Training Playbook - Secrets to Building World-Class LLMs'
-                    
-                    user['documents_processed'] += 1
-                
-                return jsonify(result), 200
-                
-        except ImportError:
+        if not pdf_available():
             return jsonify({
-                'error': 'PyPDF2 not installed. Run: pip install PyPDF2',
-                'suggestion': 'Install with: pip install PyPDF2'
+                'error': 'PDF support not installed. Run: pip install pypdf',
+                'suggestion': 'Install with: pip install pypdf'
             }), 500
+        
+        filename = os.path.basename(pdf_path)
+        
+        # Process document for RAG through the ingestion pipeline (reloading replaces the previous copy)
+        with open(pdf_path, 'rb') as pdf_file:
+            result = ai.process_pdf_for_rag(pdf_file, filename, user_id, replace=True)
+        
+        if result.get('status') != 'success':
+            return jsonify(result), 400
+        
+        # Award XP for document upload
+        xp_data = award_xp(user_id, 'document_upload', bonus=result.get('chunks_processed', 0) * 2)
+        result['xp_data'] = xp_data
+        result['document_name'] = 'Smol Training Playbook - Secrets to Building World-Class LLMs'
+        
+        user_service.update_stats(user_id, 'documents_processed')
+        
+        return jsonify(result), 200
             
     except Exception as e:
         return jsonify({
@@ -504,7 +669,48 @@ def load_smol_training_pdf():
         }), 500
 
 
+# Upper bound on questions per batch request and on concurrent answer generations
+RAG_BATCH_MAX_QUERIES = int(os.getenv('RAG_BATCH_MAX_QUERIES', '32'))
+RAG_BATCH_CONCURRENCY = int(os.getenv('RAG_BATCH_CONCURRENCY', '4'))
+
+def _answer_rag_query(answer_key, query, result):
+    """Add a Groq answer to a successful retrieval result, cached under answer_key (taken before retrieval)"""
+    groq_client = ai.groq_client
+    if result['status'] != 'success' or result.get('answer') or not (ai.GROQ_AVAILABLE and groq_client):
+        return result
+    
+    prompt = f"""Answer this question based on the context below.
+                
+Context:
+{result['context']}
+
+Question: {query}
+
+Provide a clear answer and cite which parts of the context you used."""
+    
+    # Routed like every other completion (fast tier by default, see model_router.TASK_POLICY)
+    response = ai.complete(
+        'rag_query',
+        [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ],
+        size=len(prompt),
+        temperature=0.7,
+        max_completion_tokens=700
+    )
+    
+    result['answer'] = response.choices[0].message.content
+    query_cache.put(answer_key, result)
+    return result
+
+def _answer_key(user_id, query, top_k):
+    """Cache key of an answer for the collection's current generation"""
+    return query_cache.key('chroma', 'answer', user_id, query, top_k)
+
+
 @app.route('/api/rag/query', methods=['POST'])
+@admission.limit('query')
 def query_rag():
     """Query using improved RAG system"""
     try:
@@ -517,35 +723,14 @@ def query_rag():
         user_id = data.get('user_id', 'default_user')
         top_k = data.get('top_k', 3)
         
-        # Query improved RAG
-        result = rag_service.query(user_id, query, top_k)
+        # Query improved RAG, then use Groq to generate answer from context
+        # (same question against an unchanged collection: reuse results and answer)
+        answer_key = _answer_key(user_id, query, top_k)
+        result = query_cache.get(answer_key)
+        if result is None:
+            result = _answer_rag_query(answer_key, query, rag_service.query(user_id, query, top_k))
         
         if result['status'] == 'success':
-            # Use Groq to generate answer from context
-            from ai_service import groq_client, GROQ_AVAILABLE
-            
-            if GROQ_AVAILABLE and groq_client:
-                prompt = f"""Answer this question based on the context below.
-                
-Context:
-{result['context']}
-
-Question: {query}
-
-Provide a clear answer and cite which parts of the context you used."""
-                
-                response = groq_client.chat.completions.create(
-                    model="openai/gpt-oss-20b",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_completion_tokens=700
-                )
-                
-                result['answer'] = response.choices[0].message.content
-            
             # Award XP
             xp_data = award_xp(user_id, 'flashcard_review')
             result['xp_data'] = xp_data
@@ -556,6 +741,112 @@ Provide a clear answer and cite which parts of the context you used."""
         return jsonify({'status': 'failed', 'error': str(e)}), 500
 
 
+@app.route('/api/rag/query/batch', methods=['POST'])
+@admission.limit('query_batch')
+def query_rag_batch():
+    """
+    Answer several questions against the user's documents in one request
+    Expects: { "queries": ["What is X?", "Define Y"], "user_id": "user123", "top_k": 3 }
+    Returns: { "results": [{"query": "...", "status": "success", "answer": "...", "sources": [...]}, ...], "xp_data": {...} }
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+            return jsonify({'error': 'queries must be a non-empty list of strings'}), 400
+        if len(queries) > RAG_BATCH_MAX_QUERIES:
+            return jsonify({'error': f'At most {RAG_BATCH_MAX_QUERIES} queries per batch'}), 400
+        
+        user_id = data.get('user_id', 'default_user')
+        top_k = data.get('top_k', 3)
+        
+        # Cached answers first; remaining questions share one embedding call and one search
+        answer_keys = [_answer_key(user_id, query, top_k) for query in queries]
+        results = [query_cache.get(key) for key in answer_keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            retrieved = rag_service.query_batch(user_id, [queries[i] for i in misses], top_k)
+            
+            # Generate the answers concurrently (each task gets a copy of the request context for spans)
+            with ThreadPoolExecutor(max_workers=max(1, min(RAG_BATCH_CONCURRENCY, len(misses)))) as pool:
+                futures = {
+                    i: pool.submit(contextvars.copy_context().run, _answer_rag_query,
+                                   answer_keys[i], queries[i], result)
+                    for i, result in zip(misses, retrieved)
+                }
+                for i, future in futures.items():
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        results[i] = {'status': 'failed', 'error': str(e)}
+        
+        answered = sum(1 for result in results if result['status'] == 'success')
+        response = {
+            'status': 'success' if answered else 'failed',
+            'results': [{'query': query, **result} for query, result in zip(queries, results)],
+            'num_answered': answered
+        }
+        
+        if answered:
+            # Same XP as asking each answered question separately, in one write
+            response['xp_data'] = award_xp(user_id, 'flashcard_review',
+                                           bonus=XP_CONFIG['flashcard_review'] * (answered - 1))
+        
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'failed', 'error': str(e)}), 500
+
+
+@app.route('/api/rag/documents', methods=['DELETE'])
+def delete_document():
+    """
+    Delete uploaded documents by doc_id or filename from both RAG stores
+    Expects: { "user_id": "user123", "doc_id": "abc123" } or { "user_id": "user123", "filename": "notes.pdf" }
+    Returns: { "deleted_doc_ids": [...], "chunks_deleted": 12 }
+    """
+    try:
+        data = request.get_json(silent=True) or request.args
+        user_id = data.get('user_id', 'default_user')
+        doc_id = data.get('doc_id')
+        filename = data.get('filename')
+        
+        if not doc_id and not filename:
+            return jsonify({
+                'error': 'Missing doc_id or filename'
+            }), 400
+        
+        results = [
+            rag_service.delete_document(user_id, doc_id=doc_id, filename=filename),
+            ai.delete_rag_document(user_id, doc_id=doc_id, filename=filename)
+        ]
+        # One store being unavailable must not hide a delete that succeeded in the other
+        succeeded = [r for r in results if r['status'] == 'success']
+        failed = [r for r in results if r['status'] != 'success']
+        
+        deleted_doc_ids = sorted(set(d for r in succeeded for d in r['deleted_doc_ids']))
+        if not deleted_doc_ids:
+            if failed:
+                return jsonify(failed[0]), 500
+            return jsonify({
+                'status': 'failed',
+                'error': 'Document not found'
+            }), 404
+        
+        response = {
+            'status': 'success',
+            'deleted_doc_ids': deleted_doc_ids,
+            'chunks_deleted': sum(r['chunks_deleted'] for r in succeeded)
+        }
+        if failed:
+            response['warnings'] = [r['error'] for r in failed]
+        return jsonify(response), 200
+        
+    except Exception as e:
+        return jsonify({'status': 'failed', 'error': str(e)}), 500
+
+
 @app.route('/api/rag/stats', methods=['GET'])
 def rag_stats():
     """Get RAG stats using improved system"""
@@ -585,6 +876,12 @@ def award_xp_endpoint():
         activity_type = data['activity_type']
         bonus = data.get('bonus', 0)
         
+        if not isinstance(bonus, int) or isinstance(bonus, bool):
+            return jsonify({
+                'error': 'bonus must be an integer'
+            }), 400
+        bonus = min(max(bonus, 0), MAX_XP_BONUS)
+        
         if activity_type not in XP_CONFIG:
             return jsonify({
                 'error': f'Invalid activity_type. Valid options: {list(XP_CONFIG.keys())}'
@@ -604,12 +901,47 @@ def award_xp_endpoint():
         }), 500
 
 
+# Per-worker encoded progress responses: user_id -> (row version, EncodedJSON)
+progress_responses = LRUCache(capacity=int(os.getenv('PROGRESS_CACHE_CAPACITY', '5000')))
+
+def _progress_payload(user_id):
+    user = get_user_progress(user_id)
+    current_level = user['level']
+    # Convert 1-indexed level back to 0-indexed for threshold lookup
+    threshold_index = min(current_level - 1, len(LEVEL_THRESHOLDS) - 2)
+    next_threshold_index = min(current_level, len(LEVEL_THRESHOLDS) - 1)
+    current_threshold = LEVEL_THRESHOLDS[threshold_index]
+    next_level_xp = LEVEL_THRESHOLDS[next_threshold_index]
+    
+    # Calculate progress as percentage between current and next threshold
+    if next_level_xp > current_threshold:
+        progress = (user['xp'] - current_threshold) / (next_level_xp - current_threshold) * 100
+    else:
+        progress = 100
+    
+    return {
+        'status': 'success',
+        'user_id': user_id,
+        'xp': user['xp'],
+        'level': user['level'],
+        'next_level_xp': next_level_xp,
+        'progress_to_next_level': progress,
+        'flashcards_reviewed': user['flashcards_reviewed'],
+        'quizzes_completed': user['quizzes_completed'],
+        'documents_processed': user['documents_processed'],
+        'streak': user['streak'],
+        'last_activity': user['last_activity'],
+        'achievements': user['achievements'],
+        'unlocked_features': user['unlocked_features']
+    }
+
 @app.route('/api/user/progress', methods=['GET'])
 def get_progress():
     """
     Get user progress and stats
     Query params: ?user_id=user123
     Returns: { "xp": 150, "level": 2, "flashcards_reviewed": 25, ... }
+    Sends an ETag; a matching If-None-Match gets 304 Not Modified
     """
     try:
         user_id = request.args.get('user_id', 'default_user')
@@ -619,35 +951,17 @@ def get_progress():
                 'error': 'Missing user_id parameter'
             }), 400
         
-        user = get_user_progress(user_id)
-        current_level = user['level']
-        # Convert 1-indexed level back to 0-indexed for threshold lookup
-        threshold_index = min(current_level - 1, len(LEVEL_THRESHOLDS) - 2)
-        next_threshold_index = min(current_level, len(LEVEL_THRESHOLDS) - 1)
-        current_threshold = LEVEL_THRESHOLDS[threshold_index]
-        next_level_xp = LEVEL_THRESHOLDS[next_threshold_index]
-        
-        # Calculate progress as percentage between current and next threshold
-        if next_level_xp > current_threshold:
-            progress = (user['xp'] - current_threshold) / (next_level_xp - current_threshold) * 100
+        # Unchanged row since the last poll: reuse the encoded response (one indexed lookup)
+        version = user_service.version(user_id)
+        cached = progress_responses.get(user_id)
+        if cached is not None and version[0] and cached[0] == version:
+            encoded = cached[1]
         else:
-            progress = 100
+            encoded = encode_json(_progress_payload(user_id))
+            # The version read before building, so a write made meanwhile invalidates the entry
+            progress_responses.put(user_id, (version, encoded))
         
-        return jsonify({
-            'status': 'success',
-            'user_id': user_id,
-            'xp': user['xp'],
-            'level': user['level'],
-            'next_level_xp': next_level_xp,
-            'progress_to_next_level': progress,
-            'flashcards_reviewed': user['flashcards_reviewed'],
-            'quizzes_completed': user['quizzes_completed'],
-            'documents_processed': user['documents_processed'],
-            'streak': user['streak'],
-            'last_activity': user['last_activity'],
-            'achievements': user['achievements'],
-            'unlocked_features': user['unlocked_features']
-        }), 200
+        return conditional_response(encoded, '/api/user/progress')
         
     except Exception as e:
         return jsonify({
@@ -736,16 +1050,52 @@ def get_leaderboard():
     Get top users by XP
     Query params: ?limit=10
     Returns: { "leaderboard": [{"user_id": "...", "xp": 500, "level": 3}, ...] }
+    Served from a snapshot (see leaderboard.py) with an ETag; If-None-Match can get 304
     """
     try:
         limit = int(request.args.get('limit', 10))
         
-        # Get leaderboard from user service
-        leaderboard = user_service.get_leaderboard(limit)
+        return conditional_response(leaderboard_snapshot.get(limit), '/api/leaderboard')
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
+def _analytics_window():
+    days = max(1, min(int(request.args.get('days', 30)), ROLLUP_DAYS))
+    weeks = max(1, min(int(request.args.get('weeks', 12)), ROLLUP_WEEKS))
+    return days, weeks
+
+
+@app.route('/api/analytics', methods=['GET'])
+def get_analytics():
+    """
+    Advanced analytics of one user (unlocked at level 5)
+    Query params: ?user_id=user123&days=30&weeks=12
+    Returns: { "xp_per_day": [{"start": "2025-11-01", "value": 40}, ...], "flashcards_per_week": [...],
+               "quizzes_per_week": [...], "documents_per_week": [...], "streak": {...} }
+    Read from precomputed rollups (see analytics.py)
+    """
+    try:
+        user_id = request.args.get('user_id', 'default_user')
+        days, weeks = _analytics_window()
+        
+        user = get_user_progress(user_id)
+        if 'advanced_analytics' not in user.get('unlocked_features', []):
+            return jsonify({
+                'error': 'Advanced analytics unlock at level 5',
+                'status': 'failed'
+            }), 403
+        
+        report = user_service.analytics(user_id, days=days, weeks=weeks)
         
         return jsonify({
             'status': 'success',
-            'leaderboard': leaderboard
+            'user_id': user_id,
+            **(report or {})
         }), 200
         
     except Exception as e:
@@ -755,6 +1105,120 @@ def get_leaderboard():
         }), 500
 
 
+@app.route('/api/analytics/global', methods=['GET'])
+def get_global_analytics():
+    """
+    Platform-wide activity report
+    Query params: ?days=30&weeks=12
+    Returns: the /api/analytics series summed over all users, plus "active_users_per_day"
+    """
+    try:
+        days, weeks = _analytics_window()
+        report = user_service.analytics(days=days, weeks=weeks)
+        
+        return jsonify({
+            'status': 'success',
+            **(report or {})
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Get per-worker cache counters
+    Returns: { "user_cache": {"size": 120, "hits": 950, "misses": 50, "evictions": 0, ...}, "rag_cache": {...} }
+    """
+    try:
+        return jsonify({
+            'status': 'success',
+            'user_cache': user_service.cache_stats(),
+            'rag_cache': query_cache.stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
+@app.route('/api/models', methods=['GET'])
+def model_routing():
+    """
+    Model routing table and this worker's observed latency/error averages
+    Returns: { "tiers": {"large": "...", "fast": "..."}, "policies": {...}, "observed": [...] }
+    """
+    try:
+        return jsonify({'status': 'success', **model_router.stats()}), 200
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus scrape endpoint (per-worker request, span and error metrics)
+    Returns: text/plain exposition format
+    """
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/profiler', methods=['GET'])
+def profiler_status():
+    """
+    Current profiler settings and the most recent profiles
+    Query params: ?limit=20
+    Returns: { "settings": {...}, "profiles": [{"route": "api_leaderboard", "file": "..."}] }
+    """
+    try:
+        limit = int(request.args.get('limit', 20))
+        return jsonify({
+            'status': 'success',
+            'settings': profiler.settings(),
+            'profiles': profiler.list_profiles(limit)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
+@app.route('/api/profiler', methods=['POST'])
+def configure_profiler():
+    """
+    Turn request profiling on/off or retune it for all workers without a restart
+    Expects: { "enabled": true, "sample_rate": 0.01, "slow_ms": 1500, "routes": ["/api/leaderboard"] }
+    Returns: { "settings": {...} }
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        return jsonify({
+            'status': 'success',
+            'settings': profiler.configure(**data)
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e), 'status': 'failed'}), 400
+    except Exception as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'failed'
+        }), 500
+
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -764,6 +1228,8 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+APP_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_ENV') == 'development'
@@ -774,6 +1240,7 @@ if __name__ == '__main__':
     print(f"📡 Server starting on port {port}")
     print(f"📝 Debug mode: {debug}")
     print(f"🔑 OpenAI API Key configured: {bool(OPENAI_API_KEY)}")
+    print(f"⏱️  App import: {APP_IMPORT_SECONDS:.3f}s (subsystems initialize on first use)")
     print(f"\n✨ Features Enabled:")
     print(f"   - AI Flashcard Generation")
     print(f"   - Quiz Generation")
@@ -788,6 +1255,7 @@ if __name__ == '__main__':
     print(f"   - POST /api/xp/award")
     print(f"   - GET  /api/user/progress")
     print(f"   - GET  /api/leaderboard")
+    print(f"   - GET  /metrics")
     print("="*60)
     
     app.run(debug=debug, port=port, host='0.0.0.0')
@@ -0,0 +1,244 @@
+"""
+groq_stub_server.py
+Local HTTP stand-in for the Groq chat-completions API
+
+Speaks the same protocol as groq_client.chat.completions.create (POST
+/openai/v1/chat/completions, JSON or SSE streaming), with configurable latency
+distributions, error injection and canned JSON payloads, so load tests can run
+without cost or rate limits.
+
+Usage (from backend/):
+    python benchmarks/groq_stub_server.py --port 8089 --latency lognormal:-0.7,0.5 --error-rate 0.02
+    GROQ_API_KEY=stub GROQ_BASE_URL=http://localhost:8089 python app.py
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import canned_completion  # noqa: E402
+
+COMPLETION_PATHS = ('/openai/v1/chat/completions', '/v1/chat/completions')
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Latency distribution in seconds from a spec string:
+        fixed:0.5 | uniform:0.2,1.5 | normal:0.8,0.2 | lognormal:mu,sigma | exponential:0.7
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+
+    if kind == 'fixed':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    if kind == 'exponential':
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class StubConfig:
+    """Runtime knobs shared by all request handler threads"""
+
+    def __init__(self, latency: str = 'fixed:0', error_rate: float = 0.0,
+                 error_statuses: Optional[List[int]] = None, tokens_per_sec: float = 0.0,
+                 payloads: Optional[Dict[str, str]] = None, seed: Optional[int] = None):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses or [429, 500, 503]
+        self.tokens_per_sec = tokens_per_sec
+        self.payloads = payloads or {}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def sample(self) -> Dict:
+        with self.lock:
+            self.requests += 1
+            fail = self.rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return {
+                'latency': self.latency(self.rng),
+                'error_status': self.rng.choice(self.error_statuses) if fail else None
+            }
+
+    def content_for(self, messages: List[Dict]) -> str:
+        prompt = messages[-1].get('content', '') if messages else ''
+        for needle, payload in self.payloads.items():
+            if needle in prompt:
+                return payload
+        return canned_completion(messages)
+
+
+def _tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 4))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config: StubConfig = StubConfig()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep load runs quiet
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, {'requests': self.config.requests, 'errors': self.config.errors})
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        if self.path not in COMPLETION_PATHS:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        plan = self.config.sample()
+
+        if plan['error_status']:
+            time.sleep(plan['latency'] / 4)
+            status = plan['error_status']
+            headers = {'Retry-After': '1'} if status == 429 else {}
+            self._send_json(status, {'error': {
+                'message': 'Injected failure from stub server',
+                'type': 'rate_limit_exceeded' if status == 429 else 'server_error',
+                'code': str(status)
+            }}, headers)
+            return
+
+        content = self.config.content_for(request.get('messages', []))
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:24]}'
+        model = request.get('model', 'stub-model')
+
+        if request.get('stream'):
+            self._stream(completion_id, model, content, plan['latency'])
+            return
+
+        time.sleep(plan['latency'])
+        prompt_tokens = sum(_tokens(m.get('content', '')) for m in request.get('messages', []))
+        completion_tokens = _tokens(content)
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        })
+
+    def _stream(self, completion_id: str, model: str, content: str, first_token_latency: float) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(first_token_latency)
+        piece = 16  # ~4 tokens per chunk
+        delay = (piece / 4) / self.config.tokens_per_sec if self.config.tokens_per_sec else 0
+
+        def event(delta: Dict, finish_reason: Optional[str] = None) -> bytes:
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            return f'data: {json.dumps(chunk)}\n\n'.encode()
+
+        self.wfile.write(event({'role': 'assistant', 'content': ''}))
+        for i in range(0, len(content), piece):
+            if delay:
+                time.sleep(delay)
+            self.wfile.write(event({'content': content[i:i + piece]}))
+            self.wfile.flush()
+        self.wfile.write(event({}, 'stop'))
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+
+def serve(port: int, config: StubConfig, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Start the stand-in server on a background thread and return it"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='groq-stub', daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local Groq chat-completions stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='lognormal:-0.7,0.5',
+                        help='fixed:S | uniform:A,B | normal:MU,SD | lognormal:MU,SIGMA | exponential:MEAN')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail')
+    parser.add_argument('--error-statuses', default='429,500,503')
+    parser.add_argument('--tokens-per-sec', type=float, default=200.0, help='Streaming pace (0 = no pacing)')
+    parser.add_argument('--payloads', help='JSON file mapping prompt substrings to canned response content')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    payloads = None
+    if args.payloads:
+        with open(args.payloads) as f:
+            payloads = json.load(f)
+
+    config = StubConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_statuses.split(',')],
+        tokens_per_sec=args.tokens_per_sec,
+        payloads=payloads,
+        seed=args.seed
+    )
+    server = serve(args.port, config, args.host)
+    print(f"🤖 Groq stand-in listening on http://{args.host}:{args.port} (latency {args.latency}, "
+          f"error rate {args.error_rate})")
+    print(f"   GROQ_API_KEY=stub GROQ_BASE_URL=http://{args.host}:{args.port} python app.py")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+loadgen.py
+Mixed-traffic load generator for the Flask app
+
+Drives a weighted mix of realistic requests (flashcards, quizzes, RAG queries,
+progress polls, leaderboard, XP awards) at increasing concurrency and reports
+throughput, latency percentiles and error rate per step, so the app's own
+throughput ceiling can be found on one machine. Pair it with
+groq_stub_server.py to keep the LLM out of the measurement.
+
+Usage (from backend/):
+    python benchmarks/groq_stub_server.py --port 8089 &
+    GROQ_API_KEY=stub GROQ_BASE_URL=http://localhost:8089 gunicorn -w 4 --threads 8 app:app &
+    python benchmarks/loadgen.py --url http://localhost:8000 --steps 1,4,16,64 --duration 20 --output load.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import make_pdf  # noqa: E402
+
+TOPICS = [
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The French Revolution began in 1789 and reshaped European politics.",
+    "Gradient descent minimizes a loss function by following its negative gradient.",
+    "Mitochondria produce ATP through oxidative phosphorylation.",
+    "Supply and demand determine prices in a competitive market.",
+]
+
+# (name, weight) — roughly what the frontend sends during a study session
+DEFAULT_MIX = {
+    'flashcards': 20,
+    'quiz': 10,
+    'distractors': 5,
+    'rag_query': 15,
+    'progress': 25,
+    'leaderboard': 15,
+    'xp_award': 10,
+}
+
+
+class Client:
+    """Tiny JSON-over-HTTP client on urllib (no extra dependencies)"""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: Optional[Dict] = None,
+                data: Optional[bytes] = None, headers: Optional[Dict] = None) -> Tuple[int, bytes]:
+        headers = dict(headers or {})
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def upload_pdf(self, user_id: str, filename: str, pdf: bytes) -> Tuple[int, bytes]:
+        boundary = uuid.uuid4().hex
+        parts = [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="user_id"\r\n\r\n{user_id}\r\n'.encode(),
+            (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+             f'Content-Type: application/pdf\r\n\r\n').encode() + pdf + b'\r\n',
+            f'--{boundary}--\r\n'.encode(),
+        ]
+        return self.request('POST', '/api/rag/upload', data=b''.join(parts),
+                            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+def build_request(kind: str, user_id: str, rng: random.Random) -> Tuple[str, str, Optional[Dict]]:
+    """(method, path, json body) for one request of the given kind"""
+    topic = rng.choice(TOPICS)
+    if kind == 'flashcards':
+        return 'POST', '/api/flashcards/generate', {'content': topic, 'num_cards': rng.choice([5, 10]), 'user_id': user_id}
+    if kind == 'quiz':
+        return 'POST', '/api/quiz/generate', {'content': topic, 'num_questions': 5, 'user_id': user_id}
+    if kind == 'distractors':
+        return 'POST', '/api/quiz/generate-distractors', {'question': f'What is described by: {topic}', 'correct_answer': topic}
+    if kind == 'rag_query':
+        return 'POST', '/api/rag/query', {'query': f'Explain: {topic}', 'user_id': user_id, 'top_k': 3}
+    if kind == 'progress':
+        return 'GET', f'/api/user/progress?user_id={user_id}', None
+    if kind == 'leaderboard':
+        return 'GET', '/api/leaderboard?limit=10', None
+    if kind == 'xp_award':
+        return 'POST', '/api/xp/award', {'user_id': user_id, 'activity_type': 'correct_answer'}
+    raise ValueError(f"Unknown request kind: {kind}")
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))], 2)
+
+
+def run_step(client: Client, concurrency: int, duration: float, mix: Dict[str, int],
+             users: List[str], rag_users: List[str], seed: int) -> Dict:
+    """
+    Closed-loop load: `concurrency` workers send back-to-back requests for `duration` seconds
+    RAG queries go to rag_users (the learners with documents), everything else to users.
+    """
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+    samples: Dict[str, List[float]] = {k: [] for k in kinds}
+    errors: Dict[str, int] = {k: 0 for k in kinds}
+    statuses: Dict[str, int] = {}
+
+    def worker(worker_id: int) -> None:
+        rng = random.Random(seed * 1000 + worker_id)
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            method, path, body = build_request(kind, rng.choice(rag_users if kind == 'rag_query' else users), rng)
+            started = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body)
+            except Exception:
+                status = 0
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                samples[kind].append(elapsed_ms)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 0 or status >= 500:
+                    errors[kind] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    all_latencies = sorted(v for values in samples.values() for v in values)
+    total = len(all_latencies)
+    return {
+        'concurrency': concurrency,
+        'duration_seconds': round(wall, 2),
+        'requests': total,
+        'throughput_rps': round(total / wall, 2) if wall else 0.0,
+        'error_rate': round(sum(errors.values()) / total, 4) if total else 0.0,
+        'status_codes': statuses,
+        'latency_ms': {
+            'p50': percentile(all_latencies, 0.50),
+            'p95': percentile(all_latencies, 0.95),
+            'p99': percentile(all_latencies, 0.99),
+        },
+        'by_kind': {
+            kind: {
+                'requests': len(values),
+                'errors': errors[kind],
+                'p50_ms': percentile(sorted(values), 0.50),
+                'p95_ms': percentile(sorted(values), 0.95),
+            }
+            for kind, values in samples.items()
+        }
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Mixed-traffic load generator for the Flask app')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--steps', default='1,2,4,8,16,32', help='Concurrency levels to ramp through')
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds per step')
+    parser.add_argument('--users', type=int, default=200, help='Distinct simulated learners')
+    parser.add_argument('--rag-users', type=int, default=5, help='Learners that get a PDF uploaded during setup (and receive every RAG query)')
+    parser.add_argument('--mix', help='JSON object of request kind -> weight (default: study-session mix)')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stop-on-saturation', action='store_true',
+                        help='Stop ramping when throughput grows <5%% or error rate exceeds 5%%')
+    parser.add_argument('--output', help='Write JSON results here')
+    args = parser.parse_args()
+
+    client = Client(args.url, args.timeout)
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    users = [f'load_user_{i}' for i in range(args.users)]
+
+    status, _ = client.request('GET', '/')
+    if status != 200:
+        print(f"❌ {args.url} is not responding (status {status})", file=sys.stderr)
+        return 1
+
+    # Give a few learners documents so RAG queries do real retrieval work
+    pending = []
+    for user_id in users[:args.rag_users]:
+        pdf = make_pdf([' '.join(TOPICS) * 8 for _ in range(3)])
+        status, body = client.upload_pdf(user_id, 'loadgen.pdf', pdf)
+        if status == 202:
+            pending.append(json.loads(body)['status_url'])
+    # Uploads are ingested in the background; wait so the first step measures warm retrieval
+    for status_url in pending:
+        for _ in range(120):
+            status, body = client.request('GET', status_url)
+            if status != 200 or json.loads(body)['job']['state'] in ('succeeded', 'failed'):
+                break
+            time.sleep(0.5)
+    rag_users = users[:args.rag_users] or users
+
+    steps = []
+    for concurrency in [int(c) for c in args.steps.split(',')]:
+        result = run_step(client, concurrency, args.duration, mix, users, rag_users, args.seed)
+        steps.append(result)
+        print(f"👥 {concurrency:>4} workers: {result['throughput_rps']:>8.1f} req/s  "
+              f"p50 {result['latency_ms']['p50']} ms  p95 {result['latency_ms']['p95']} ms  "
+              f"errors {result['error_rate']:.1%}", file=sys.stderr)
+
+        if args.stop_on_saturation and len(steps) > 1:
+            previous = steps[-2]['throughput_rps']
+            if result['error_rate'] > 0.05 or (previous and result['throughput_rps'] < previous * 1.05):
+                break
+
+    peak = max(steps, key=lambda s: s['throughput_rps'])
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'url': args.url,
+            'mix': mix,
+            'users': args.users,
+            'duration_per_step': args.duration
+        },
+        'peak': {'concurrency': peak['concurrency'], 'throughput_rps': peak['throughput_rps']},
+        'steps': steps
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
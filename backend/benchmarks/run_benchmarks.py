@@ -0,0 +1,331 @@
+"""
+run_benchmarks.py
+Offline benchmark suite for the backend
+
+Groq and Google embeddings are replaced by deterministic stubs (stubs.py) and
+all databases are created in a throwaway directory, so runs are repeatable and
+never touch the network or the real chroma_db.
+
+Usage (from backend/):
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --quick --compare bench.json
+    python benchmarks/run_benchmarks.py --suites leaderboard --users 10000,100000,1000000
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stubs import StubEmbeddings, StubGroqClient, make_pdf  # noqa: E402
+
+SUITES = ('chunking', 'ingestion', 'retrieval', 'rag_service', 'endpoints', 'leaderboard')
+
+WORDS = (
+    "learning model neural network gradient descent attention transformer token "
+    "embedding vector retrieval context memory recall quiz flashcard concept theory "
+    "practice example definition algorithm data training loss evaluation metric"
+).split()
+
+
+def make_text(n_chars: int, seed: int = 0) -> str:
+    """Deterministic pseudo-prose of roughly n_chars characters"""
+    rng = random.Random(seed)
+    sentences = []
+    length = 0
+    while length < n_chars:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + '.'
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(sentences)[:n_chars]
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1) -> Dict:
+    """Time fn repeat times after warmup calls; milliseconds"""
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {
+        'runs': repeat,
+        'mean_ms': round(statistics.fmean(timings), 4),
+        'p50_ms': round(timings[len(timings) // 2], 4),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        'min_ms': round(timings[0], 4),
+        'max_ms': round(timings[-1], 4)
+    }
+
+
+def bench_chunking(args) -> Dict:
+    import ai_service
+
+    results = {}
+    for size in args.doc_sizes:
+        text = make_text(size, seed=size)
+        stats = measure(lambda: ai_service.chunk_text(text), args.repeat)
+        stats['chars_per_sec'] = round(size / (stats['mean_ms'] / 1000)) if stats['mean_ms'] else None
+        results[f'{size}_chars'] = stats
+    return results
+
+
+def bench_ingestion(args) -> Dict:
+    import ai_service
+
+    results = {}
+    for size in args.doc_sizes:
+        text = make_text(size, seed=size)
+        counter = {'n': 0}
+
+        def ingest():
+            counter['n'] += 1
+            return ai_service.process_document_for_rag(text, f'doc_{counter["n"]}.txt', f'ingest_{size}_{counter["n"]}')
+
+        chunks = len(ai_service.chunk_text(text))
+        stats = measure(ingest, max(1, args.repeat // 4))
+        stats['chunks'] = chunks
+        stats['chunks_per_sec'] = round(chunks / (stats['mean_ms'] / 1000), 1) if stats['mean_ms'] else None
+        results[f'{size}_chars'] = stats
+    return results
+
+
+def bench_retrieval(args) -> Dict:
+    import ai_service
+
+    results = {}
+    for n_chunks in args.corpus_sizes:
+        user_id = f'retrieval_{n_chunks}'
+        # chunk_text produces ~450-char chunks for 500-char windows with 50 overlap
+        ai_service.process_document_for_rag(make_text(n_chunks * 450, seed=n_chunks), 'corpus.txt', user_id)
+        actual = len(ai_service.vector_store.get(user_id)['documents'])
+
+        queries = [make_text(60, seed=i) for i in range(args.repeat)]
+        it = iter(queries * 2)
+        stats = measure(lambda: ai_service.retrieve_relevant_chunks(next(it), user_id, 5), args.repeat)
+        stats['chunks'] = actual
+        results[f'{n_chunks}_chunks'] = stats
+    return results
+
+
+def bench_rag_service(args) -> Dict:
+    try:
+        from rag_service import rag_service
+    except ImportError as e:
+        return {'skipped': f'rag_service unavailable: {e}'}
+
+    rag_service.embeddings = StubEmbeddings()
+    results = {'ingestion': {}, 'query': {}}
+
+    for n_pages in args.pdf_pages:
+        path = os.path.join(args.workdir, f'bench_{n_pages}.pdf')
+        with open(path, 'wb') as f:
+            f.write(make_pdf([make_text(3000, seed=page) for page in range(n_pages)]))
+
+        user_id = f'rag_{n_pages}'
+        started = time.perf_counter()
+        outcome = rag_service.process_pdf(path, user_id)
+        elapsed = time.perf_counter() - started
+        if outcome['status'] != 'success':
+            results['ingestion'][f'{n_pages}_pages'] = {'error': outcome.get('error')}
+            continue
+
+        results['ingestion'][f'{n_pages}_pages'] = {
+            'seconds': round(elapsed, 4),
+            'chunks': outcome['chunks_processed'],
+            'chunks_per_sec': round(outcome['chunks_processed'] / elapsed, 1)
+        }
+
+        queries = iter([make_text(60, seed=i) for i in range(args.repeat * 2)])
+        stats = measure(lambda: rag_service.query(user_id, next(queries), 5), args.repeat)
+        stats['chunks'] = outcome['chunks_processed']
+        results['query'][f'{n_pages}_pages'] = stats
+
+    return results
+
+
+def bench_endpoints(args) -> Dict:
+    try:
+        import app as app_module
+    except ImportError as e:
+        return {'skipped': f'app unavailable: {e}'}
+
+    import ai_service
+    ai_service.groq_client = StubGroqClient(latency=args.llm_latency)
+    ai_service.GROQ_AVAILABLE = True
+    client = app_module.app.test_client()
+
+    content = make_text(2000, seed=7)
+    requests_to_time = {
+        'GET /': lambda: client.get('/'),
+        'POST /api/process': lambda: client.post('/api/process', json={'text': content, 'user_id': 'bench'}),
+        'POST /api/flashcards/generate': lambda: client.post(
+            '/api/flashcards/generate', json={'content': content, 'num_cards': 10, 'user_id': 'bench'}),
+        'POST /api/quiz/generate': lambda: client.post(
+            '/api/quiz/generate', json={'content': content, 'num_questions': 5, 'user_id': 'bench'}),
+        'POST /api/quiz/generate-distractors': lambda: client.post(
+            '/api/quiz/generate-distractors', json={'question': 'What?', 'correct_answer': 'That'}),
+        'POST /api/analyze': lambda: client.post('/api/analyze', json={'content': content}),
+        'POST /api/xp/award': lambda: client.post(
+            '/api/xp/award', json={'user_id': 'bench', 'activity_type': 'correct_answer'}),
+        'GET /api/user/progress': lambda: client.get('/api/user/progress?user_id=bench'),
+        'GET /api/leaderboard': lambda: client.get('/api/leaderboard?limit=10'),
+    }
+
+    try:
+        from rag_service import rag_service
+        rag_service.embeddings = StubEmbeddings()
+        with open(os.path.join(args.workdir, 'endpoint.pdf'), 'wb') as f:
+            f.write(make_pdf([make_text(3000, seed=page) for page in range(5)]))
+        rag_service.process_pdf(os.path.join(args.workdir, 'endpoint.pdf'), 'bench')
+        requests_to_time['POST /api/rag/query'] = lambda: client.post(
+            '/api/rag/query', json={'query': 'What is attention?', 'user_id': 'bench'})
+        requests_to_time['GET /api/rag/stats'] = lambda: client.get('/api/rag/stats?user_id=bench')
+    except ImportError:
+        pass
+
+    results = {}
+    for name, send in requests_to_time.items():
+        status = send().status_code
+        results[name] = measure(send, args.repeat)
+        results[name]['status_code'] = status
+    return results
+
+
+def bench_leaderboard(args) -> Dict:
+    from user_service import user_service
+    from user_store import UserStore
+
+    results = {}
+    rng = random.Random(42)
+    for n_users in args.users:
+        store = UserStore(os.path.join(args.workdir, f'leaderboard_{n_users}.db'))
+        started = time.perf_counter()
+        batch = 10000
+        for offset in range(0, n_users, batch):
+            store.put_many(
+                {'user_id': f'user_{i}', 'xp': rng.randint(0, 20000), 'level': 1}
+                for i in range(offset, min(offset + batch, n_users))
+            )
+        load_seconds = time.perf_counter() - started
+
+        user_service.store = store
+        results[f'{n_users}_users'] = {
+            'load_seconds': round(load_seconds, 3),
+            'top_10': measure(lambda: user_service.get_leaderboard(10), args.repeat),
+            'top_100': measure(lambda: user_service.get_leaderboard(100), args.repeat)
+        }
+    return results
+
+
+def flatten(results: Dict, prefix: str = '') -> Dict[str, float]:
+    """Map 'suite/case/metric' -> value for every *_ms / *_seconds metric"""
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}/{key}' if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and (key.endswith('_ms') or key.endswith('seconds')):
+            flat[path] = value
+    return flat
+
+
+def compare(current: Dict, baseline: Dict, metric: str = 'p50_ms') -> List[Dict]:
+    """Relative change of each matching metric between two result files"""
+    now = flatten(current['results'])
+    before = flatten(baseline['results'])
+    changes = []
+    for path, value in sorted(now.items()):
+        if path in before and before[path] and (path.endswith(metric) or path.endswith('seconds')):
+            changes.append({'metric': path, 'baseline': before[path], 'current': value,
+                            'change': round((value - before[path]) / before[path], 4)})
+    return changes
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Offline backend benchmarks')
+    parser.add_argument('--suites', default=','.join(SUITES), help=f'Comma-separated subset of {SUITES}')
+    parser.add_argument('--output', help='Write machine-readable JSON results here')
+    parser.add_argument('--compare', help='Baseline JSON results to compare against')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='Exit 1 if any p50 metric is slower than baseline by more than this fraction')
+    parser.add_argument('--quick', action='store_true', help='Small sizes for a fast smoke run')
+    parser.add_argument('--repeat', type=int, default=None)
+    parser.add_argument('--users', type=_int_list, default=None, help='Leaderboard sizes, e.g. 10000,1000000')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Seconds each stubbed completion sleeps')
+    args = parser.parse_args()
+
+    args.repeat = args.repeat or (5 if args.quick else 30)
+    args.users = args.users or ([1000, 10000] if args.quick else [10000, 100000, 1000000])
+    args.doc_sizes = [5000, 50000] if args.quick else [5000, 50000, 500000]
+    args.corpus_sizes = [100, 1000] if args.quick else [100, 1000, 10000]
+    args.pdf_pages = [5] if args.quick else [5, 50]
+
+    # Everything (chroma_db/, SQLite stores) lands in a throwaway directory
+    invoked_from = os.getcwd()
+    args.workdir = tempfile.mkdtemp(prefix='flashcard-bench-')
+    os.chdir(args.workdir)
+    os.environ['SHARED_STATE_PATH'] = os.path.join(args.workdir, 'shared_state.db')
+    os.environ['USER_STORE_PATH'] = os.path.join(args.workdir, 'users.db')
+
+    results = {}
+    # Service logging goes to stderr so stdout stays pure JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for suite in args.suites.split(','):
+            print(f"⏱️  Running {suite}...")
+            results[suite] = globals()[f'bench_{suite}'](args)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': args.quick,
+            'repeat': args.repeat,
+            'llm_latency': args.llm_latency
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(os.path.join(invoked_from, args.output), 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(os.path.join(invoked_from, args.compare)) as f:
+            changes = compare(report, json.load(f))
+        for change in changes:
+            print(f"{change['change']:+8.1%}  {change['metric']}  "
+                  f"({change['baseline']} -> {change['current']})", file=sys.stderr)
+        if args.max_regression is not None and any(c['change'] > args.max_regression for c in changes):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
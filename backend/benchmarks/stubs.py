@@ -0,0 +1,150 @@
+"""
+stubs.py
+Deterministic offline stand-ins for the Groq chat client and Google embeddings
+Used by the benchmark suite so runs are repeatable and never hit the network
+"""
+
+import hashlib
+import json
+import re
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+
+def _count(prompt: str, default: int = 5) -> int:
+    match = re.search(r'exactly (\d+)', prompt)
+    return int(match.group(1)) if match else default
+
+
+def canned_completion(messages: List[Dict]) -> str:
+    """Build a well-formed response for the task implied by the prompt"""
+    prompt = messages[-1]['content']
+
+    if 'flashcards' in prompt:
+        return json.dumps([
+            {
+                'front': f'Term {i + 1}',
+                'back': f'Definition {i + 1}',
+                'difficulty': 'medium',
+                'category': 'Benchmark'
+            }
+            for i in range(_count(prompt))
+        ])
+
+    if 'multiple-choice quiz questions' in prompt:
+        return json.dumps([
+            {
+                'question': f'Question {i + 1}?',
+                'options': {'A': 'First', 'B': 'Second', 'C': 'Third', 'D': 'Fourth'},
+                'correct_answer': 'A',
+                'explanation': 'Because it is first'
+            }
+            for i in range(_count(prompt))
+        ])
+
+    if 'incorrect answers' in prompt:
+        return json.dumps([f'Wrong answer {i + 1}' for i in range(_count(prompt, 3))])
+
+    if '"difficulty"' in prompt:
+        return json.dumps({
+            'difficulty': 'intermediate',
+            'reading_level': '9-10',
+            'key_concepts': ['alpha', 'beta', 'gamma'],
+            'estimated_study_time': '15',
+            'reasoning': 'Benchmark content'
+        })
+
+    return 'This is a canned answer based on the provided context [Source 1].'
+
+
+class _Completions:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def create(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        content = canned_completion(messages)
+        if stream:
+            return (
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[i:i + 16]))])
+                for i in range(0, len(content), 16)
+            )
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+        )
+
+
+class StubGroqClient:
+    """Mimics groq.Groq: client.chat.completions.create(...)"""
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency: Seconds each completion sleeps, to model network time
+        """
+        self.chat = SimpleNamespace(completions=_Completions(latency))
+
+
+class StubEmbeddings:
+    """Mimics GoogleGenerativeAIEmbeddings with hash-derived unit vectors"""
+
+    def __init__(self, dimensions: int = 768):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        raw = (digest * (self.dimensions // len(digest) + 1))[:self.dimensions]
+        vector = [b / 255.0 - 0.5 for b in raw]
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Minimal text-only PDF (Helvetica, one text line per 90 chars) for ingestion runs"""
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_refs = []
+
+    for text in pages:
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)] or ['']
+        ops = ['BT /F1 10 Tf 12 TL 40 800 Td']
+        for line in lines[:60]:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            ops.append(f'({escaped}) Tj T*')
+        ops.append('ET')
+        stream = '\n'.join(ops).encode('latin-1', 'replace')
+
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        content_ref = len(objects)
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_ref
+        )
+        page_refs.append(len(objects))
+
+    kids = ' '.join(f'{ref} 0 R' for ref in page_refs).encode()
+    objects[1] = b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % len(page_refs)
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
@@ -0,0 +1,66 @@
+"""
+compaction.py
+Background compaction for logically deleted (tombstoned) RAG documents
+Deletes only record a tombstone; the space is reclaimed here, off the request path
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+# Seconds to wait after a delete so bursts of deletes/replacements coalesce
+COMPACTION_DELAY_SECONDS = float(os.getenv('COMPACTION_DELAY_SECONDS', '5'))
+
+
+class CompactionScheduler:
+    """Debounced background runner for compaction jobs keyed by store/user"""
+
+    def __init__(self, delay: float = COMPACTION_DELAY_SECONDS):
+        self.delay = delay
+        self._pending: Dict[str, Callable[[], None]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def schedule(self, key: str, job: Callable[[], None]) -> None:
+        """
+        Queue a compaction job; a later job with the same key replaces it
+
+        Args:
+            key: Identifier of the store being compacted (e.g. "chroma:user123")
+            job: Callable that physically removes tombstoned entries
+        """
+        with self._lock:
+            self._pending[key] = job
+            # Start the worker on first use so importing this module stays cheap
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='rag-compaction', daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+
+    def run_pending(self) -> int:
+        """Run all queued jobs synchronously, returns number of jobs run"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for key, job in pending.items():
+            try:
+                job()
+            except Exception as e:
+                print(f"⚠️  Compaction failed for {key}: {e}")
+
+        return len(pending)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.delay)
+            self._wakeup.clear()
+            self.run_pending()
+
+
+# Global instance
+compaction_scheduler = CompactionScheduler()
@@ -0,0 +1,102 @@
+"""
+dedup.py
+Near-duplicate chunk detection with 64-bit SimHash fingerprints
+Used at ingest so repeated headers, footers, boilerplate and near-identical
+slides are not embedded and indexed again
+"""
+
+import hashlib
+import os
+import re
+from collections import Counter
+
+from metrics import registry
+
+# NumPy import with error handling (pure-Python fallback below)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None  # type: ignore
+    NUMPY_AVAILABLE = False
+
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+# Chunks whose fingerprints differ in at most this many of 64 bits are near-duplicates
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', '3'))
+SHINGLE_SIZE = 3
+BITS = 64
+
+DUPLICATES_DROPPED = registry.counter(
+    'app_dedup_dropped_total', 'Near-duplicate chunks dropped at ingest', ('store',))
+
+_TOKEN = re.compile(r'\w+')
+
+
+def _features(text: str) -> Counter:
+    """Word 3-gram shingles of normalized text (case-folded, numbers collapsed so page numbers match)"""
+    tokens = _TOKEN.findall(re.sub(r'\d+', '0', text.lower()))
+    if len(tokens) < SHINGLE_SIZE:
+        return Counter([' '.join(tokens)]) if tokens else Counter()
+    return Counter(' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1))
+
+
+def _digest(feature: str) -> bytes:
+    return hashlib.blake2b(feature.encode('utf-8'), digest_size=BITS // 8).digest()
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash of a text; similar texts get fingerprints a few bits apart"""
+    features = _features(text)
+    if not features:
+        return 0
+
+    if NUMPY_AVAILABLE and np is not None:
+        digests = np.frombuffer(b''.join(_digest(f) for f in features), dtype=np.uint8)
+        bits = np.unpackbits(digests.reshape(len(features), BITS // 8), axis=1).astype(np.int64)
+        weights = np.fromiter(features.values(), dtype=np.int64, count=len(features))
+        totals = weights @ (bits * 2 - 1)
+        return int.from_bytes(np.packbits(totals > 0).tobytes(), 'big')
+
+    totals = [0] * BITS
+    for feature, weight in features.items():
+        value = int.from_bytes(_digest(feature), 'big')
+        for bit in range(BITS):
+            totals[BITS - 1 - bit] += weight if (value >> bit) & 1 else -weight
+    fingerprint = 0
+    for total in totals:
+        fingerprint = (fingerprint << 1) | (1 if total > 0 else 0)
+    return fingerprint
+
+
+class SimHashIndex:
+    """
+    Finds fingerprints within max_distance bits without comparing against all of them
+
+    The 64 bits are split into max_distance + 1 bands; by the pigeonhole principle
+    two fingerprints that differ in at most max_distance bits agree exactly on at
+    least one band, so only entries sharing a band value are compared.
+    """
+
+    def __init__(self, max_distance: int = DEDUP_MAX_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width, extra = divmod(BITS, bands)
+        self._bands = []
+        shift = 0
+        for band in range(bands):
+            size = width + (1 if band < extra else 0)
+            self._bands.append((shift, (1 << size) - 1))
+            shift += size
+        self._buckets = [dict() for _ in self._bands]
+
+    def add(self, fingerprint: int) -> None:
+        for buckets, (shift, mask) in zip(self._buckets, self._bands):
+            buckets.setdefault((fingerprint >> shift) & mask, []).append(fingerprint)
+
+    def contains_near(self, fingerprint: int) -> bool:
+        for buckets, (shift, mask) in zip(self._buckets, self._bands):
+            for candidate in buckets.get((fingerprint >> shift) & mask, ()):
+                if bin(candidate ^ fingerprint).count('1') <= self.max_distance:
+                    return True
+        return False
+
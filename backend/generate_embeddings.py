@@ -1,31 +1,48 @@
 # backend/generate_embeddings.py
 #Importing necessary libraries
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import uuid
+import chromadb
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import Chroma
+from ingestion import IngestTarget, ingest, pdf_pages
 
-#creating a list that stores PDF path
-def process_pdf_and_create_db(file_path, db_persist_directory="./chroma_db"):
-    #Load the document
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
+#langchain's default collection name, so the returned vector_db reads what was written
+COLLECTION_NAME = "langchain"
+
+#Writes each embedded batch into the default Chroma collection of a directory
+class ChromaDirectoryTarget(IngestTarget):
+    name = 'chroma_directory'
+    chunk_size = 1000
+    chunk_overlap = 200
+
+    def __init__(self, source, db_persist_directory):
+        self.source = source
+        self.embeddings = GoogleGenerativeAIEmbeddings(model="text-embedding-004")
+        #Batches arrive already embedded, so they go through chromadb's collection API
+        #(Chroma.add_texts would embed them again)
+        self.client = chromadb.PersistentClient(path=db_persist_directory)
+        self.collection = self.client.get_or_create_collection(COLLECTION_NAME)
+        self.vector_db = Chroma(client=self.client, collection_name=COLLECTION_NAME,
+                                embedding_function=self.embeddings)
 
-    #Split the document into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=1000)
-    chunks = text_splitter.split_documents(documents)
+    def embed(self, texts):
+        return self.embeddings.embed_documents(texts)
 
-    #Generate embeddings using Google Gemini
-    embeddings = GoogleGenerativeAIEmbeddings(model="text-embedding-004")
-    
-    #Store embeddings in ChromaDB
-    # Chroma can persist the database locally to disk
-    vector_db = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=db_persist_directory
-    )
-    vector_db.persist() # Ensures the database is saved to disk
+    def write(self, chunks, vectors):
+        self.collection.add(
+            ids=[str(uuid.uuid4()) for _ in chunks],
+            embeddings=list(vectors),
+            documents=[chunk.text for chunk in chunks],
+            metadatas=[{'source': self.source, 'page': chunk.page} for chunk in chunks]
+        )
+
+#creating a list that stores PDF path
+def process_pdf_and_create_db(file_path, db_persist_directory="./chroma_db"):
+    #Load, chunk, embed and store the document with the shared ingestion pipeline
+    #(same stages as the upload endpoints; pages are embedded while later ones are parsed)
+    target = ChromaDirectoryTarget(file_path, db_persist_directory)
+    with open(file_path, 'rb') as stream:
+        stats = ingest(pdf_pages(stream), target)
 
-    print(f"Vector database created and persisted at {db_persist_directory}")
-    return vector_db
\ No newline at end of file
+    print(f"Vector database created and persisted at {db_persist_directory} ({stats['chunks']} chunks)")
+    return target.vector_db
@@ -0,0 +1,49 @@
+"""
+http_cache.py
+Pre-encoded JSON responses with ETags, 304 Not Modified and gzip
+A payload is serialized and compressed once; every poll after that is either a
+304 (client already has it) or a copy of the stored bytes.
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Dict, NamedTuple
+
+from flask import Response, request
+
+from metrics import registry
+
+CONDITIONAL_RESPONSES = registry.counter(
+    'app_conditional_responses_total', 'ETag-checked responses by route and result', ('route', 'result'))
+
+
+class EncodedJSON(NamedTuple):
+    etag: str       # content hash, identical in every worker for the same payload
+    body: bytes
+    gzipped: bytes
+
+
+def encode_json(payload: Dict) -> EncodedJSON:
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    # mtime=0 keeps the compressed bytes deterministic
+    return EncodedJSON(hashlib.sha1(body).hexdigest()[:20], body, gzip.compress(body, 6, mtime=0))
+
+
+def conditional_response(encoded: EncodedJSON, route: str) -> Response:
+    """304 if the client's If-None-Match matches, else the stored body (gzipped when accepted)"""
+    if request.if_none_match.contains_weak(encoded.etag):
+        CONDITIONAL_RESPONSES.inc(route=route, result='not_modified')
+        response = Response(status=304)
+    else:
+        CONDITIONAL_RESPONSES.inc(route=route, result='full')
+        if request.accept_encodings['gzip']:
+            response = Response(encoded.gzipped, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(encoded.body, mimetype='application/json')
+    # Weak: the gzipped and plain bodies are the same resource
+    response.set_etag(encoded.etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'  # always revalidate, which is a cheap 304
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,433 @@
+"""
+ingestion.py
+Stage-parallel document ingestion shared by every upload path
+parse -> normalize -> chunk -> dedupe -> embed -> index, each stage in its own
+thread and connected to the next by a bounded queue, so later pages are parsed
+while earlier chunks are embedded and written. Stages are plain objects and can
+be swapped or extended; the store-specific parts (chunk size, embedding,
+writing) come from an IngestTarget.
+"""
+
+import contextvars
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from dedup import DEDUP_ENABLED, DUPLICATES_DROPPED, SimHashIndex, simhash
+from metrics import record_span, registry
+from pdf_cache import PdfTextCache, content_hash, pdf_text_cache
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # older installs only have PyPDF2
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        PdfReader = None
+
+PDF_AVAILABLE = PdfReader is not None
+
+# Items buffered between two stages; a full queue makes the upstream stage wait
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '8'))
+# Chunks per embedding call
+INGEST_EMBED_BATCH = int(os.getenv('INGEST_EMBED_BATCH', '32'))
+
+STAGE_ITEMS = registry.counter('app_ingest_stage_items_total', 'Items emitted by each ingestion stage', ('stage',))
+STAGE_BLOCKED = registry.counter(
+    'app_ingest_stage_blocked_seconds_total', 'Time ingestion stages waited on a full downstream queue', ('stage',))
+
+ProgressFn = Callable[[str, float], None]
+
+
+class Page(NamedTuple):
+    text: str
+    number: int   # 0-based
+    total: int
+
+
+class Chunk(NamedTuple):
+    text: str
+    page: int          # page the chunk starts on
+    total_pages: int
+    fingerprint: Optional[int] = None
+
+
+def pdf_pages(stream: BinaryIO, progress: Optional[ProgressFn] = None,
+              cache: Optional[PdfTextCache] = None) -> Iterator[Page]:
+    """
+    Parse a PDF page by page from a seekable binary stream
+    Pages of PDFs parsed before (same bytes) come from the parsed-text cache;
+    a fully parsed PDF is added to it.
+    """
+    cache = cache or pdf_text_cache
+    digest = content_hash(stream) if cache.enabled else None
+    cached = cache.get(digest) if digest else None
+    if cached is not None:
+        for number, text in enumerate(cached):
+            yield Page(text, number, len(cached))
+        if progress:
+            progress('parsing', 0.3)
+        return
+
+    if PdfReader is None:
+        raise RuntimeError('PDF support not installed. Run: pip install pypdf')
+    stream.seek(0)
+    reader = PdfReader(stream)
+    total = len(reader.pages)
+    texts = []
+    for number, page in enumerate(reader.pages):
+        texts.append(page.extract_text() or "")
+        yield Page(texts[-1], number, total)
+        if progress:
+            progress('parsing', 0.3 * (number + 1) / total)
+    if digest:
+        cache.put(digest, texts)
+
+
+def text_pages(text: str) -> Iterator[Page]:
+    """Plain text as a single page"""
+    yield Page(text, 0, 1)
+
+
+class EmptyDocumentError(ValueError):
+    """The document produced no chunks to store"""
+
+
+class IngestTarget:
+    """Store-specific end of the pipeline (see RAGService and the ai_service vector store)"""
+
+    name = 'store'
+    chunk_size = 1000
+    chunk_overlap = 200
+
+    def embed(self, texts: List[str]) -> List[Any]:
+        raise NotImplementedError
+
+    def write(self, chunks: List[Chunk], vectors: List[Any]) -> None:
+        """Store one embedded batch (called from the index stage's thread)"""
+        raise NotImplementedError
+
+    def commit(self) -> None:
+        """Called once after the last write"""
+
+
+class Stage:
+    """One pipeline step: process() maps an item to zero or more outputs, finish() flushes at the end"""
+
+    name = 'stage'
+
+    def process(self, item: Any) -> Iterable[Any]:
+        raise NotImplementedError
+
+    def finish(self) -> Iterable[Any]:
+        return ()
+
+
+class NormalizeStage(Stage):
+    """Collapse whitespace, keeping single line breaks for the chunker; drop pages without text"""
+
+    name = 'normalize'
+
+    def __init__(self):
+        self.characters = 0
+
+    def process(self, page: Page) -> Iterable[Page]:
+        text = re.sub(r'[^\S\n]+', ' ', page.text)
+        text = re.sub(r' ?\n\s*', '\n', text).strip()
+        self.characters += len(text)
+        return [page._replace(text=text)] if text else []
+
+
+class ChunkStage(Stage):
+    """
+    Overlapping chunks that prefer to end on a sentence or line; a chunk may span pages
+    Cuts after the last '.' or newline inside the window (pages are joined by a newline),
+    produced as pages arrive. ai_service.chunk_text uses it on a single text.
+    """
+
+    name = 'chunk'
+
+    def __init__(self, size: int, overlap: int):
+        self.size = size
+        self.overlap = overlap
+        self.text = ''
+        self.pages: List[tuple] = []  # (offset in self.text, page number, total pages)
+
+    def process(self, page: Page) -> Iterable[Chunk]:
+        if self.text:
+            self.text += '\n'
+        self.pages.append((len(self.text), page.number, page.total))
+        self.text += page.text
+        return self._cut(final=False)
+
+    def finish(self) -> Iterable[Chunk]:
+        return self._cut(final=True)
+
+    def _page_at(self, offset: int) -> tuple:
+        for start, number, total in reversed(self.pages):
+            if start <= offset:
+                return number, total
+        return self.pages[0][1:]
+
+    def _cut(self, final: bool) -> List[Chunk]:
+        chunks = []
+        start = 0
+        # Only cut where the end is known to fall inside the text; the rest waits for more pages
+        while start < len(self.text) and (final or start + self.size < len(self.text)):
+            end = start + self.size
+            if end < len(self.text):
+                last_break = max(self.text.rfind('.', start, end), self.text.rfind('\n', start, end))
+                if last_break > start:
+                    end = last_break + 1
+            text = self.text[start:end].strip()
+            if text:
+                chunks.append(Chunk(text, *self._page_at(start)))
+            next_start = end - self.overlap if end < len(self.text) else end
+            # A sentence break close to start would otherwise move the window backwards
+            start = next_start if next_start > start else end
+
+        # Keep only the uncut tail
+        self.text = self.text[start:]
+        self.pages = [(max(offset - start, 0), number, total)
+                      for i, (offset, number, total) in enumerate(self.pages)
+                      if i + 1 == len(self.pages) or self.pages[i + 1][0] > start]
+        return chunks
+
+
+class DedupeStage(Stage):
+    """
+    Drop chunks that nearly duplicate an earlier chunk of the same document; fingerprint the rest
+    Other documents are not consulted, so deleting one never removes content another relies on.
+    """
+
+    name = 'dedupe'
+
+    def __init__(self, store: str, enabled: bool = DEDUP_ENABLED):
+        self.store = store
+        self.enabled = enabled
+        self.index = SimHashIndex()
+        self.dropped = 0
+
+    def process(self, chunk: Chunk) -> Iterable[Chunk]:
+        if not self.enabled:
+            return [chunk]
+        fingerprint = simhash(chunk.text)
+        if self.index.contains_near(fingerprint):
+            self.dropped += 1
+            return []
+        self.index.add(fingerprint)
+        return [chunk._replace(fingerprint=fingerprint)]
+
+    def finish(self) -> Iterable[Chunk]:
+        if self.enabled:
+            DUPLICATES_DROPPED.inc(self.dropped, store=self.store)
+        return ()
+
+
+class EmbedStage(Stage):
+    """Group chunks into batches and embed each batch with one call"""
+
+    name = 'embed'
+
+    def __init__(self, embed: Callable[[List[str]], List[Any]], batch_size: int = INGEST_EMBED_BATCH):
+        self.embed = embed
+        self.batch_size = max(1, batch_size)
+        self.batch: List[Chunk] = []
+
+    def _flush(self) -> List[tuple]:
+        batch, self.batch = self.batch, []
+        return [(batch, self.embed([chunk.text for chunk in batch]))] if batch else []
+
+    def process(self, chunk: Chunk) -> Iterable[tuple]:
+        self.batch.append(chunk)
+        return self._flush() if len(self.batch) >= self.batch_size else []
+
+    def finish(self) -> Iterable[tuple]:
+        return self._flush()
+
+
+class IndexStage(Stage):
+    """Hand embedded batches to the target"""
+
+    name = 'index'
+
+    def __init__(self, target: IngestTarget, progress: Optional[ProgressFn] = None):
+        self.target = target
+        self.progress = progress
+        self.chunks = 0
+
+    def process(self, batch: tuple) -> Iterable[Any]:
+        chunks, vectors = batch
+        self.target.write(chunks, vectors)
+        self.chunks += len(chunks)
+        if self.progress:
+            last = chunks[-1]
+            self.progress('indexing', 0.4 + 0.55 * (last.page + 1) / last.total_pages)
+        return ()
+
+
+_DONE = object()
+
+
+class _Failed(Exception):
+    """Another stage failed; stop quietly"""
+
+
+def run_pipeline(source: Iterable[Any], stages: List[Stage], queue_size: int = INGEST_QUEUE_SIZE) -> None:
+    """
+    Feed source through the stages, one thread each (the source is iterated as the 'parse' stage)
+    Raises the first exception any stage raised.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    failed = threading.Event()
+    errors: List[BaseException] = []
+
+    def put(q: queue.Queue, item: Any, name: str) -> None:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        started = time.perf_counter()
+        while True:
+            if failed.is_set():
+                raise _Failed()
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        STAGE_BLOCKED.inc(time.perf_counter() - started, stage=name)
+
+    def items(q: queue.Queue) -> Iterator[Any]:
+        while True:
+            if failed.is_set():
+                raise _Failed()
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def emit(name: str, outputs: List[Any], outbound: Optional[queue.Queue]) -> None:
+        STAGE_ITEMS.inc(len(outputs), stage=name)
+        if outbound is not None:
+            for output in outputs:
+                put(outbound, output, name)
+
+    def guarded(name: str, body: Callable[[], float]) -> None:
+        busy = 0.0
+        try:
+            busy = body()
+        except _Failed:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+        finally:
+            record_span(f'ingest_{name}', busy)
+
+    def run_source() -> float:
+        busy = 0.0
+        iterator = iter(source)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                busy += time.perf_counter() - started
+            emit('parse', [item], queues[0])
+        put(queues[0], _DONE, 'parse')
+        return busy
+
+    def run_stage(stage: Stage, inbound: queue.Queue, outbound: Optional[queue.Queue]) -> float:
+        # Only process()/finish() count as busy time, not waiting on the inbound queue
+        busy = 0.0
+        for item in items(inbound):
+            started = time.perf_counter()
+            outputs = list(stage.process(item))
+            busy += time.perf_counter() - started
+            emit(stage.name, outputs, outbound)
+        started = time.perf_counter()
+        outputs = list(stage.finish())
+        busy += time.perf_counter() - started
+        emit(stage.name, outputs, outbound)
+        if outbound is not None:
+            put(outbound, _DONE, stage.name)
+        return busy
+
+    # Each thread copies the caller's context so spans land in its request's Server-Timing
+    workers = [threading.Thread(target=contextvars.copy_context().run, args=(guarded, 'parse', run_source),
+                                name='ingest-parse', daemon=True)]
+    for i, stage in enumerate(stages):
+        outbound = queues[i + 1] if i + 1 < len(stages) else None
+        body = (lambda stage=stage, inbound=queues[i], outbound=outbound: run_stage(stage, inbound, outbound))
+        workers.append(threading.Thread(target=contextvars.copy_context().run, args=(guarded, stage.name, body),
+                                        name=f'ingest-{stage.name}', daemon=True))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+
+
+def default_stages(target: IngestTarget, progress: Optional[ProgressFn] = None) -> List[Stage]:
+    return [
+        NormalizeStage(),
+        ChunkStage(target.chunk_size, target.chunk_overlap),
+        DedupeStage(target.name),
+        EmbedStage(target.embed),
+        IndexStage(target, progress),
+    ]
+
+
+def ingest(source: Iterable[Page], target: IngestTarget, progress: Optional[ProgressFn] = None,
+           stages: Optional[List[Stage]] = None) -> Dict:
+    """
+    Run pages through the pipeline into target, then commit it
+
+    Args:
+        source: Pages, e.g. pdf_pages(stream) or text_pages(text)
+        target: Where chunks are embedded and written
+        progress: Optional callback(stage, fraction) for background jobs
+        stages: Replaces default_stages(target, progress)
+
+    Returns:
+        Dict with pages, characters, chunks (written) and duplicates_dropped
+
+    Raises:
+        EmptyDocumentError: No text was found, so nothing was stored or committed
+    """
+    stages = stages if stages is not None else default_stages(target, progress)
+    pages = []
+
+    def counted() -> Iterator[Page]:
+        for page in source:
+            pages.append(page.number)
+            yield page
+
+    run_pipeline(counted(), stages)
+
+    def stat(kind: type, field: str) -> int:
+        return sum(getattr(stage, field) for stage in stages if isinstance(stage, kind))
+
+    indexed = any(isinstance(stage, IndexStage) for stage in stages)
+    if indexed and not stat(IndexStage, 'chunks'):
+        raise EmptyDocumentError(
+            'Could not extract text from the document. A PDF might be image-based or encrypted.')
+    target.commit()
+
+    return {
+        'pages': len(pages),
+        'characters': stat(NormalizeStage, 'characters'),
+        'chunks': stat(IndexStage, 'chunks'),
+        'duplicates_dropped': stat(DedupeStage, 'dropped'),
+    }
@@ -0,0 +1,158 @@
+"""
+jobs.py
+Background job queue for document ingestion
+Uploads enqueue a job and return immediately; a worker pool in the accepting
+process does the parsing, chunking, embedding and indexing. Job records live in
+shared state so any worker can answer status polls.
+"""
+
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from compaction import compaction_scheduler
+from metrics import registry
+from shared_state import SharedCache, shared_state
+
+# Ingestion threads per worker process
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+# Finished jobs are forgotten after this long
+JOB_TTL_SECONDS = float(os.getenv('JOB_TTL_SECONDS', '3600'))
+# Each worker sweeps expired jobs at most this often, in the background
+JOB_PRUNE_INTERVAL_SECONDS = float(os.getenv('JOB_PRUNE_INTERVAL_SECONDS', '60'))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+
+JOBS_TOTAL = registry.counter('app_jobs_total', 'Background jobs by kind and final state', ('kind', 'state'))
+JOBS_IN_FLIGHT = registry.gauge('app_jobs_in_flight', 'Queued or running jobs in this worker', ('kind',))
+JOB_DURATION = registry.histogram('app_job_duration_seconds', 'Background job run time', ('kind',))
+
+# Progress callback handed to job functions: progress(stage, fraction 0..1)
+ProgressFn = Callable[[str, float], None]
+
+
+class JobQueue:
+    """Thread pool that runs jobs and records their state, progress and result"""
+
+    def __init__(self, workers: int = INGEST_WORKERS):
+        self.workers = workers
+        self.records = SharedCache(shared_state, 'jobs')
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {}
+        self._last_prune = float('-inf')
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingest')
+        return self._pool
+
+    def submit(self, kind: str, user_id: str, fn: Callable[[ProgressFn], Dict], **details) -> Dict:
+        """
+        Enqueue a job
+
+        Args:
+            kind: Job type, e.g. 'rag_upload'
+            user_id: Owner of the job
+            fn: Does the work; receives a progress callback and returns the result dict
+            details: Extra fields stored on the record (filename, ...)
+
+        Returns:
+            The queued job record
+        """
+        self._maybe_prune()
+        job = {
+            'job_id': uuid.uuid4().hex[:16],
+            'kind': kind,
+            'user_id': user_id,
+            'state': QUEUED,
+            'stage': 'queued',
+            'progress': 0.0,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+            **details
+        }
+        self.records.put(job['job_id'], job)
+        self._track(kind, 1)
+        self._executor().submit(self._run, job['job_id'], kind, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.records.get(job_id)
+
+    def recent(self, user_id: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        """Most recent jobs, optionally only one user's"""
+        jobs = [job for job in (self.records.get(key) for key in shared_state.keys('jobs')) if job]
+        if user_id:
+            jobs = [job for job in jobs if job['user_id'] == user_id]
+        jobs.sort(key=lambda job: job['created_at'], reverse=True)
+        return jobs[:limit]
+
+    def _maybe_prune(self) -> None:
+        # prune() reads every job record, so it runs off the request path and not on every submit
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune < JOB_PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune = now
+        compaction_scheduler.schedule('jobs', self.prune)
+
+    def prune(self) -> int:
+        """Drop finished jobs older than JOB_TTL_SECONDS; fail jobs stuck that long (their process died)"""
+        cutoff = time.time() - JOB_TTL_SECONDS
+        removed = 0
+        for key in shared_state.keys('jobs'):
+            job = self.records.get(key)
+            if not job:
+                continue
+            if job['finished_at'] and job['finished_at'] < cutoff:
+                self.records.pop(key)
+                removed += 1
+            elif not job['finished_at'] and job['created_at'] < cutoff:
+                self._set(key, state=FAILED, stage='error', error='Job abandoned', finished_at=time.time())
+        return removed
+
+    def _set(self, job_id: str, **changes) -> None:
+        def apply(job: Dict) -> Dict:
+            job.update(changes)
+            return job
+        self.records.update(job_id, apply)
+
+    def _track(self, kind: str, delta: int) -> None:
+        with self._lock:
+            self._in_flight[kind] = self._in_flight.get(kind, 0) + delta
+            JOBS_IN_FLIGHT.set(self._in_flight[kind], kind=kind)
+
+    def _run(self, job_id: str, kind: str, fn: Callable[[ProgressFn], Dict]) -> None:
+        started = time.perf_counter()
+
+        def progress(stage: str, fraction: float) -> None:
+            self._set(job_id, stage=stage, progress=round(min(max(fraction, 0.0), 1.0), 3))
+
+        try:
+            self._set(job_id, state=RUNNING, stage='starting', started_at=time.time())
+            result = fn(progress)
+            state = SUCCEEDED if result.get('status') == 'success' else FAILED
+            self._set(job_id, state=state, stage='done', progress=1.0, result=result,
+                      error=result.get('error'), finished_at=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            state = FAILED
+            self._set(job_id, state=state, stage='error', error=str(e), finished_at=time.time())
+        finally:
+            self._track(kind, -1)
+            JOB_DURATION.observe(time.perf_counter() - started, kind=kind)
+        JOBS_TOTAL.inc(kind=kind, state=state)
+
+
+# Global instance
+job_queue = JobQueue()
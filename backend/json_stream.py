@@ -0,0 +1,97 @@
+"""
+json_stream.py
+Incremental parser for a JSON array of objects arriving in text fragments
+Lets streamed Groq completions hand out each flashcard or quiz question as
+soon as its object closes, instead of waiting for (and depending on) the
+complete array.
+"""
+
+import json
+import re
+from typing import Any, List
+
+# Characters that can change parser state; everything else is skipped in bulk
+_STRUCTURAL = re.compile(r'[\[\]{}"\\]')
+# First non-whitespace character after a position
+_NEXT = re.compile(r'\s*(\S)')
+
+
+class JSONArrayStream:
+    """
+    Feed text fragments, get back each top-level array element once it is complete
+
+    Anything before the array (prose, a ```json fence, an object wrapper like
+    {"flashcards": [...]}) is skipped; a '[' only opens the array when the next
+    non-whitespace character is '{' or ']', so bracketed prose like "[the]" is
+    skipped too, and an array that closes without elements is passed over.
+    Elements that fail to decode are dropped so one malformed object doesn't
+    cost the rest of the stream.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0           # next character of self.text to scan
+        self._depth = 0         # nesting depth; the array itself is depth 1
+        self._started = False   # seen the opening '['
+        self._in_string = False
+        self._escaped = -1      # index of a character escaped by a backslash
+        self._element_start = None
+        self._elements = 0      # elements opened in the current array
+        self.closed = False     # seen the array's closing ']'
+        self.items = 0
+
+    def feed(self, fragment: str) -> List[Any]:
+        """Add a fragment and return the elements it completed, in order"""
+        self.text += fragment
+        completed = []
+        if self.closed:
+            return completed
+
+        for match in _STRUCTURAL.finditer(self.text, self._pos):
+            char = match.group()
+            i = match.start()
+            if i == self._escaped:
+                # The character after a backslash inside a string (\" or \\)
+                continue
+            if self._in_string:
+                if char == '\\':
+                    self._escaped = i + 1
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = self._started
+            elif not self._started:
+                if char == '[':
+                    following = _NEXT.match(self.text, i + 1)
+                    if following is None:
+                        # Wait for the next fragment to tell the array from prose
+                        self._pos = i
+                        return completed
+                    if following.group(1) in '{]':
+                        self._started = True
+                        self._depth = 1
+                        self._elements = 0
+            elif char in '[{':
+                if self._depth == 1:
+                    self._element_start = i
+                    self._elements += 1
+                self._depth += 1
+            elif char in ']}':
+                self._depth -= 1
+                if self._depth == 1 and self._element_start is not None:
+                    try:
+                        completed.append(json.loads(self.text[self._element_start:i + 1]))
+                        self.items += 1
+                    except json.JSONDecodeError:
+                        pass
+                    self._element_start = None
+                elif self._depth == 0 and not self._elements:
+                    # "[]" in prose; keep looking for the real array
+                    self._started = False
+                elif self._depth == 0:
+                    self.closed = True
+                    self._pos = i + 1
+                    return completed
+        self._pos = len(self.text)
+        return completed
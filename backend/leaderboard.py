@@ -0,0 +1,106 @@
+"""
+leaderboard.py
+In-memory leaderboard snapshot, rebuilt on an interval or once enough XP has moved
+Polls are answered from pre-encoded bytes (see http_cache.py); the store is only
+queried when the snapshot is rebuilt.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from http_cache import EncodedJSON, encode_json
+from metrics import registry
+from shared_state import shared_state
+
+# Rebuild at least this often
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv('LEADERBOARD_REFRESH_SECONDS', '10'))
+# ...or as soon as this much XP has been awarded (by any worker) since the last build
+LEADERBOARD_XP_THRESHOLD = int(os.getenv('LEADERBOARD_XP_THRESHOLD', '100'))
+# Entries kept in the snapshot; larger limits are capped to it
+LEADERBOARD_MAX_ENTRIES = int(os.getenv('LEADERBOARD_MAX_ENTRIES', '100'))
+# How often a worker reads the shared XP counter
+XP_CHECK_SECONDS = 1.0
+
+NAMESPACE = 'leaderboard'
+XP_KEY = 'xp_awarded'
+
+LEADERBOARD_REFRESHES = registry.counter(
+    'app_leaderboard_refreshes_total', 'Leaderboard snapshot rebuilds by trigger', ('reason',))
+
+
+def record_xp(amount: int) -> None:
+    """Count awarded XP towards the next snapshot rebuild (called on every XP award)"""
+    if amount:
+        shared_state.update(NAMESPACE, XP_KEY, lambda raw: json.dumps(json.loads(raw or '0') + amount))
+
+
+def xp_awarded() -> int:
+    raw, _ = shared_state.get(NAMESPACE, XP_KEY)
+    return json.loads(raw) if raw else 0
+
+
+class LeaderboardSnapshot:
+    """Top LEADERBOARD_MAX_ENTRIES users plus the encoded response for each requested limit"""
+
+    def __init__(self):
+        # (entries, {limit: encoded payload}), swapped as one so encodings never outlive their entries
+        self._snapshot: Optional[Tuple[List[Dict], Dict[int, EncodedJSON]]] = None
+        self._built_at = 0.0
+        self._built_xp = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _build(self, limit: int) -> List[Dict]:
+        # Imported here so this module stays importable from user_service
+        from user_service import user_service
+        return user_service.get_leaderboard(limit)
+
+    def _stale_reason(self) -> Optional[str]:
+        now = time.time()
+        if self._snapshot is None:
+            return 'initial'
+        if now - self._built_at >= LEADERBOARD_REFRESH_SECONDS:
+            return 'interval'
+        if now - self._checked_at >= XP_CHECK_SECONDS:
+            self._checked_at = now
+            if xp_awarded() - self._built_xp >= LEADERBOARD_XP_THRESHOLD:
+                return 'xp'
+        return None
+
+    def _refresh(self, reason: str) -> None:
+        xp = xp_awarded()
+        self._snapshot = (self._build(LEADERBOARD_MAX_ENTRIES), {})
+        self._built_at = self._checked_at = time.time()
+        self._built_xp = xp
+        LEADERBOARD_REFRESHES.inc(reason=reason)
+
+    def get(self, limit: int) -> EncodedJSON:
+        """Encoded {'status', 'leaderboard'} payload for the top limit users (1..LEADERBOARD_MAX_ENTRIES)"""
+        # Clamped first so arbitrary limits can't grow the per-limit encodings or query the store
+        limit = min(max(limit, 1), LEADERBOARD_MAX_ENTRIES)
+
+        reason = self._stale_reason()
+        if reason == 'initial':
+            with self._lock:
+                if self._snapshot is None:
+                    self._refresh(reason)
+        elif reason and self._lock.acquire(blocking=False):
+            # One thread rebuilds; the others keep serving the current snapshot
+            try:
+                self._refresh(reason)
+            finally:
+                self._lock.release()
+
+        entries, encoded_by_limit = self._snapshot
+        encoded = encoded_by_limit.get(limit)
+        if encoded is None:
+            encoded = encode_json({'status': 'success', 'leaderboard': entries[:limit]})
+            encoded_by_limit[limit] = encoded
+        return encoded
+
+
+# Global instance
+leaderboard_snapshot = LeaderboardSnapshot()
@@ -0,0 +1,114 @@
+"""
+map_reduce.py
+Section-wise generation over long content
+Content above MAP_REDUCE_THRESHOLD is split into sections that are sent to the
+model in parallel (bounded by MAP_CONCURRENCY); the per-section results are then
+merged and deduplicated. A request costs about one section-sized completion in
+latency, however long the document is.
+"""
+
+import contextvars
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, TypeVar
+
+from dedup import SimHashIndex, simhash
+from metrics import registry
+
+# Content longer than this (characters) is processed section by section
+MAP_REDUCE_THRESHOLD = int(os.getenv('MAP_REDUCE_THRESHOLD', '12000'))
+# Target section size; never above the threshold, so a section is never split again
+MAP_SECTION_CHARS = min(int(os.getenv('MAP_SECTION_CHARS', '6000')), MAP_REDUCE_THRESHOLD)
+# Most sections sent to the model for one request (evenly spaced over the document)
+MAP_MAX_SECTIONS = int(os.getenv('MAP_MAX_SECTIONS', '16'))
+# Parallel completions per request
+MAP_CONCURRENCY = int(os.getenv('MAP_CONCURRENCY', '4'))
+# Ask sections for this many times their share so deduplication still fills the request
+OVERSAMPLE = 1.5
+# Generated items (a question, a card front) this many SimHash bits apart count as the same
+ITEM_MAX_DISTANCE = 3
+
+MAP_SECTIONS = registry.counter('app_map_reduce_sections_total', 'Sections sent to the model by map-reduce', ('task',))
+
+T = TypeVar('T')
+
+
+def split_sections(content: str, size: int = MAP_SECTION_CHARS) -> List[str]:
+    """Split content into sections of at most size characters, preferring paragraph then sentence breaks"""
+    sections = []
+    start = 0
+    while start < len(content):
+        end = start + size
+        if end < len(content):
+            # Only look in the back half so sections don't come out tiny
+            floor = start + size // 2
+            cut = content.rfind('\n\n', floor, end)
+            if cut == -1:
+                cut = content.rfind('. ', floor, end)
+            if cut != -1:
+                end = cut + 1
+        section = content[start:end].strip()
+        if section:
+            sections.append(section)
+        start = end
+    return sections
+
+
+def pick_sections(sections: List[str], limit: int) -> List[str]:
+    """At most limit sections, evenly spaced so the whole document is represented"""
+    if len(sections) <= limit:
+        return sections
+    if limit <= 1:
+        return sections[:1]
+    step = (len(sections) - 1) / (limit - 1)
+    return [sections[round(i * step)] for i in range(limit)]
+
+
+def quota(total: int, sections: int, cap: int = 20) -> int:
+    """Items to ask each section for"""
+    return max(1, min(cap, math.ceil(total * OVERSAMPLE / sections)))
+
+
+def run_sections(task: str, fn: Callable[[str], T], sections: List[str],
+                 concurrency: int = MAP_CONCURRENCY) -> List[T]:
+    """Apply fn to every section, at most concurrency at a time; results in section order"""
+    MAP_SECTIONS.inc(len(sections), task=task)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(sections)))) as pool:
+        # Copy the request context per call so spans land in this request's Server-Timing
+        futures = [pool.submit(contextvars.copy_context().run, fn, section) for section in sections]
+        return [future.result() for future in futures]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'\W+', ' ', text.lower()).strip()
+
+
+def merge_items(per_section: List[List[Dict]], key: Callable[[Dict], str], limit: int) -> List[Dict]:
+    """
+    Interleave the sections' items (first of each section, then second, ...) and
+    keep the first limit that are neither exact nor near duplicates of one already kept
+
+    Args:
+        per_section: Generated items, one list per section in document order
+        key: Text that identifies an item (question, card front)
+        limit: Number of items wanted
+    """
+    index = SimHashIndex(ITEM_MAX_DISTANCE)
+    seen = set()
+    merged = []
+    for position in range(max((len(items) for items in per_section), default=0)):
+        for items in per_section:
+            if position >= len(items) or not isinstance(items[position], dict):
+                continue
+            text = _normalize(key(items[position]) or '')
+            fingerprint = simhash(text)
+            if not text or text in seen or index.contains_near(fingerprint):
+                continue
+            seen.add(text)
+            index.add(fingerprint)
+            merged.append(items[position])
+            if len(merged) == limit:
+                return merged
+    return merged
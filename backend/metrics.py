@@ -0,0 +1,219 @@
+"""
+metrics.py
+In-process metrics: counters, gauges, latency histograms and per-request spans
+Rendered in Prometheus text format by the /metrics endpoint
+"""
+
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds (Prometheus client defaults, extended for LLM calls)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value:g}')
+        return lines
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value:g}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = 'le="%g"' % bound
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {count}')
+                le = 'le="+Inf"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {series[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {series[-2]:.6f}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """Holds every metric of this process"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    'app_http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'))
+REQUESTS_TOTAL = registry.counter(
+    'app_http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+SPAN_DURATION = registry.histogram(
+    'app_span_duration_seconds', 'Time spent in an instrumented stage or service method', ('span',))
+SPAN_ERRORS = registry.counter(
+    'app_span_errors_total', 'Instrumented stages that raised an exception', ('span',))
+
+# Spans recorded during the current request: list of (name, seconds)
+_request_spans: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    'request_spans', default=None)
+
+
+def start_request() -> None:
+    """Begin collecting spans for the current request (used for Server-Timing)"""
+    _request_spans.set([])
+
+
+def request_spans() -> List[Tuple[str, float]]:
+    return _request_spans.get() or []
+
+
+@contextmanager
+def span(name: str):
+    """Time a block: feeds the span histogram and the current request's breakdown"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        SPAN_ERRORS.inc(span=name)
+        raise
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def record_span(name: str, seconds: float) -> None:
+    """Record a span timed elsewhere (e.g. the summed busy time of a pipeline stage)"""
+    SPAN_DURATION.observe(seconds, span=name)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def timed(name: str) -> Callable:
+    """Decorator form of span()"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(total_seconds: float) -> str:
+    """Server-Timing value: summed duration per span name plus the request total"""
+    totals: Dict[str, float] = {}
+    for name, seconds in request_spans():
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items()]
+    entries.append(f'total;dur={total_seconds * 1000:.1f}')
+    return ', '.join(entries)
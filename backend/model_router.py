@@ -0,0 +1,205 @@
+"""
+model_router.py
+Latency-aware routing of Groq completions to model tiers
+Each task maps to a preferred tier and reasoning effort (lowered for small
+inputs). Observed latency and error rates per model and task are tracked as
+moving averages; a tier expected to blow the task's latency budget, or failing
+too often, is skipped for the next faster one, and a call that failed for a
+transient reason (timeout, connection error, 429 or 5xx) is retried once per
+faster tier. Bad requests are raised straight away.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import registry, span
+
+# Tiers from most capable (slowest) to fastest
+TIERS = {
+    'large': os.getenv('MODEL_TIER_LARGE', 'openai/gpt-oss-120b'),
+    'fast': os.getenv('MODEL_TIER_FAST', 'openai/gpt-oss-20b'),
+}
+TIER_ORDER = ['large', 'fast']
+
+# false = every task uses its preferred tier and effort, no failover
+MODEL_ROUTING = os.getenv('MODEL_ROUTING', 'true').lower() == 'true'
+# A model failing more than this share of recent calls is skipped
+ROUTER_ERROR_THRESHOLD = float(os.getenv('ROUTER_ERROR_THRESHOLD', '0.5'))
+# Observations older than this are forgotten, so a skipped tier gets retried
+ROUTER_STATS_TTL = float(os.getenv('ROUTER_STATS_TTL', '120'))
+# Inputs shorter than this (characters) use one step less reasoning effort
+SMALL_INPUT_CHARS = int(os.getenv('SMALL_INPUT_CHARS', '1500'))
+
+EWMA_ALPHA = 0.2
+MIN_SAMPLES = 3
+EFFORTS = ['low', 'medium', 'high']
+
+
+class Policy(NamedTuple):
+    tier: str
+    effort: str
+    budget: float  # seconds
+
+
+TASK_POLICY: Dict[str, Policy] = {
+    'general': Policy('large', 'medium', 15.0),
+    'quiz': Policy('large', 'medium', 20.0),
+    'flashcards': Policy('large', 'medium', 25.0),
+    # Streams are budgeted on time to first byte
+    'quiz_stream': Policy('large', 'medium', 5.0),
+    'flashcards_stream': Policy('large', 'medium', 5.0),
+    'analyze': Policy('fast', 'medium', 10.0),
+    'distractors': Policy('fast', 'low', 6.0),
+    'rag_answer': Policy('large', 'medium', 12.0),
+    'rag_query': Policy('fast', 'medium', 10.0),
+}
+
+MODEL_REQUESTS = registry.counter(
+    'app_model_requests_total', 'Completions by model, task and outcome', ('model', 'task', 'outcome'))
+MODEL_LATENCY = registry.histogram('app_model_latency_seconds', 'Completion latency by model', ('model',))
+MODEL_FAILOVERS = registry.counter(
+    'app_model_failovers_total', 'Tier skipped or retried on a faster one', ('task', 'reason'))
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether another model could succeed where this call failed (timeouts, 429, 5xx)"""
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Groq's connection and timeout errors carry no status code; matched by class so
+    # that importing this module doesn't import the Groq SDK
+    return any(cls.__name__ == 'APIConnectionError' and cls.__module__.startswith('groq')
+               for cls in type(error).__mro__)
+
+
+class ModelRouter:
+    """Picks a model and reasoning effort per call and learns from the outcomes"""
+
+    def __init__(self, tiers: Dict[str, str] = TIERS, policies: Dict[str, Policy] = TASK_POLICY,
+                 enabled: bool = MODEL_ROUTING):
+        self.tiers = tiers
+        self.policies = policies
+        self.enabled = enabled
+        self._stats: Dict[Tuple[str, str], Dict] = {}  # (model, task) -> moving averages
+        self._lock = threading.Lock()
+
+    def route(self, task: str, size: int = 0) -> List[Tuple[str, str]]:
+        """
+        Candidate (model, reasoning effort) pairs for a call, best first
+
+        Args:
+            task: Key of TASK_POLICY ('general' if unknown)
+            size: Input length in characters
+        """
+        policy = self.policies.get(task, self.policies['general'])
+        effort = policy.effort
+        if self.enabled and size and size < SMALL_INPUT_CHARS:
+            effort = EFFORTS[max(EFFORTS.index(effort) - 1, 0)]
+
+        tiers = TIER_ORDER[TIER_ORDER.index(policy.tier):]
+        if not self.enabled:
+            return [(self.tiers[tiers[0]], effort)]
+
+        # Skip tiers that would miss the budget or keep failing, but always keep the fastest
+        while len(tiers) > 1:
+            reason = self._unfit(self.tiers[tiers[0]], task, policy.budget)
+            if reason is None:
+                break
+            MODEL_FAILOVERS.inc(task=task, reason=reason)
+            tiers = tiers[1:]
+        return [(self.tiers[tier], effort) for tier in tiers]
+
+    def complete(self, task: str, size: int, call: Callable[[str, str], Any]) -> Any:
+        """
+        Run call(model, reasoning_effort) on the routed model, failing over to faster tiers on
+        transient errors
+
+        Each attempt is timed as the 'groq_completion' span. Other errors (4xx, validation)
+        are raised without a retry and don't count against the model.
+        """
+        candidates = self.route(task, size)
+        for attempt, (model, effort) in enumerate(candidates):
+            started = time.perf_counter()
+            try:
+                with span('groq_completion'):
+                    response = call(model, effort)
+            except Exception as e:
+                if not is_transient(e):
+                    MODEL_REQUESTS.inc(model=model, task=task, outcome='rejected')
+                    raise
+                self._observe(model, task, time.perf_counter() - started, failed=True)
+                if attempt == len(candidates) - 1:
+                    raise
+                MODEL_FAILOVERS.inc(task=task, reason='error')
+                continue
+            self._observe(model, task, time.perf_counter() - started, failed=False)
+            return response
+
+    def stats(self) -> Dict:
+        """Routing table and current moving averages, for /api/models"""
+        now = time.time()
+        with self._lock:
+            observed = [
+                {
+                    'model': model,
+                    'task': task,
+                    'latency_seconds': round(s['latency'], 3) if s['latency'] is not None else None,
+                    'error_rate': round(s['error_rate'], 3),
+                    'samples': s['samples'],
+                    'age_seconds': round(now - s['updated'], 1)
+                }
+                for (model, task), s in self._stats.items()
+            ]
+        return {
+            'enabled': self.enabled,
+            'tiers': self.tiers,
+            'policies': {task: policy._asdict() for task, policy in self.policies.items()},
+            'observed': observed
+        }
+
+    def _fresh(self, model: str, task: str) -> Optional[Dict]:
+        s = self._stats.get((model, task))
+        if s is not None and time.time() - s['updated'] > ROUTER_STATS_TTL:
+            del self._stats[(model, task)]
+            return None
+        return s
+
+    def _unfit(self, model: str, task: str, budget: float) -> Optional[str]:
+        """Why a model should be skipped for a task right now (None if it is fine)"""
+        with self._lock:
+            s = self._fresh(model, task)
+            if s is None or s['samples'] < MIN_SAMPLES:
+                return None
+            if s['error_rate'] > ROUTER_ERROR_THRESHOLD:
+                return 'errors'
+            if s['latency'] is not None and s['latency'] > budget:
+                return 'latency'
+        return None
+
+    def _observe(self, model: str, task: str, seconds: float, failed: bool) -> None:
+        MODEL_REQUESTS.inc(model=model, task=task, outcome='error' if failed else 'success')
+        MODEL_LATENCY.observe(seconds, model=model)
+        with self._lock:
+            s = self._fresh(model, task)
+            if s is None:
+                self._stats[(model, task)] = {
+                    'latency': None if failed else seconds, 'error_rate': float(failed), 'samples': 1,
+                    'updated': time.time()
+                }
+                return
+            # A failed call's duration says little about the model's latency, so only successes set it
+            if not failed and s['latency'] is None:
+                s['latency'] = seconds
+            elif not failed:
+                s['latency'] += EWMA_ALPHA * (seconds - s['latency'])
+            s['error_rate'] += EWMA_ALPHA * (float(failed) - s['error_rate'])
+            s['samples'] += 1
+            s['updated'] = time.time()
+
+
+# Global instance
+model_router = ModelRouter()
@@ -0,0 +1,154 @@
+"""
+pdf_cache.py
+On-disk cache of the text extracted from PDFs, keyed by the SHA-256 of the PDF bytes
+One zlib-compressed file per document holds the page count, the byte length of
+each page and the UTF-8 page texts. Ingesting the same bytes again (re-uploads,
+the Smol training guide) reads the pages from here instead of parsing the PDF.
+The directory is kept under PDF_CACHE_MAX_MB by evicting the least recently
+used files; files are written atomically, so workers can share the directory.
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+from typing import BinaryIO, List, Optional
+
+from metrics import registry
+
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', './chroma_db/pdf_text')
+# Disk budget of the cache (0 disables it)
+PDF_CACHE_MAX_MB = float(os.getenv('PDF_CACHE_MAX_MB', '256'))
+
+MAGIC = b'PTX1'
+SUFFIX = '.ptx'
+
+PDF_CACHE_LOOKUPS = registry.counter('app_pdf_cache_lookups_total', 'Parsed-text cache lookups', ('result',))
+PDF_CACHE_EVICTIONS = registry.counter('app_pdf_cache_evictions_total', 'Parsed-text cache files evicted')
+PDF_CACHE_BYTES = registry.gauge('app_pdf_cache_bytes', 'Size of the parsed-text cache directory')
+
+
+def content_hash(stream: BinaryIO, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a seekable binary stream's bytes (the stream is rewound afterwards)"""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def encode_pages(pages: List[str]) -> bytes:
+    encoded = [page.encode('utf-8') for page in pages]
+    lengths = array('I', [len(page) for page in encoded])
+    return zlib.compress(MAGIC + struct.pack('<I', len(encoded)) + lengths.tobytes() + b''.join(encoded))
+
+
+def decode_pages(data: bytes) -> List[str]:
+    raw = zlib.decompress(data)
+    if raw[:4] != MAGIC:
+        raise ValueError('Not a parsed-text cache file')
+    (count,) = struct.unpack_from('<I', raw, 4)
+    lengths = array('I')
+    lengths.frombytes(raw[8:8 + 4 * count])
+    pages = []
+    offset = 8 + 4 * count
+    for length in lengths:
+        pages.append(raw[offset:offset + length].decode('utf-8'))
+        offset += length
+    if offset != len(raw):
+        raise ValueError('Truncated parsed-text cache file')
+    return pages
+
+
+class PdfTextCache:
+    """Page texts of parsed PDFs in a size-bounded directory, one file per content hash"""
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, max_mb: float = PDF_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()  # eviction scans of this worker
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest + SUFFIX)
+
+    def get(self, digest: str) -> Optional[List[str]]:
+        """Page texts stored for a content hash, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                pages = decode_pages(f.read())
+            os.utime(path)  # mtime is the recency used for eviction
+        except FileNotFoundError:
+            PDF_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        except (OSError, ValueError, zlib.error, UnicodeDecodeError) as e:
+            print(f"⚠️  Discarding unreadable parsed-text cache file {path}: {e}")
+            self._remove(path)
+            PDF_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        PDF_CACHE_LOOKUPS.inc(result='hit')
+        return pages
+
+    def put(self, digest: str, pages: List[str]) -> None:
+        """Store the page texts of a parsed PDF, then evict down to the budget"""
+        if not self.enabled:
+            return
+        data = encode_pages(pages)
+        if len(data) > self.max_bytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(digest))
+        except OSError as e:
+            print(f"⚠️  Could not write parsed-text cache file: {e}")
+            return
+        self.evict()
+
+    def evict(self) -> int:
+        """Remove least recently used files until the directory fits the budget"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # evicted by another worker
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                evicted += 1
+            PDF_CACHE_EVICTIONS.inc(evicted)
+            PDF_CACHE_BYTES.set(total)
+            return evicted
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Global instance
+pdf_text_cache = PdfTextCache()
@@ -0,0 +1,294 @@
+"""
+profiler.py
+Opt-in sampling profiler for live requests
+A background thread samples the stacks of profiled request threads with
+sys._current_frames() and writes collapsed stacks (flamegraph.pl / speedscope
+compatible) per route. Settings live in shared state so a runtime toggle
+reaches every worker without a restart.
+"""
+
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from metrics import registry
+from shared_state import shared_state
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', './profiles')
+# Workers re-read the shared settings at most this often
+PROFILER_REFRESH_SECONDS = 2.0
+# Oldest profiles of a route are deleted past this count
+PROFILE_MAX_FILES_PER_ROUTE = 50
+MAX_STACK_DEPTH = 128
+
+DEFAULT_SETTINGS = {
+    'enabled': os.getenv('PROFILER_ENABLED', 'false').lower() == 'true',
+    # Fraction of requests profiled and always written
+    'sample_rate': float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+    # Requests at least this slow are written too (0 disables; all requests are sampled while enabled)
+    'slow_ms': float(os.getenv('PROFILE_SLOW_MS', '1000')),
+    'interval_ms': float(os.getenv('PROFILE_INTERVAL_MS', '5')),
+    # Only profile these routes (empty = all)
+    'routes': [],
+}
+
+
+def _number(name: str, value, minimum: float, maximum: float = math.inf,
+            exclusive_minimum: bool = False) -> float:
+    """A finite number in range; numeric strings are accepted, booleans are not"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{name} must be a number")
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number") from None
+    below = number <= minimum if exclusive_minimum else number < minimum
+    if not math.isfinite(number) or below or number > maximum:
+        if maximum != math.inf:
+            raise ValueError(f"{name} must be between {minimum:g} and {maximum:g}")
+        raise ValueError(f"{name} must be {'>' if exclusive_minimum else '>='} {minimum:g}")
+    return number
+
+
+def _flag(name: str, value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    raise ValueError(f"{name} must be true or false")
+
+
+def _routes(name: str, value) -> List[str]:
+    if not isinstance(value, list) or not all(isinstance(route, str) for route in value):
+        raise ValueError(f"{name} must be a list of route paths")
+    return value
+
+
+# Parses one setting, raising ValueError for a value of the wrong type or range
+SETTING_PARSERS = {
+    'enabled': _flag,
+    'sample_rate': lambda name, value: _number(name, value, 0.0, 1.0),
+    'slow_ms': lambda name, value: _number(name, value, 0.0),
+    'interval_ms': lambda name, value: _number(name, value, 0.0, exclusive_minimum=True),
+    'routes': _routes,
+}
+
+
+def validate_settings(changes: Dict) -> Dict:
+    """Parsed copy of setting changes; ValueError names the first unknown or invalid one"""
+    unknown = set(changes) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown profiler settings: {', '.join(sorted(unknown))}")
+    return {name: SETTING_PARSERS[name](name, value) for name, value in changes.items()}
+
+
+def _sanitize(stored: Dict) -> Dict:
+    """Settings from shared state with unknown or invalid entries replaced by the defaults"""
+    settings = dict(DEFAULT_SETTINGS)
+    for name, value in stored.items():
+        try:
+            settings.update(validate_settings({name: value}))
+        except ValueError as e:
+            print(f"⚠️  Ignoring stored profiler setting: {e}")
+    return settings
+
+
+PROFILES_WRITTEN = registry.counter(
+    'app_profiles_written_total', 'Request profiles written to disk', ('route', 'reason'))
+
+
+class _Session:
+    __slots__ = ('thread_id', 'forced', 'started', 'stacks')
+
+    def __init__(self, thread_id: int, forced: bool):
+        self.thread_id = thread_id
+        self.forced = forced
+        self.started = time.perf_counter()
+        self.stacks: Counter = Counter()
+
+
+def _frame_label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+def _collapse(frame) -> str:
+    """Root-first 'a;b;c' stack for one sampled frame"""
+    labels: List[str] = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+def _route_slug(route: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', route.strip('/')) or 'root'
+
+
+class SamplingProfiler:
+    """Samples the threads of in-flight profiled requests at a fixed interval"""
+
+    def __init__(self, output_dir: str = PROFILE_DIR):
+        self.output_dir = output_dir
+        self._settings = dict(DEFAULT_SETTINGS)
+        self._settings_version = -1
+        self._checked_at = 0.0
+        self._active: Dict[int, _Session] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # Settings
+
+    def settings(self) -> Dict:
+        """Current settings, refreshed from shared state at most every few seconds"""
+        now = time.monotonic()
+        if now - self._checked_at >= PROFILER_REFRESH_SECONDS:
+            self._checked_at = now
+            try:
+                version = shared_state.version('profiler', 'settings')
+                if version != self._settings_version:
+                    raw, version = shared_state.get('profiler', 'settings')
+                    self._settings = _sanitize(json.loads(raw) if raw else {})
+                    self._settings_version = version
+            except Exception as e:
+                print(f"⚠️  Profiler settings unavailable: {e}")
+        return self._settings
+
+    def configure(self, **changes) -> Dict:
+        """
+        Change settings for every worker
+
+        Args:
+            changes: Any of enabled (bool), sample_rate (0..1), slow_ms (>= 0),
+                interval_ms (> 0), routes (list of paths)
+
+        Returns:
+            The new settings
+
+        Raises:
+            ValueError: Unknown setting, or a value of the wrong type or range
+        """
+        changes = validate_settings(changes)
+
+        def apply(raw: Optional[str]) -> str:
+            return json.dumps({**_sanitize(json.loads(raw) if raw else {}), **changes})
+
+        raw, version = shared_state.update('profiler', 'settings', apply)
+        self._settings = json.loads(raw)
+        self._settings_version = version
+        self._checked_at = time.monotonic()
+        return self._settings
+
+    # Request hooks
+
+    def begin(self, route: str) -> Optional[_Session]:
+        """Start sampling the calling thread if profiling is on for this request"""
+        settings = self.settings()
+        if not settings['enabled'] or (settings['routes'] and route not in settings['routes']):
+            return None
+
+        forced = random.random() < settings['sample_rate']
+        if not forced and not settings['slow_ms']:
+            return None
+
+        session = _Session(threading.get_ident(), forced)
+        with self._lock:
+            self._active[session.thread_id] = session
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return session
+
+    def end(self, session: Optional[_Session], route: str, method: str = 'GET') -> Optional[str]:
+        """Stop sampling; write the profile if it was picked by rate or ran slow"""
+        if session is None:
+            return None
+        with self._lock:
+            self._active.pop(session.thread_id, None)
+
+        elapsed_ms = (time.perf_counter() - session.started) * 1000
+        slow_ms = self.settings()['slow_ms']
+        if session.forced:
+            reason = 'sampled'
+        elif slow_ms and elapsed_ms >= slow_ms:
+            reason = 'slow'
+        else:
+            return None
+        if not session.stacks:
+            return None
+
+        try:
+            path = self._write(session, route, method, elapsed_ms)
+        except OSError as e:
+            print(f"⚠️  Could not write profile: {e}")
+            return None
+        PROFILES_WRITTEN.inc(route=route, reason=reason)
+        return path
+
+    # Sampler
+
+    def _run(self) -> None:
+        while True:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            # Sample under the lock so end() never sees a session still being written
+            with self._lock:
+                frames = sys._current_frames()
+                for session in self._active.values():
+                    frame = frames.get(session.thread_id)
+                    if frame is not None:
+                        session.stacks[_collapse(frame)] += 1
+                del frames
+            time.sleep(max(self._settings['interval_ms'], 1) / 1000)
+
+    # Output
+
+    def _route_dir(self, route: str) -> str:
+        return os.path.join(self.output_dir, _route_slug(route))
+
+    def _write(self, session: _Session, route: str, method: str, elapsed_ms: float) -> str:
+        directory = self._route_dir(route)
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(directory, f"{stamp}_{method}_{elapsed_ms:.0f}ms_{os.getpid()}.folded")
+        with open(path, 'w') as f:
+            for stack, count in session.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        existing = sorted(os.listdir(directory))
+        for name in existing[:-PROFILE_MAX_FILES_PER_ROUTE]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        return path
+
+    def list_profiles(self, limit: int = 20) -> List[Dict]:
+        """Most recent profiles across routes"""
+        profiles = []
+        if os.path.isdir(self.output_dir):
+            for route_dir in os.listdir(self.output_dir):
+                directory = os.path.join(self.output_dir, route_dir)
+                if not os.path.isdir(directory):
+                    continue
+                for name in os.listdir(directory):
+                    profiles.append({'route': route_dir, 'file': os.path.join(directory, name)})
+        profiles.sort(key=lambda p: os.path.basename(p['file']), reverse=True)
+        return profiles[:limit]
+
+
+# Global instance
+profiler = SamplingProfiler()
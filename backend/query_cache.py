@@ -0,0 +1,67 @@
+"""
+query_cache.py
+Generation-versioned cache of RAG query results and answers
+Every ingest or delete bumps the collection's generation (shared across workers),
+and the generation is part of the cache key, so a cached result can never be
+served for a corpus that has changed since it was computed.
+"""
+
+import os
+import re
+from typing import Dict, Optional
+
+from lru_cache import LRUCache
+from metrics import registry
+from shared_state import shared_state
+
+# Per-worker result entries (0 disables the cache)
+RAG_CACHE_CAPACITY = int(os.getenv('RAG_CACHE_CAPACITY', '2000'))
+
+GENERATION_NAMESPACE = 'rag_generation'
+
+RAG_CACHE_LOOKUPS = registry.counter(
+    'app_rag_cache_lookups_total', 'RAG result cache lookups', ('store', 'kind', 'result'))
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r'\s+', ' ', query).strip().lower().rstrip('?!. ')
+
+
+class QueryCache:
+    """LRU of query results keyed by (store, kind, user, normalized query, top_k, generation)"""
+
+    def __init__(self, capacity: int = RAG_CACHE_CAPACITY):
+        self.enabled = capacity > 0
+        self.entries = LRUCache(capacity=max(capacity, 1))
+
+    def generation(self, store: str, user_id: str) -> int:
+        """Current generation of a user's collection in one store"""
+        return shared_state.version(GENERATION_NAMESPACE, f"{store}:{user_id}")
+
+    def bump(self, store: str, user_id: str) -> int:
+        """Invalidate every cached result for a user's collection (call on ingest/delete)"""
+        return shared_state.put(GENERATION_NAMESPACE, f"{store}:{user_id}", '')
+
+    def key(self, store: str, kind: str, user_id: str, query: str, top_k: int) -> tuple:
+        """Cache key; read it before computing so a concurrent ingest makes the result unreachable"""
+        return (store, kind, user_id, normalize_query(query), top_k, self.generation(store, user_id))
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        result = self.entries.get(key)
+        RAG_CACHE_LOOKUPS.inc(store=key[0], kind=key[1], result='hit' if result is not None else 'miss')
+        # Copy so callers can add fields (xp_data, answer) without touching the cached entry
+        return {**result, 'cached': True} if result is not None else None
+
+    def put(self, key: tuple, result: Dict) -> None:
+        if self.enabled and result.get('status') == 'success':
+            self.entries.put(key, {k: v for k, v in result.items() if k != 'cached'})
+
+    def stats(self) -> Dict:
+        return {'enabled': self.enabled, **self.entries.stats()}
+
+
+# Global instance
+query_cache = QueryCache()
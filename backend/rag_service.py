@@ -4,19 +4,69 @@ Improved RAG system using Google Gemini embeddings and ChromaDB
 """
 
 import os
-from typing import Dict, List
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import hashlib
+import uuid
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Set, Tuple, Union
+import chromadb
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
 from dotenv import load_dotenv
+from compaction import compaction_scheduler
+from shared_state import SharedCache, shared_state
+from metrics import span, timed
+from query_cache import query_cache
+from ingestion import Chunk, IngestTarget, ingest, pdf_pages
+from sharding import SHARD_SIZE, merge_top_k, shard_searcher
+from rerank import fetch_count, rerank
 
 load_dotenv()
 
 # ChromaDB storage path
 CHROMA_DB_PATH = "./chroma_db"
 
+class _ChromaTarget(IngestTarget):
+    """Ingestion target for a user's sharded Chroma collections: Gemini embeddings, written batch by batch"""
+    
+    name = 'chroma'
+    chunk_size = 1000
+    chunk_overlap = 200
+    
+    def __init__(self, service: 'RAGService', user_id: str, filename: str, doc_id: str):
+        self.service = service
+        self.user_id = user_id
+        self.filename = filename
+        self.doc_id = doc_id
+        self.ids: Set[str] = set()  # chunks written so far, tombstoned if the ingest fails
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.service.embeddings.embed_documents(texts)
+    
+    def write(self, chunks: List[Chunk], vectors: List[Any]) -> None:
+        # Each batch tops up the user's last shard or opens new ones
+        for shard, batch in self.service._allocate(self.user_id, list(zip(chunks, vectors))):
+            metadatas = []
+            for chunk, _ in batch:
+                metadata = {
+                    'source': self.filename,
+                    'page': chunk.page,
+                    'total_pages': chunk.total_pages,
+                    'user_id': self.user_id,
+                    'source_file': self.filename,
+                    'doc_id': self.doc_id
+                }
+                metadatas.append(metadata)
+            ids = [str(uuid.uuid4()) for _ in batch]
+            with span('chroma_index'):
+                self.service._get_collection(self.user_id, shard).add(
+                    ids=ids,
+                    embeddings=[vector for _, vector in batch],
+                    documents=[chunk.text for chunk, _ in batch],
+                    metadatas=metadatas
+                )
+            self.ids.update(ids)
+
+
 class RAGService:
     """Improved RAG service with Google Gemini embeddings"""
     
@@ -30,84 +80,211 @@ class RAGService:
             self.embedding_available = True
         except Exception as e:
             print(f"⚠️  Google embeddings unavailable: {e}")
+            # Collections don't need the embedding function, so deletes and compaction keep working
+            self.embeddings = None
             self.embedding_available = False
+        
+        # Chunks are written with precomputed embeddings, so collections are opened
+        # without an embedding function
+        self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        
+        # Chroma chunk ids logically deleted per user (shared across workers),
+        # reclaimed by compaction
+        self._tombstones = SharedCache(shared_state, 'chroma_tombstones')
+        # Number of SHARD_SIZE collections each user's chunks are spread over
+        self._shard_counts = SharedCache(shared_state, 'chroma_shards')
+    
+    def _collection_name(self, user_id: str, shard: int = 0) -> str:
+        """Shard 0 keeps the original per-user collection name"""
+        return f"user_{user_id}" if shard == 0 else f"user_{user_id}_shard{shard}"
+    
+    def _get_collection(self, user_id: str, shard: int = 0) -> Any:
+        """Open (or create) one shard of the user's ChromaDB collection"""
+        return self.client.get_or_create_collection(self._collection_name(user_id, shard), embedding_function=None)
+    
+    def _collections(self, user_id: str) -> List:
+        """Chroma collections for every shard of the user's documents"""
+        return [self._get_collection(user_id, shard) for shard in range(self._shard_counts.get(user_id, 1))]
+    
+    def _allocate(self, user_id: str, chunks: List[Any]) -> List[Tuple[int, List[Any]]]:
+        """
+        Assign new chunks to shards: top up the last shard, then open new ones
+        
+        Concurrent uploads may both top up the same shard, so a shard can end up
+        slightly over SHARD_SIZE; it never affects correctness.
+        """
+        shard = self._shard_counts.get(user_id, 1) - 1
+        room = SHARD_SIZE - self._get_collection(user_id, shard).count()
+        batches = []
+        start = 0
+        while start < len(chunks):
+            if room <= 0:
+                shard += 1
+                room = SHARD_SIZE
+            batches.append((shard, chunks[start:start + room]))
+            start += room
+            room = 0
+        
+        # Publish new shards before indexing so other workers start searching them
+        self._shard_counts.update(user_id, lambda count: max(count, shard + 1), default=lambda: 1)
+        return batches
+    
+    def _live_tombstones(self, user_id: str) -> Set[str]:
+        return set(self._tombstones.get(user_id, []))
     
-    def process_pdf(self, file_path: str, user_id: str) -> Dict:
+    @timed('rag.process_pdf')
+    def process_pdf(self, file_path: str, user_id: str, filename: Optional[str] = None,
+                    replace: bool = False,
+                    progress: Optional[Callable[[str, float], None]] = None) -> Dict:
         """
-        Process PDF and store in ChromaDB
+        Process a PDF file on disk and store it in ChromaDB (see process_pdf_stream)
         
         Args:
             file_path: Path to PDF file
+            filename: Original filename (defaults to the basename of file_path)
+        """
+        try:
+            with open(file_path, 'rb') as stream:
+                return self.process_pdf_stream(stream, user_id, filename or os.path.basename(file_path),
+                                               replace=replace, progress=progress)
+        except OSError as e:
+            return {
+                'status': 'failed',
+                'error': str(e)
+            }
+    
+    @timed('rag.process_pdf_stream')
+    def process_pdf_stream(self, stream: BinaryIO, user_id: str, filename: str,
+                           replace: bool = False,
+                           progress: Optional[Callable[[str, float], None]] = None) -> Dict:
+        """
+        Process a PDF from a seekable binary stream (in-memory or spooled upload) and store in ChromaDB
+        
+        Args:
+            stream: Binary file object positioned anywhere; read from the start
             user_id: User identifier
+            filename: Original filename
+            replace: Tombstone earlier uploads with the same filename once the new copy is stored
+            progress: Optional callback(stage, fraction) for background jobs
             
         Returns:
             Dict with processing results
         """
         try:
-            # Load PDF
-            loader = PyPDFLoader(file_path)
-            documents = loader.load()
-            
-            # Split into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
-            )
-            chunks = text_splitter.split_documents(documents)
-            
-            # Add user_id to metadata for isolation
-            for chunk in chunks:
-                chunk.metadata['user_id'] = user_id
-                chunk.metadata['source_file'] = os.path.basename(file_path)
-            
-            # Create/update ChromaDB collection for this user
-            collection_name = f"user_{user_id}"
-            vector_db = Chroma.from_documents(
-                documents=chunks,
-                embedding=self.embeddings,
-                persist_directory=CHROMA_DB_PATH,
-                collection_name=collection_name
-            )
+            replacing = self._find_chunks(user_id, filename=filename) if replace else (set(), set())
+            return self._ingest_stream(stream, user_id, filename, replacing, progress)
+        except Exception as e:
+            return {
+                'status': 'failed',
+                'error': str(e)
+            }
+    
+    def _ingest_stream(self, stream: BinaryIO, user_id: str, filename: str,
+                       replacing: Tuple[Set[str], Set[str]],
+                       progress: Optional[Callable[[str, float], None]] = None) -> Dict:
+        """
+        Ingest a PDF as a new document; the (chunk ids, doc_ids) it replaces are tombstoned only if it succeeds
+        Batches are written as they are embedded, so on failure the chunks already written are tombstoned.
+        """
+        target = None
+        try:
+            doc_id = hashlib.md5(f"{user_id}_{filename}_{datetime.now()}".encode()).hexdigest()[:12]
+            progress = progress or (lambda stage, fraction: None)
+            replaced_chunks, replaced_doc_ids = replacing
+            
+            # parse -> normalize -> chunk -> dedupe -> embed -> index, stages overlapping (see ingestion.py)
+            progress('parsing', 0.05)
+            target = _ChromaTarget(self, user_id, filename, doc_id)
+            stats = ingest(pdf_pages(stream, progress), target, progress)
             
-            print(f"✅ Processed {len(chunks)} chunks for user {user_id}")
+            # The new copy is stored: retire the old one
+            self._tombstone(user_id, replaced_chunks)
+            if target.ids:
+                query_cache.bump('chroma', user_id)
+            
+            print(f"✅ Processed {stats['chunks']} chunks for user {user_id} ({stats['duplicates_dropped']} near-duplicates dropped)")
             
             return {
                 'status': 'success',
-                'chunks_processed': len(chunks),
-                'filename': os.path.basename(file_path),
-                'collection': collection_name
+                'doc_id': doc_id,
+                'chunks_processed': stats['chunks'],
+                'duplicates_dropped': stats['duplicates_dropped'],
+                'pages_processed': stats['pages'],
+                'filename': filename,
+                'collection': self._collection_name(user_id),
+                'shards': self._shard_counts.get(user_id, 1),
+                'replaced_doc_ids': sorted(replaced_doc_ids) if replaced_chunks else []
             }
             
         except Exception as e:
+            if target is not None:
+                # A partial copy must not answer queries (this also bumps the query cache)
+                self._tombstone(user_id, target.ids)
             return {
                 'status': 'failed',
                 'error': str(e)
             }
     
-    def query(self, user_id: str, query: str, top_k: int = 3) -> Dict:
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed several queries in one batched call"""
+        if len(queries) == 1:
+            return [self.embeddings.embed_query(queries[0])]
+        try:
+            return self.embeddings.embed_documents(queries, task_type="RETRIEVAL_QUERY")
+        except TypeError:
+            # Embedding backends without task types
+            return self.embeddings.embed_documents(queries)
+    
+    def _search(self, user_id: str, queries: List[str], top_k: int) -> List[Dict]:
         """
-        Query user's documents
-        
-        Args:
-            user_id: User identifier
-            query: Search query
-            top_k: Number of results
-            
-        Returns:
-            Dict with results
+        Embed all queries at once, then search every shard in parallel with
+        a single call per shard, merge each query's over-fetched candidates
+        and re-rank them with MMR down to top_k
         """
-        try:
-            collection_name = f"user_{user_id}"
-            
-            # Load existing ChromaDB collection
-            vector_db = Chroma(
-                persist_directory=CHROMA_DB_PATH,
-                embedding_function=self.embeddings,
-                collection_name=collection_name
+        collections = self._collections(user_id)
+        tombstones = self._live_tombstones(user_id)
+        
+        with span('embedding'):
+            query_embeddings = self._embed_queries(queries)
+        
+        fetch_k = fetch_count(top_k)
+        include = ["documents", "metadatas", "distances"]
+        if fetch_k > top_k:
+            include.append("embeddings")  # for MMR
+        
+        def search_shard(collection) -> List[List[Tuple[float, str, str, Dict, Any]]]:
+            # Over-fetch by the number of tombstoned chunks so fetch_k live hits survive filtering
+            raw = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=fetch_k + len(tombstones),
+                include=include
             )
-            
-            # Search for similar documents
-            results = vector_db.similarity_search_with_score(query, k=top_k)
+            embeddings = raw.get('embeddings') if fetch_k > top_k else None
+            return [
+                [
+                    (distance, chunk_id, text, metadata, embeddings[q][i] if embeddings is not None else None)
+                    for i, (chunk_id, text, metadata, distance) in enumerate(zip(
+                        raw['ids'][q], raw['documents'][q], raw['metadatas'][q], raw['distances'][q]
+                    ))
+                    if chunk_id not in tombstones
+                ][:fetch_k]
+                for q in range(len(queries))
+            ]
+        
+        with span('chroma_search'):
+            partials = shard_searcher.map(search_shard, collections, store='chroma')
+        
+        formatted = []
+        for q in range(len(queries)):
+            # Closest first across all shards
+            merged = merge_top_k([partial[q] for partial in partials], fetch_k,
+                                 key=lambda hit: hit[0], reverse=False)
+            with span('mmr'):
+                merged = rerank(query_embeddings[q], merged, [hit[4] for hit in merged], top_k, store='chroma')
+            results = [
+                (Document(page_content=text, metadata=metadata or {}), distance)
+                for distance, chunk_id, text, metadata, _ in merged
+            ]
             
             # Format results
             sources = []
@@ -117,46 +294,86 @@ class RAGService:
                 sources.append({
                     'content': doc.page_content[:200] + "...",
                     'filename': doc.metadata.get('source_file', 'unknown'),
+                    'doc_id': doc.metadata.get('doc_id'),
                     'page': doc.metadata.get('page', 'N/A'),
                     'similarity': round(1 - score, 3)  # Convert distance to similarity
                 })
                 context_parts.append(doc.page_content)
             
             # Combine context for answer generation
-            context = "\n\n".join(context_parts)
-            
-            return {
+            formatted.append({
                 'status': 'success',
-                'context': context,
+                'context': "\n\n".join(context_parts),
                 'sources': sources,
                 'num_results': len(sources)
-            }
+            })
+        return formatted
+    
+    @timed('rag.query')
+    def query(self, user_id: str, query: str, top_k: int = 3) -> Dict:
+        """
+        Query user's documents
+        
+        Args:
+            user_id: User identifier
+            query: Search query
+            top_k: Number of results
+            
+        Returns:
+            Dict with results
+        """
+        return self.query_batch(user_id, [query], top_k)[0]
+    
+    @timed('rag.query_batch')
+    def query_batch(self, user_id: str, queries: List[str], top_k: int = 3) -> List[Dict]:
+        """
+        Query user's documents with several questions at once
+        
+        Cached questions are answered from the result cache; the rest share one
+        batched embedding call and one collection search.
+        
+        Args:
+            user_id: User identifier
+            queries: Search queries
+            top_k: Number of results per query
+            
+        Returns:
+            One result dict per query, in order
+        """
+        results: List[Optional[Dict]] = [None] * len(queries)
+        try:
+            # Repeat queries against an unchanged collection skip embedding and search
+            cache_keys = [query_cache.key('chroma', 'results', user_id, query, top_k) for query in queries]
+            misses = []
+            for i, cache_key in enumerate(cache_keys):
+                results[i] = query_cache.get(cache_key)
+                if results[i] is None:
+                    misses.append(i)
+            
+            if misses:
+                for i, result in zip(misses, self._search(user_id, [queries[i] for i in misses], top_k)):
+                    query_cache.put(cache_keys[i], result)
+                    results[i] = result
+            return results
             
         except Exception as e:
-            return {
-                'status': 'failed',
-                'error': str(e)
-            }
+            return [result or {'status': 'failed', 'error': str(e)} for result in results]
     
+    @timed('rag.get_stats')
     def get_stats(self, user_id: str) -> Dict:
         """Get user's RAG statistics"""
         try:
-            collection_name = f"user_{user_id}"
-            
-            vector_db = Chroma(
-                persist_directory=CHROMA_DB_PATH,
-                embedding_function=self.embeddings,
-                collection_name=collection_name
-            )
+            collection_name = self._collection_name(user_id)
             
             # Get collection stats
-            collection = vector_db._collection
-            count = collection.count()
+            collections = self._collections(user_id)
+            count = sum(collection.count() for collection in collections) - len(self._live_tombstones(user_id))
             
             return {
                 'status': 'success',
                 'total_chunks': count,
-                'collection': collection_name
+                'collection': collection_name,
+                'shards': len(collections)
             }
             
         except Exception as e:
@@ -165,6 +382,117 @@ class RAGService:
                 'total_chunks': 0,
                 'note': 'No documents uploaded yet'
             }
+    
+    @timed('rag.delete_document')
+    def delete_document(self, user_id: str, doc_id: Optional[str] = None,
+                        filename: Optional[str] = None) -> Dict:
+        """
+        Logically delete documents by doc_id and/or filename
+        
+        Matching chunk ids are tombstoned so queries skip them right away;
+        background compaction deletes them from ChromaDB.
+        
+        Args:
+            user_id: User identifier
+            doc_id: Document id returned at upload time
+            filename: Delete every document uploaded under this filename
+            
+        Returns:
+            Dict with the tombstoned doc_ids
+        """
+        if doc_id is None and filename is None:
+            return {'status': 'failed', 'error': 'doc_id or filename is required'}
+        
+        try:
+            chunk_ids, doc_ids = self._find_chunks(user_id, doc_id=doc_id, filename=filename)
+            self._tombstone(user_id, chunk_ids)
+            
+            return {
+                'status': 'success',
+                'deleted_doc_ids': sorted(doc_ids),
+                'chunks_deleted': len(chunk_ids)
+            }
+            
+        except Exception as e:
+            return {
+                'status': 'failed',
+                'error': str(e)
+            }
+    
+    def _find_chunks(self, user_id: str, doc_id: Optional[str] = None,
+                     filename: Optional[str] = None) -> Tuple[Set[str], Set[str]]:
+        """Live chunk ids matching a doc_id and/or filename, and the doc_ids they belong to"""
+        tombstones = self._live_tombstones(user_id)
+        filters = []
+        if doc_id is not None:
+            filters.append({'doc_id': doc_id})
+        if filename is not None:
+            filters.append({'source_file': filename})
+        
+        chunk_ids = set()
+        doc_ids = set()
+        for collection in self._collections(user_id):
+            for where in filters:
+                found = collection.get(where=where, include=["metadatas"])
+                for chunk_id, metadata in zip(found['ids'], found['metadatas']):
+                    if chunk_id not in tombstones:
+                        chunk_ids.add(chunk_id)
+                        doc_ids.add(metadata.get('doc_id') or metadata.get('source_file', 'unknown'))
+        return chunk_ids, doc_ids
+    
+    def _tombstone(self, user_id: str, chunk_ids: Set[str]) -> None:
+        """Hide chunks from queries right away and schedule their physical deletion"""
+        if not chunk_ids:
+            return
+        self._tombstones.update(
+            user_id, lambda tombstones: sorted(set(tombstones) | chunk_ids), default=list
+        )
+        compaction_scheduler.schedule(f"chroma:{user_id}", lambda: self.compact(user_id))
+        query_cache.bump('chroma', user_id)
+    
+    @timed('rag.replace_document')
+    def replace_document(self, pdf: Union[str, BinaryIO], user_id: str, doc_id: str,
+                         filename: Optional[str] = None,
+                         progress: Optional[Callable[[str, float], None]] = None) -> Dict:
+        """Ingest a new PDF (path or binary stream) in place of an existing document, tombstoned once it is stored"""
+        try:
+            replacing = self._find_chunks(user_id, doc_id=doc_id)
+            if not replacing[0]:
+                return {'status': 'failed', 'error': f'Document not found: {doc_id}'}
+            
+            if isinstance(pdf, str):
+                with open(pdf, 'rb') as stream:
+                    return self._ingest_stream(stream, user_id, filename or os.path.basename(pdf),
+                                               replacing, progress)
+            return self._ingest_stream(pdf, user_id, filename or 'document.pdf', replacing, progress)
+        except Exception as e:
+            return {
+                'status': 'failed',
+                'error': str(e)
+            }
+    
+    @timed('rag.compact')
+    def compact(self, user_id: str) -> int:
+        """
+        Physically delete tombstoned chunks from the user's collection
+        
+        Returns:
+            Number of chunks reclaimed
+        """
+        chunk_ids = self._live_tombstones(user_id)
+        if not chunk_ids:
+            return 0
+        
+        # Ids missing from a shard are ignored by Chroma
+        for collection in self._collections(user_id):
+            collection.delete(ids=list(chunk_ids))
+        
+        self._tombstones.update(
+            user_id, lambda tombstones: sorted(set(tombstones) - chunk_ids), default=list
+        )
+        
+        print(f"🧹 Compacted {len(chunk_ids)} chunks for user {user_id}")
+        return len(chunk_ids)
 
 # Create singleton
 rag_service = RAGService()
\ No newline at end of file
@@ -0,0 +1,203 @@
+"""
+rate_limit.py
+Token-bucket admission control for the expensive endpoints
+Every request to a limited endpoint takes its class's cost from the caller's
+bucket and then from one global bucket; when either is short it is rejected
+straight away with 429 and a Retry-After. Buckets live in shared state so the
+limits hold across all workers on the host. A caller is the client address
+(taken from X-Forwarded-For only behind RATE_LIMIT_TRUSTED_PROXIES proxies)
+together with the user id it claims, so claiming someone else's user id never
+drains (or borrows from) their bucket.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import jsonify, request
+
+from compaction import compaction_scheduler
+from metrics import registry
+from shared_state import shared_state
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+# Per-user bucket: burst size and tokens added per second
+RATE_LIMIT_USER_CAPACITY = float(os.getenv('RATE_LIMIT_USER_CAPACITY', '20'))
+RATE_LIMIT_USER_REFILL = float(os.getenv('RATE_LIMIT_USER_REFILL', '0.5'))
+# Shared by everyone (sized to stay under the Groq account's rate limit)
+RATE_LIMIT_GLOBAL_CAPACITY = float(os.getenv('RATE_LIMIT_GLOBAL_CAPACITY', '200'))
+RATE_LIMIT_GLOBAL_REFILL = float(os.getenv('RATE_LIMIT_GLOBAL_REFILL', '5'))
+# Tokens per request by endpoint class, e.g. "upload=5,generate=2,query=1"
+RATE_LIMIT_COSTS = os.getenv('RATE_LIMIT_COSTS', 'upload=5,generate=2,query_batch=4,query=1')
+# Reverse proxies in front of the app; 0 = use the socket address and ignore X-Forwarded-For
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+
+NAMESPACE = 'rate_limit'
+GLOBAL_KEY = '__global__'
+PRUNE_INTERVAL_SECONDS = 60
+
+RATE_LIMIT_DECISIONS = registry.counter(
+    'app_rate_limit_requests_total', 'Admission decisions by endpoint class', ('endpoint_class', 'outcome'))
+RATE_LIMIT_GLOBAL_TOKENS = registry.gauge(
+    'app_rate_limit_global_tokens', 'Tokens left in the global bucket (as last seen by this worker)')
+
+
+def parse_costs(spec: str) -> Dict[str, float]:
+    costs = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, cost = item.split('=', 1)
+            costs[name.strip()] = float(cost)
+    return costs
+
+
+class AdmissionController:
+    """Per-user and global token buckets with per-endpoint-class costs"""
+
+    def __init__(self, enabled: bool = RATE_LIMIT_ENABLED,
+                 user_capacity: float = RATE_LIMIT_USER_CAPACITY, user_refill: float = RATE_LIMIT_USER_REFILL,
+                 global_capacity: float = RATE_LIMIT_GLOBAL_CAPACITY,
+                 global_refill: float = RATE_LIMIT_GLOBAL_REFILL,
+                 costs: Optional[Dict[str, float]] = None):
+        self.enabled = enabled
+        self.user = (user_capacity, user_refill)
+        self.global_ = (global_capacity, global_refill)
+        self.costs = costs if costs is not None else parse_costs(RATE_LIMIT_COSTS)
+        self._last_prune = float('-inf')
+        self._lock = threading.Lock()
+
+    def _adjust(self, key: str, bucket: Tuple[float, float], cost: float) -> Tuple[bool, float, float]:
+        """
+        Refill a bucket, then take cost from it if it has enough (negative cost refunds)
+
+        Returns:
+            Tuple of (admitted, tokens left, seconds until cost would be available)
+        """
+        capacity, refill = bucket
+        cost = min(cost, capacity)  # a cost above capacity could never be admitted
+        now = time.time()
+        outcome = {}
+
+        def apply(raw: Optional[str]) -> str:
+            state = json.loads(raw) if raw else {'tokens': capacity, 'updated': now}
+            tokens = min(capacity, state['tokens'] + max(now - state['updated'], 0) * refill)
+            if tokens >= cost:
+                tokens = min(capacity, tokens - cost)
+                outcome.update(admitted=True, wait=0.0)
+            else:
+                outcome.update(admitted=False, wait=(cost - tokens) / refill if refill > 0 else 3600.0)
+            outcome['tokens'] = tokens
+            return json.dumps({'tokens': tokens, 'updated': now})
+
+        shared_state.update(NAMESPACE, key, apply)
+        return outcome['admitted'], outcome['tokens'], outcome['wait']
+
+    def admit(self, endpoint_class: str, client: str) -> Tuple[bool, Optional[str], float]:
+        """
+        Try to admit one request
+
+        Args:
+            endpoint_class: Key of the cost table
+            client: Client address and user id (see client_id)
+
+        Returns:
+            Tuple of (admitted, rejecting scope 'user' or 'global', seconds to wait)
+        """
+        if not self.enabled:
+            return True, None, 0.0
+        cost = self.costs.get(endpoint_class, 1.0)
+        self._maybe_prune()
+
+        # The user's bucket first, so a rejected abuser never drains the global one
+        admitted, _, wait = self._adjust(f"user:{client}", self.user, cost)
+        if not admitted:
+            RATE_LIMIT_DECISIONS.inc(endpoint_class=endpoint_class, outcome='rejected_user')
+            return False, 'user', wait
+
+        admitted, tokens, wait = self._adjust(GLOBAL_KEY, self.global_, cost)
+        RATE_LIMIT_GLOBAL_TOKENS.set(tokens)
+        if not admitted:
+            self._adjust(f"user:{client}", self.user, -cost)
+            RATE_LIMIT_DECISIONS.inc(endpoint_class=endpoint_class, outcome='rejected_global')
+            return False, 'global', wait
+
+        RATE_LIMIT_DECISIONS.inc(endpoint_class=endpoint_class, outcome='admitted')
+        return True, None, 0.0
+
+    def _maybe_prune(self) -> None:
+        # prune() touches every bucket, so it runs off the request path
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune = now
+        compaction_scheduler.schedule('rate_limit', self.prune)
+
+    def prune(self) -> int:
+        """Forget user buckets idle long enough to have refilled (same as having none)"""
+        capacity, refill = self.user
+        if refill <= 0:
+            return 0
+        # Judged inside the delete, so a bucket used since is kept
+        idle_since = time.time() - capacity / refill
+        return shared_state.delete_stale(NAMESPACE, 'updated', idle_since, keep=(GLOBAL_KEY,))
+
+    def limit(self, endpoint_class: str) -> Callable:
+        """Route decorator: reject with 429 + Retry-After when the caller or the server is over budget"""
+        def decorator(fn: Callable) -> Callable:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                admitted, scope, wait = self.admit(endpoint_class, client_id())
+                if not admitted:
+                    response = jsonify({
+                        'status': 'failed',
+                        'error': 'Too many requests, please slow down' if scope == 'user'
+                                 else 'Server is busy, please retry shortly',
+                        'scope': scope,
+                        'retry_after': round(wait, 2)
+                    })
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+                    return response
+                return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+def client_address() -> str:
+    """
+    The caller's address: the socket peer, or behind RATE_LIMIT_TRUSTED_PROXIES
+    proxies the X-Forwarded-For entry the outermost trusted proxy added
+
+    Entries further left are written by the client and never used.
+    """
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return forwarded[-RATE_LIMIT_TRUSTED_PROXIES]
+    return request.remote_addr or 'unknown'
+
+
+def client_id() -> str:
+    """
+    Whose bucket a request draws from: the client address plus the user id from
+    the X-User-Id header, user_id query arg or user_id in a JSON body
+
+    The user id is client-supplied, so it only splits an address's traffic and
+    never reaches a bucket another address uses. Multipart bodies are
+    deliberately not parsed, so rejecting an upload never reads it.
+    """
+    user_id = request.headers.get('X-User-Id') or request.args.get('user_id')
+    if not user_id and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and body.get('user_id'):
+            user_id = str(body['user_id'])
+    return f"{client_address()}|{user_id or ''}"
+
+
+# Global instance
+admission = AdmissionController()
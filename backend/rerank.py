@@ -0,0 +1,118 @@
+"""
+rerank.py
+Maximal Marginal Relevance re-ranking of over-fetched search candidates
+Searches fetch MMR_FETCH_MULTIPLIER times the requested number of hits, then
+pick them one at a time by relevance to the query minus similarity to the hits
+already picked, so overlapping or near-copied chunks do not crowd the context.
+"""
+
+import os
+from typing import List, Sequence
+
+from metrics import registry
+
+# NumPy import with error handling (pure-Python fallback below)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None  # type: ignore
+    NUMPY_AVAILABLE = False
+
+MMR_ENABLED = os.getenv('MMR_ENABLED', 'true').lower() == 'true'
+# 1.0 ranks by relevance only, 0.0 by diversity only
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.7'))
+# Candidates fetched per requested hit
+MMR_FETCH_MULTIPLIER = int(os.getenv('MMR_FETCH_MULTIPLIER', '4'))
+
+MMR_RERANKS = registry.counter('app_mmr_reranks_total', 'Result lists re-ranked with MMR', ('store',))
+MMR_REORDERED = registry.counter(
+    'app_mmr_reordered_total', 'Hits MMR picked from outside the plain top k', ('store',))
+
+
+def fetch_count(top_k: int) -> int:
+    """Candidates a search should fetch for top_k re-ranked hits"""
+    if not MMR_ENABLED:
+        return top_k
+    return top_k * max(MMR_FETCH_MULTIPLIER, 1)
+
+
+def mmr(query_vector: Sequence[float], candidate_vectors: Sequence[Sequence[float]], k: int,
+        lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    Select k candidates with Maximal Marginal Relevance
+
+    Args:
+        query_vector: Query embedding
+        candidate_vectors: Candidate embeddings, best match first
+        k: Number of candidates to select
+        lambda_mult: Weight of relevance against diversity (0..1)
+
+    Returns:
+        Indices into candidate_vectors in selection order
+    """
+    n = len(candidate_vectors)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    if not NUMPY_AVAILABLE:
+        return _mmr_python(query_vector, candidate_vectors, k, lambda_mult)
+
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    candidates = candidates / norms
+    query = np.asarray(query_vector, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    if query_norm:
+        query = query / query_norm
+
+    relevance = candidates @ query
+    # Candidate-to-candidate cosine similarities in one product
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    # Similarity of each candidate to its closest selected candidate
+    closest = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * closest
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        np.maximum(closest, similarity[pick], out=closest)
+    return selected
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return dot / norm if norm else 0.0
+
+
+def _mmr_python(query_vector: Sequence[float], candidate_vectors: Sequence[Sequence[float]], k: int,
+                lambda_mult: float) -> List[int]:
+    relevance = [_cosine(query_vector, vector) for vector in candidate_vectors]
+    selected = [max(range(len(relevance)), key=relevance.__getitem__)]
+    closest = [_cosine(candidate_vectors[selected[0]], vector) for vector in candidate_vectors]
+    while len(selected) < k:
+        pick = max(
+            (i for i in range(len(relevance)) if i not in selected),
+            key=lambda i: lambda_mult * relevance[i] - (1.0 - lambda_mult) * closest[i]
+        )
+        selected.append(pick)
+        closest = [max(c, _cosine(candidate_vectors[pick], vector)) for c, vector in zip(closest, candidate_vectors)]
+    return selected
+
+
+def rerank(query_vector: Sequence[float], candidates: List, vectors: Sequence[Sequence[float]], k: int,
+           store: str) -> List:
+    """The k candidates MMR selects (candidates and vectors in the same order, best match first)"""
+    if not MMR_ENABLED or len(candidates) <= k:
+        return candidates[:k]
+    order = mmr(query_vector, vectors, k)
+    MMR_RERANKS.inc(store=store)
+    MMR_REORDERED.inc(sum(1 for i in order if i >= k), store=store)
+    return [candidates[i] for i in order]
@@ -0,0 +1,105 @@
+"""
+services.py
+Lazy, on-first-use initialization of the backend subsystems
+Keeps app.py import (and health checks) fast; heavy imports such as langchain,
+chromadb and the Groq/Google clients happen the first time a subsystem is used
+"""
+
+import importlib
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+class LazyService:
+    """Proxy that builds its target on first attribute access and records how long it took"""
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        self._init_seconds: Optional[float] = None
+        self._error: Optional[str] = None
+
+    def get(self) -> Any:
+        """Return the initialized subsystem, initializing it if needed"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    try:
+                        self._instance = self._factory()
+                        self._error = None
+                    except Exception as e:
+                        self._error = str(e)
+                        raise
+                    finally:
+                        self._init_seconds = time.perf_counter() - started
+        return self._instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def report(self) -> Dict:
+        return {
+            'initialized': self.initialized,
+            'init_seconds': round(self._init_seconds, 4) if self._init_seconds is not None else None,
+            'error': self._error
+        }
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.get(), attr)
+
+
+def _module_attr(module: str, attr: Optional[str] = None) -> Callable[[], Any]:
+    def factory() -> Any:
+        loaded = importlib.import_module(module)
+        return getattr(loaded, attr) if attr else loaded
+    return factory
+
+
+# Subsystems, in the order warmup() initializes them
+ai = LazyService('ai', _module_attr('ai_service'))
+rag_service = LazyService('rag', _module_attr('rag_service', 'rag_service'))
+user_service = LazyService('users', _module_attr('user_service', 'user_service'))
+
+SERVICES = {service._name: service for service in (ai, rag_service, user_service)}
+
+
+def warmup(names: Optional[Iterable[str]] = None) -> Dict:
+    """
+    Initialize subsystems ahead of the first request
+
+    Args:
+        names: Subsystems to initialize (default: all)
+
+    Returns:
+        Startup report per subsystem
+
+    Raises:
+        ValueError: If a name is not a known subsystem (nothing is initialized)
+    """
+    names = list(names or SERVICES)
+    unknown = [name for name in names if name not in SERVICES]
+    if unknown:
+        raise ValueError(f"Unknown services: {unknown}. Valid options: {list(SERVICES)}")
+    for name in names:
+        try:
+            SERVICES[name].get()
+        except Exception as e:
+            print(f"⚠️  Warmup failed for {name}: {e}")
+    return startup_report()
+
+
+def warmup_in_background() -> threading.Thread:
+    """Warm every subsystem without blocking the server from accepting requests"""
+    thread = threading.Thread(target=warmup, name='service-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def startup_report() -> Dict:
+    """Initialization state and time for each subsystem"""
+    return {name: service.report() for name, service in SERVICES.items()}
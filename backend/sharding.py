@@ -0,0 +1,78 @@
+"""
+sharding.py
+Scatter-gather search over fixed-size shards of a collection
+Large collections are split into shards of at most SHARD_SIZE chunks; each shard
+is searched for its own top-k on a shared thread pool and the partial results
+are merged with a heap, so query latency follows core count rather than corpus size.
+"""
+
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, List, Optional, Sequence, Tuple, TypeVar
+
+from metrics import registry
+
+# Chunks per shard in both the in-memory vector store and Chroma
+SHARD_SIZE = int(os.getenv('SHARD_SIZE', '5000'))
+# Threads shared by all shard searches in this worker (NumPy and hnswlib release the GIL)
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', str(os.cpu_count() or 4)))
+
+SHARDS_SEARCHED = registry.histogram(
+    'app_search_shards', 'Shards searched per query', ('store',),
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+
+S = TypeVar('S')
+T = TypeVar('T')
+
+
+def shard_ranges(total: int, size: int = SHARD_SIZE) -> List[Tuple[int, int]]:
+    """[start, end) index ranges splitting total items into shards of at most size"""
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def merge_top_k(partials: Sequence[List[T]], k: int, key: Callable[[T], float],
+                reverse: bool = True) -> List[T]:
+    """
+    Merge per-shard results, each already sorted by key, into the overall top k
+
+    Args:
+        partials: One sorted result list per shard
+        k: Number of results to keep
+        key: Score of a result
+        reverse: True when higher scores are better (similarity), False for distances
+    """
+    return list(islice(heapq.merge(*partials, key=key, reverse=reverse), k))
+
+
+class ShardSearcher:
+    """Runs one search function per shard in parallel"""
+
+    def __init__(self, workers: int = SEARCH_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='shard-search')
+        return self._pool
+
+    def map(self, search: Callable[[S], T], shards: Sequence[S], store: str) -> List[T]:
+        """
+        Apply search to every shard and return the partial results in shard order
+
+        A single shard is searched inline so small collections pay no pool overhead.
+        """
+        SHARDS_SEARCHED.observe(len(shards), store=store)
+        if len(shards) <= 1 or self.workers <= 1:
+            return [search(shard) for shard in shards]
+        return list(self._executor().map(search, shards))
+
+
+# Global instance
+shard_searcher = ShardSearcher()
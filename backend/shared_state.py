@@ -0,0 +1,227 @@
+"""
+shared_state.py
+Cross-worker shared state backed by SQLite in WAL mode
+Lets several gunicorn workers see the same RAG documents and tombstones
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional, Tuple
+
+from lru_cache import LRUCache
+
+# SQLite file shared by every worker on the host
+SHARED_STATE_PATH = os.getenv('SHARED_STATE_PATH', './chroma_db/shared_state.db')
+# Decoded entries each SharedCache keeps per worker
+SHARED_CACHE_CAPACITY = int(os.getenv('SHARED_CACHE_CAPACITY', '1024'))
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a SQLite connection tuned for many concurrent readers and one writer"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # Autocommit mode; writers open explicit BEGIN IMMEDIATE transactions
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection):
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection"""
+    # IMMEDIATE takes the write lock up front so concurrent read-modify-writes serialize
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+class SharedState:
+    """Versioned key-value entries shared between worker processes"""
+
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        # One connection per thread; sqlite3 connections are not thread-safe
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            self._local.conn = conn
+        return conn
+
+    def version(self, namespace: str, key: str) -> int:
+        """Current version of an entry (0 if it does not exist)"""
+        row = self._conn().execute(
+            "SELECT version FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, namespace: str, key: str) -> Tuple[Optional[str], int]:
+        """Return (serialized value, version), or (None, 0) if missing"""
+        row = self._conn().execute(
+            "SELECT value, version FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def put(self, namespace: str, key: str, value: str) -> int:
+        """Store a serialized value and bump its version, returns the new version"""
+        with transaction(self._conn()) as conn:
+            return self._write(conn, namespace, key, value)
+
+    def update(self, namespace: str, key: str,
+               fn: Callable[[Optional[str]], str]) -> Tuple[str, int]:
+        """
+        Atomic read-modify-write across workers
+
+        Args:
+            namespace: Entry namespace
+            key: Entry key
+            fn: Receives the current serialized value (or None), returns the new one
+
+        Returns:
+            Tuple of (new serialized value, new version)
+        """
+        with transaction(self._conn()) as conn:
+            row = conn.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            value = fn(row[0] if row else None)
+            return value, self._write(conn, namespace, key, value)
+
+    def keys(self, namespace: str) -> List[str]:
+        """All keys currently stored in a namespace"""
+        rows = self._conn().execute(
+            "SELECT key FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._conn().execute(
+            "DELETE FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        )
+
+    def delete_stale(self, namespace: str, field: str, before: float, keep: Tuple[str, ...] = ()) -> int:
+        """
+        Delete the entries of a namespace whose JSON value has value[field] < before
+
+        One statement in one transaction, so an entry written concurrently is
+        judged by its new value. Returns the number of entries deleted.
+        """
+        with transaction(self._conn()) as conn:
+            return conn.execute(
+                f"""DELETE FROM entries
+                   WHERE namespace = ? AND json_extract(value, '$.' || ?) < ?
+                   AND key NOT IN ({', '.join('?' * len(keep))})""",
+                (namespace, field, before, *keep)
+            ).rowcount
+
+    def _write(self, conn: sqlite3.Connection, namespace: str, key: str, value: str) -> int:
+        conn.execute(
+            """INSERT INTO entries (namespace, key, value, version) VALUES (?, ?, ?, 1)
+               ON CONFLICT (namespace, key)
+               DO UPDATE SET value = excluded.value, version = entries.version + 1""",
+            (namespace, key, value)
+        )
+        return conn.execute(
+            "SELECT version FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()[0]
+
+
+class SharedCache:
+    """
+    Per-worker read cache over one SharedState namespace
+
+    Every read checks the entry's version (a single indexed lookup) and only
+    re-fetches and decodes the value when another worker has changed it.
+    At most capacity decoded entries are kept, least recently used first out.
+    """
+
+    def __init__(self, state: SharedState, namespace: str,
+                 encode: Callable[[Any], str] = json.dumps,
+                 decode: Callable[[str], Any] = json.loads,
+                 capacity: int = SHARED_CACHE_CAPACITY):
+        self.state = state
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+        self._entries = LRUCache(capacity=capacity)  # key -> (version, value)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        version = self.state.version(self.namespace, key)
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        raw, version = self.state.get(self.namespace, key)
+        if raw is None:
+            self._entries.pop(key, None)
+            return default
+
+        value = self.decode(raw)
+        self._entries.put(key, (version, value))
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        version = self.state.put(self.namespace, key, self.encode(value))
+        self._entries.put(key, (version, value))
+
+    def update(self, key: str, fn: Callable[[Any], Any],
+               default: Callable[[], Any] = dict) -> Any:
+        """Apply fn to the freshest value under the cross-worker write lock"""
+        result = {}
+
+        def apply(raw: Optional[str]) -> str:
+            value = self.decode(raw) if raw is not None else default()
+            result['value'] = fn(value)
+            return self.encode(result['value'])
+
+        _, version = self.state.update(self.namespace, key, apply)
+        self._entries.put(key, (version, result['value']))
+        return result['value']
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        value = self.get(key, default)
+        self.state.delete(self.namespace, key)
+        self._entries.pop(key, None)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.state.version(self.namespace, key) > 0
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.put(key, value)
+
+
+# Global instance
+shared_state = SharedState()
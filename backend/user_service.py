@@ -1,65 +1,97 @@
 """
 user_service.py
-User data management using ChromaDB for persistence
+User data management using an embedded SQLite user store for persistence
+XP and stat counters change through the append-only XP ledger (see xp_ledger.py)
 Handles XP, levels, progress tracking, and feature unlocks
 """
 
 import os
 import json
 from datetime import datetime
-from typing import Dict, Optional
-from langchain_community.vectorstores import Chroma
-from chromadb.config import Settings
-import chromadb
+from typing import Dict, List, Optional, Tuple
+from lru_cache import LRUCache
+from user_store import STAT_COLUMNS, UserStore
+from leaderboard import record_xp
+from xp_ledger import xp_ledger
+from analytics import GLOBAL_SCOPE, activity_rollups, user_scope
 
-# ChromaDB setup for user data
+# Legacy ChromaDB location of user data (imported once into the user store)
 USERS_DB_PATH = "./chroma_db/users"
-os.makedirs(USERS_DB_PATH, exist_ok=True)
 
-# Simple in-memory cache for fast access (backed by ChromaDB)
-user_cache = {}
+# Per-worker read cache bounds (TTL of 0 disables expiry)
+USER_CACHE_CAPACITY = int(os.getenv('USER_CACHE_CAPACITY', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '0'))
+
+# Per-worker read cache: {user_id: (row_version, user_data)}, revalidated against the store
+user_cache = LRUCache(capacity=USER_CACHE_CAPACITY, ttl=USER_CACHE_TTL_SECONDS or None)
 
 class UserService:
-    """Manage user data with ChromaDB persistence"""
+    """Manage user data with SQLite persistence"""
     
     def __init__(self):
-        """Initialize ChromaDB client for user storage"""
+        """Open the user store, importing legacy ChromaDB users on first run"""
+        self.store = UserStore()
         try:
-            self.client = chromadb.PersistentClient(path=USERS_DB_PATH)
-            # Get or create collection for users
-            self.users_collection = self.client.get_or_create_collection(
-                name="users",
-                metadata={"hnsw:space": "cosine"}
-            )
+            if self.store.count() == 0 and os.path.isdir(USERS_DB_PATH):
+                self._migrate_from_chromadb()
+            xp_ledger.bootstrap()
+            activity_rollups.backfill()
         except Exception as e:
-            print(f"⚠️  ChromaDB initialization error: {e}")
-            self.users_collection = None
+            print(f"⚠️  User store initialization error: {e}")
+    
+    def _migrate_from_chromadb(self) -> None:
+        """One-time import of users persisted by the previous ChromaDB backend"""
+        try:
+            import chromadb
+        except ImportError:
+            return
+        
+        client = chromadb.PersistentClient(path=USERS_DB_PATH)
+        try:
+            collection = client.get_collection(name="users")
+        except Exception:
+            return
+        
+        results = collection.get(include=["metadatas"])
+        users = [json.loads(metadata['data']) for metadata in results['metadatas']]
+        if users:
+            self.store.put_many(users)
+            print(f"✅ Imported {len(users)} users from ChromaDB")
+    
+    def _cache(self, user_data: Dict, version: int) -> Dict:
+        user_cache[user_data['user_id']] = (version, user_data)
+        return user_data
     
     def get_user(self, user_id: str) -> Dict:
-        """Retrieve user data from cache or database"""
-        # Check cache first
-        if user_id in user_cache:
-            return user_cache[user_id]
+        """Retrieve user data from cache or database, including this worker's unflushed ledger events"""
+        user_data, pending, _ = xp_ledger.read(user_id, lambda: self._load_user(user_id))
+        return xp_ledger.overlay(user_data, pending)
+    
+    def _load_user(self, user_id: str) -> Dict:
+        # Check cache first (revalidated against other workers' writes; an outdated entry is a miss)
+        version = self.store.version(user_id)
+        cached = user_cache.get(user_id, valid=lambda entry: entry[0] == version)
+        if cached is not None:
+            return cached[1]
         
-        # Try to load from ChromaDB
-        if self.users_collection:
-            try:
-                results = self.users_collection.get(
-                    ids=[user_id],
-                    include=["metadatas", "documents"]
-                )
-                
-                if results['ids']:
-                    # Parse user data from metadata
-                    user_data = json.loads(results['metadatas'][0]['data'])
-                    user_cache[user_id] = user_data
-                    return user_data
-            except Exception as e:
-                print(f"Error fetching user from ChromaDB: {e}")
+        try:
+            user_data, version = self.store.get(user_id)
+            if user_data is not None:
+                return self._cache(user_data, version)
+        except Exception as e:
+            print(f"Error fetching user from user store: {e}")
         
         # Create new user if doesn't exist
         return self._create_new_user(user_id)
     
+    def version(self, user_id: str) -> Tuple[int, int]:
+        """
+        (row version, unflushed ledger events) of a user; changes on every write
+        Row version is 0 if the user is not stored yet
+        """
+        row_version, _, pending_events = xp_ledger.read(user_id, lambda: self.store.version(user_id))
+        return row_version, pending_events
+    
     def _create_new_user(self, user_id: str) -> Dict:
         """Create and store new user with default values"""
         user_data = {
@@ -78,105 +110,89 @@ class UserService:
             'updated_at': datetime.now().isoformat()
         }
         
-        # Save to both cache and ChromaDB
-        user_cache[user_id] = user_data
-        self._save_to_chromadb(user_id, user_data)
-        
-        return user_data
-    
-    def _save_to_chromadb(self, user_id: str, user_data: Dict) -> None:
-        """Persist user data to ChromaDB"""
-        if not self.users_collection:
-            return
+        # A user missing from the store but known to the ledger gets its totals back
+        try:
+            user_data.update(xp_ledger.state(user_id))
+        except Exception as e:
+            print(f"Error rebuilding user from XP ledger: {e}")
         
+        # If another worker created the user first, keep its copy
         try:
-            user_data['updated_at'] = datetime.now().isoformat()
-            
-            # Try to update existing, insert if not found
-            self.users_collection.upsert(
-                ids=[user_id],
-                documents=[f"User {user_id}"],  # Simple document text
-                metadatas=[{
-                    "user_id": user_id,
-                    "data": json.dumps(user_data),
-                    "level": str(user_data['level']),
-                    "xp": str(user_data['xp'])
-                }]
-            )
+            user_data, version = self.store.insert(user_data)
+            return self._cache(user_data, version)
         except Exception as e:
-            print(f"Error saving user to ChromaDB: {e}")
+            print(f"Error saving user to user store: {e}")
+            return user_data
+    
+    def _write(self, user_id: str, result: Tuple) -> Dict:
+        user_data, version = result
+        if user_data is None:
+            return self.get_user(user_id)
+        return self._cache(user_data, version)
     
     def update_user(self, user_id: str, updates: Dict) -> Dict:
-        """Update user data and save to ChromaDB"""
-        user_data = self.get_user(user_id)
-        user_data.update(updates)
-        user_data['updated_at'] = datetime.now().isoformat()
-        
-        user_cache[user_id] = user_data
-        self._save_to_chromadb(user_id, user_data)
-        
-        return user_data
+        """Update user data and save to the user store"""
+        self.get_user(user_id)  # Make sure the user exists
+        # The update is written once; only the re-read is retried if a ledger flush lands meanwhile
+        self._write(user_id, self.store.update(user_id, lambda user_data: user_data.update(updates)))
+        return self.get_user(user_id)
     
     def set_character(self, user_id: str, character: Dict) -> Dict:
         """Save character selection"""
         return self.update_user(user_id, {'character': character})
     
-    def add_xp(self, user_id: str, amount: int) -> Dict:
-        """Add XP to user"""
-        user_data = self.get_user(user_id)
-        user_data['xp'] += amount
-        user_data['updated_at'] = datetime.now().isoformat()
-        
-        user_cache[user_id] = user_data
-        self._save_to_chromadb(user_id, user_data)
-        
-        return user_data
+    def add_xp(self, user_id: str, amount: int, source: str = '') -> Dict:
+        """Add XP to user (one buffered ledger append)"""
+        self.get_user(user_id)  # the row must exist when the ledger flush applies the delta
+        xp_ledger.append(user_id, 'xp', amount, source)
+        record_xp(amount)  # may trigger an early leaderboard rebuild
+        return self.get_user(user_id)
     
     def update_stats(self, user_id: str, stat_name: str, increment: int = 1) -> Dict:
         """Increment any stat (flashcards_reviewed, quizzes_completed, etc)"""
         user_data = self.get_user(user_id)
         
-        if stat_name in user_data:
+        if stat_name not in user_data:
+            return user_data
+        
+        if stat_name in STAT_COLUMNS:
+            xp_ledger.append(user_id, stat_name, increment)
+            return self.get_user(user_id)
+        
+        def change(user_data: Dict) -> None:
             user_data[stat_name] += increment
-            user_data['updated_at'] = datetime.now().isoformat()
-            
-            user_cache[user_id] = user_data
-            self._save_to_chromadb(user_id, user_data)
         
-        return user_data
+        return self._write(user_id, self.store.update(user_id, change))
+    
+    def xp_history(self, user_id: str, since: float = 0.0, limit: int = 1000) -> List[Dict]:
+        """XP and stat events of a user since a Unix timestamp, oldest first"""
+        xp_ledger.flush()  # include this worker's latest events
+        return xp_ledger.events(user_id, since=since, limit=limit)
+    
+    def analytics(self, user_id: Optional[str] = None, days: int = 30, weeks: int = 12) -> Optional[Dict]:
+        """Precomputed activity series and streak of a user (or the whole platform when user_id is None)"""
+        xp_ledger.flush()  # include this worker's latest events
+        scope = user_scope(user_id) if user_id else GLOBAL_SCOPE
+        return activity_rollups.report(scope, days=days, weeks=weeks)
     
-    def get_leaderboard(self, limit: int = 10) -> list:
+    def cache_stats(self) -> Dict:
+        """Hit/miss/eviction counters of the per-worker user cache"""
+        return user_cache.stats()
+    
+    def get_leaderboard(self, limit: int = 10) -> List[Dict]:
         """Get top users by XP"""
         try:
-            if not self.users_collection:
-                return []
-            
-            # Get all users from ChromaDB
-            results = self.users_collection.get(include=["metadatas"])
-            
-            users_list = []
-            for metadata in results['metadatas']:
-                try:
-                    user_data = json.loads(metadata['data'])
-                    users_list.append({
-                        'user_id': user_data['user_id'],
-                        'xp': user_data['xp'],
-                        'level': user_data['level'],
-                        'flashcards_reviewed': user_data['flashcards_reviewed'],
-                        'quizzes_completed': user_data['quizzes_completed'],
-                        'character': user_data.get('character', {}).get('name', 'Unknown')
-                    })
-                except:
-                    pass
-            
-            # Sort by XP descending
-            users_list.sort(key=lambda x: x['xp'], reverse=True)
-            
-            # Add ranks and return top N
             leaderboard = []
-            for idx, user in enumerate(users_list[:limit]):
-                user['rank'] = idx + 1
-                leaderboard.append(user)
+            for idx, user_data in enumerate(self.store.top_by_xp(limit)):
+                leaderboard.append({
+                    'user_id': user_data['user_id'],
+                    'xp': user_data['xp'],
+                    'level': user_data['level'],
+                    'flashcards_reviewed': user_data['flashcards_reviewed'],
+                    'quizzes_completed': user_data['quizzes_completed'],
+                    'character': (user_data.get('character') or {}).get('name', 'Unknown'),
+                    'rank': idx + 1
+                })
             
             return leaderboard
         except Exception as e:
@@ -0,0 +1,140 @@
+"""
+user_store.py
+Embedded SQLite store for user records
+Typed columns for XP, level and stat counters, JSON column for the rest
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from shared_state import connect, transaction
+
+# SQLite file holding one row per user (WAL mode, shared by all workers)
+USER_STORE_PATH = os.getenv('USER_STORE_PATH', './chroma_db/users.db')
+
+# Fields stored as typed integer columns; everything else goes to the JSON column
+INT_COLUMNS = ('xp', 'level', 'flashcards_reviewed', 'quizzes_completed', 'documents_processed', 'streak')
+STAT_COLUMNS = ('flashcards_reviewed', 'quizzes_completed', 'documents_processed', 'streak')
+
+_SELECT = f"SELECT user_id, {', '.join(INT_COLUMNS)}, data, version, updated_at FROM users"
+
+
+class UserStore:
+    """One indexed row per user; every write bumps the row version"""
+
+    def __init__(self, path: str = USER_STORE_PATH):
+        self.path = path
+        # One connection per thread; sqlite3 connections are not thread-safe
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    {', '.join(f'{col} INTEGER NOT NULL DEFAULT 0' for col in INT_COLUMNS)},
+                    data TEXT NOT NULL DEFAULT '{{}}',
+                    version INTEGER NOT NULL DEFAULT 1,
+                    updated_at TEXT
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp DESC)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_row(user_data: Dict) -> Tuple:
+        extra = {k: v for k, v in user_data.items() if k not in INT_COLUMNS and k != 'user_id'}
+        return (
+            user_data['user_id'],
+            *(int(user_data.get(col) or 0) for col in INT_COLUMNS),
+            json.dumps(extra),
+            user_data.get('updated_at') or datetime.now().isoformat()
+        )
+
+    @staticmethod
+    def _from_row(row: Tuple) -> Tuple[Dict, int]:
+        user_id, *ints, data, version, updated_at = row
+        user_data = json.loads(data)
+        user_data['user_id'] = user_id
+        user_data.update(zip(INT_COLUMNS, ints))
+        user_data['updated_at'] = updated_at
+        return user_data, version
+
+    def version(self, user_id: str) -> int:
+        """Current row version (0 if the user does not exist)"""
+        row = self.conn.execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, user_id: str) -> Tuple[Optional[Dict], int]:
+        """Return (user_data, version), or (None, 0) if missing"""
+        row = self.conn.execute(f"{_SELECT} WHERE user_id = ?", (user_id,)).fetchone()
+        return self._from_row(row) if row else (None, 0)
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def insert(self, user_data: Dict) -> Tuple[Dict, int]:
+        """Insert a new user; if another worker inserted it first, return that row"""
+        self.conn.execute(
+            f"""INSERT OR IGNORE INTO users (user_id, {', '.join(INT_COLUMNS)}, data, updated_at)
+                VALUES ({', '.join('?' * (len(INT_COLUMNS) + 3))})""",
+            self._to_row(user_data)
+        )
+        return self.get(user_data['user_id'])
+
+    def put_many(self, users: Iterable[Dict]) -> int:
+        """Batched upsert of whole records in a single transaction"""
+        rows = [self._to_row(user_data) for user_data in users]
+        assignments = ', '.join(f'{col} = excluded.{col}' for col in INT_COLUMNS)
+        with transaction(self.conn):
+            self.conn.executemany(
+                f"""INSERT INTO users (user_id, {', '.join(INT_COLUMNS)}, data, updated_at)
+                    VALUES ({', '.join('?' * (len(INT_COLUMNS) + 3))})
+                    ON CONFLICT (user_id) DO UPDATE SET {assignments}, data = excluded.data,
+                        updated_at = excluded.updated_at, version = users.version + 1""",
+                rows
+            )
+        return len(rows)
+
+    def increment(self, user_id: str, column: str, amount: int) -> Tuple[Optional[Dict], int]:
+        """Atomically add to one integer column with a single indexed row update"""
+        if column not in INT_COLUMNS:
+            raise ValueError(f"Not an integer column: {column}")
+
+        with transaction(self.conn):
+            self.conn.execute(
+                f"""UPDATE users SET {column} = {column} + ?, version = version + 1, updated_at = ?
+                    WHERE user_id = ?""",
+                (amount, datetime.now().isoformat(), user_id)
+            )
+            return self.get(user_id)
+
+    def update(self, user_id: str, fn: Callable[[Dict], None]) -> Tuple[Optional[Dict], int]:
+        """Atomic read-modify-write of a whole record across workers"""
+        with transaction(self.conn):
+            user_data, _ = self.get(user_id)
+            if user_data is None:
+                return None, 0
+            fn(user_data)
+            user_data['updated_at'] = datetime.now().isoformat()
+            user_id, *ints, data, updated_at = self._to_row(user_data)
+            self.conn.execute(
+                f"""UPDATE users SET {', '.join(f'{col} = ?' for col in INT_COLUMNS)},
+                        data = ?, updated_at = ?, version = version + 1
+                    WHERE user_id = ?""",
+                (*ints, data, updated_at, user_id)
+            )
+            return self.get(user_id)
+
+    def top_by_xp(self, limit: int) -> List[Dict]:
+        """Top users by XP, served from the XP index"""
+        rows = self.conn.execute(f"{_SELECT} ORDER BY xp DESC LIMIT ?", (limit,)).fetchall()
+        return [self._from_row(row)[0] for row in rows]
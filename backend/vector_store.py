@@ -0,0 +1,242 @@
+"""
+vector_store.py
+Per-document storage of the in-process RAG vector store, shared across workers via SQLite
+Each uploaded document is one row (its chunks, embeddings and metadata), so an
+ingest writes only the new document, a delete flips a flag and compaction drops
+rows. Workers keep decoded documents in a bounded cache and rebuild a user's
+view from them when the user's version changes, decoding only documents they
+have not seen yet.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from lru_cache import LRUCache
+from shared_state import SHARED_STATE_PATH, connect, transaction
+
+# Decoded documents and assembled user views kept per worker
+VECTOR_STORE_CACHE_DOCUMENTS = int(os.getenv('VECTOR_STORE_CACHE_DOCUMENTS', '2000'))
+VECTOR_STORE_CACHE_USERS = int(os.getenv('VECTOR_STORE_CACHE_USERS', '256'))
+
+
+def new_user_store() -> Dict:
+    """Empty per-user view"""
+    return {
+        'documents': [],
+        'embeddings': [],
+        'metadata': [],
+        'tombstones': set()  # doc_ids logically deleted, reclaimed by compaction
+    }
+
+
+class VectorStore:
+    """
+    Documents of every user in the vector_documents table of the shared state file
+
+    get() returns a read-only view per user in the format the search code uses:
+    {"documents": [], "embeddings": [], "metadata": [], "tombstones": set()},
+    chunks in upload order. The same view object is returned until the user's
+    documents change.
+    """
+
+    def __init__(self, path: str = SHARED_STATE_PATH,
+                 cached_documents: int = VECTOR_STORE_CACHE_DOCUMENTS,
+                 cached_users: int = VECTOR_STORE_CACHE_USERS):
+        self.path = path
+        self._local = threading.local()
+        self._documents = LRUCache(capacity=cached_documents)  # (user_id, doc_id) -> decoded chunks
+        self._views = LRUCache(capacity=cached_users)  # user_id -> (version, view)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS vector_documents (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    tombstoned INTEGER NOT NULL DEFAULT 0,
+                    data TEXT NOT NULL,
+                    UNIQUE (user_id, doc_id)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS vector_versions (
+                    user_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )"""
+            )
+            self._migrate(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        """Split whole-user JSON entries written by older versions into document rows"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries'"
+        ).fetchone()
+        if not exists or not conn.execute(
+            "SELECT 1 FROM entries WHERE namespace = 'vector_store' LIMIT 1"
+        ).fetchone():
+            return
+        with transaction(conn):
+            for user_id, raw in conn.execute(
+                "SELECT key, value FROM entries WHERE namespace = 'vector_store'"
+            ).fetchall():
+                user_data = json.loads(raw)
+                tombstones = set(user_data.get('tombstones', []))
+                by_doc: Dict[str, Dict] = {}
+                for text, embedding, metadata in zip(
+                    user_data['documents'], user_data['embeddings'], user_data['metadata']
+                ):
+                    doc = by_doc.setdefault(metadata['doc_id'], {
+                        'filename': metadata['filename'], 'documents': [], 'embeddings': [], 'metadata': []
+                    })
+                    doc['documents'].append(text)
+                    doc['embeddings'].append(embedding)
+                    doc['metadata'].append(metadata)
+                for doc_id, doc in by_doc.items():
+                    conn.execute(
+                        """INSERT OR IGNORE INTO vector_documents
+                           (user_id, doc_id, filename, chunk_count, tombstoned, data) VALUES (?, ?, ?, ?, ?, ?)""",
+                        (user_id, doc_id, doc.pop('filename'), len(doc['documents']),
+                         int(doc_id in tombstones), json.dumps(doc))
+                    )
+                VectorStore._bump(conn, user_id)
+            conn.execute("DELETE FROM entries WHERE namespace = 'vector_store'")
+
+    @staticmethod
+    def _bump(conn: sqlite3.Connection, user_id: str) -> None:
+        conn.execute(
+            """INSERT INTO vector_versions (user_id, version) VALUES (?, 1)
+               ON CONFLICT (user_id) DO UPDATE SET version = version + 1""",
+            (user_id,)
+        )
+
+    def version(self, user_id: str) -> int:
+        row = self.conn.execute("SELECT version FROM vector_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, user_id: str, default: Optional[Dict] = None) -> Optional[Dict]:
+        """The user's view (do not modify it), or default if the user has no documents"""
+        version = self.version(user_id)
+        cached = self._views.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        conn = self.conn
+        rows = conn.execute(
+            "SELECT doc_id, tombstoned FROM vector_documents WHERE user_id = ? ORDER BY seq", (user_id,)
+        ).fetchall()
+        if not rows:
+            self._views.pop(user_id)
+            return default
+
+        decoded = {doc_id: self._documents.get((user_id, doc_id)) for doc_id, _ in rows}
+        missing = [doc_id for doc_id, doc in decoded.items() if doc is None]
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            for doc_id, data in conn.execute(
+                f"""SELECT doc_id, data FROM vector_documents
+                    WHERE user_id = ? AND doc_id IN ({', '.join('?' * len(batch))})""",
+                (user_id, *batch)
+            ):
+                decoded[doc_id] = json.loads(data)
+                self._documents.put((user_id, doc_id), decoded[doc_id])
+
+        view = new_user_store()
+        for doc_id, tombstoned in rows:
+            doc = decoded.get(doc_id)
+            if doc is None:  # compacted between the two reads; the next version drops it
+                continue
+            view['documents'].extend(doc['documents'])
+            view['embeddings'].extend(doc['embeddings'])
+            view['metadata'].extend(doc['metadata'])
+            if tombstoned:
+                view['tombstones'].add(doc_id)
+        self._views.put(user_id, (version, view))
+        return view
+
+    def add_document(self, user_id: str, doc_id: str, filename: str, documents: List[str],
+                     embeddings: List[List[float]], metadata: List[Dict],
+                     replace_filename: Optional[str] = None) -> Set[str]:
+        """
+        Store one document; in the same transaction tombstone the live documents
+        uploaded under replace_filename. Returns the tombstoned doc_ids.
+        """
+        doc = {'documents': documents, 'embeddings': embeddings, 'metadata': metadata}
+        data = json.dumps(doc)
+        with transaction(self.conn) as conn:
+            replaced = set()
+            if replace_filename is not None:
+                replaced = {row[0] for row in conn.execute(
+                    """SELECT doc_id FROM vector_documents
+                       WHERE user_id = ? AND filename = ? AND tombstoned = 0""",
+                    (user_id, replace_filename)
+                )}
+                self._set_tombstoned(conn, user_id, replaced)
+            conn.execute(
+                """INSERT INTO vector_documents (user_id, doc_id, filename, chunk_count, data)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (user_id, doc_id, filename, len(documents), data)
+            )
+            self._bump(conn, user_id)
+        self._documents.put((user_id, doc_id), doc)
+        return replaced
+
+    def tombstone(self, user_id: str, doc_id: Optional[str] = None,
+                  filename: Optional[str] = None) -> Tuple[Set[str], int]:
+        """Logically delete live documents by doc_id and/or filename; returns (doc_ids, chunks)"""
+        with transaction(self.conn) as conn:
+            rows = conn.execute(
+                """SELECT doc_id, chunk_count FROM vector_documents
+                   WHERE user_id = ? AND tombstoned = 0 AND (doc_id = ? OR filename = ?)""",
+                (user_id, doc_id, filename)
+            ).fetchall()
+            matched = {row[0] for row in rows}
+            if matched:
+                self._set_tombstoned(conn, user_id, matched)
+                self._bump(conn, user_id)
+        return matched, sum(row[1] for row in rows)
+
+    def _set_tombstoned(self, conn: sqlite3.Connection, user_id: str, doc_ids: Iterable[str]) -> None:
+        conn.executemany(
+            "UPDATE vector_documents SET tombstoned = 1 WHERE user_id = ? AND doc_id = ?",
+            [(user_id, doc_id) for doc_id in doc_ids]
+        )
+
+    def compact(self, user_id: str) -> int:
+        """Physically delete the user's tombstoned documents; returns the chunks reclaimed"""
+        with transaction(self.conn) as conn:
+            rows = conn.execute(
+                "SELECT doc_id, chunk_count FROM vector_documents WHERE user_id = ? AND tombstoned = 1",
+                (user_id,)
+            ).fetchall()
+            if not rows:
+                return 0
+            conn.execute("DELETE FROM vector_documents WHERE user_id = ? AND tombstoned = 1", (user_id,))
+            self._bump(conn, user_id)
+        for doc_id, _ in rows:
+            self._documents.pop((user_id, doc_id))
+        return sum(row[1] for row in rows)
+
+    def live_documents(self, user_id: str) -> List[Dict]:
+        """doc_id, filename and chunk count of the user's live documents, in upload order"""
+        rows = self.conn.execute(
+            """SELECT doc_id, filename, chunk_count FROM vector_documents
+               WHERE user_id = ? AND tombstoned = 0 ORDER BY seq""",
+            (user_id,)
+        ).fetchall()
+        return [{'doc_id': doc_id, 'filename': filename, 'chunks': chunks} for doc_id, filename, chunks in rows]
+
+
+# Global instance
+vector_store = VectorStore()
@@ -0,0 +1,297 @@
+"""
+xp_ledger.py
+Append-only ledger of XP and stat events with periodic per-user snapshots
+An award is appended to a per-worker buffer; batches are written by a background
+flusher in one transaction that inserts the events and adds their summed deltas
+to the user rows (and folds them into the analytics rollups), so a row always
+equals the ledger folded up to its last flushed event. Every
+XP_LEDGER_SNAPSHOT_EVERY events a user's totals are snapshotted, and any user's
+totals can be rebuilt from the latest snapshot plus the events after it.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from analytics import activity_rollups
+from metrics import registry
+from shared_state import transaction
+from user_store import STAT_COLUMNS, UserStore
+
+# Longest an append waits in the buffer (0 writes every event straight away)
+XP_LEDGER_FLUSH_MS = float(os.getenv('XP_LEDGER_FLUSH_MS', '50'))
+# A buffer this full is flushed at once by the appending thread
+XP_LEDGER_BATCH_SIZE = int(os.getenv('XP_LEDGER_BATCH_SIZE', '500'))
+# Snapshot a user's totals after this many events since the last snapshot
+XP_LEDGER_SNAPSHOT_EVERY = int(os.getenv('XP_LEDGER_SNAPSHOT_EVERY', '100'))
+
+# Counters recorded in the ledger (each is a typed column of the users table)
+KINDS = ('xp',) + STAT_COLUMNS
+# Largest magnitude of one event, so sums stay far inside SQLite's 64-bit integers
+MAX_AMOUNT = 2 ** 31 - 1
+
+LEDGER_EVENTS = registry.counter('app_xp_ledger_events_total', 'Events appended to the XP ledger', ('kind',))
+LEDGER_FLUSH_EVENTS = registry.histogram(
+    'app_xp_ledger_flush_events', 'Events written per ledger flush', buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+LEDGER_SNAPSHOTS = registry.counter('app_xp_ledger_snapshots_total', 'Per-user ledger snapshots written')
+
+# (user_id, kind, amount, source, created_at)
+Event = Tuple[str, str, int, str, float]
+T = TypeVar('T')
+
+
+class XPLedger:
+    """Buffered, batched event appends plus snapshot/tail reads of the same SQLite file as the user store"""
+
+    def __init__(self, store: Optional[UserStore] = None, flush_ms: float = XP_LEDGER_FLUSH_MS,
+                 batch_size: int = XP_LEDGER_BATCH_SIZE, snapshot_every: int = XP_LEDGER_SNAPSHOT_EVERY):
+        self.store = store or UserStore()
+        self.flush_seconds = flush_ms / 1000.0
+        self.batch_size = batch_size
+        self.snapshot_every = snapshot_every
+        self._buffer: List[Event] = []
+        # Unflushed deltas of this worker: user_id -> {kind: amount}, and event counts per user
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self._pending_events: Dict[str, int] = {}
+        self._lock = threading.Lock()  # buffer, pending maps and generation
+        self._flush_lock = threading.Lock()  # one flush at a time
+        # Odd while a flush may be committing (until its pending deltas are removed);
+        # readers retry when it moved, so a delta is never counted twice or missed
+        self._generation = 0
+        self._flushed = threading.Condition(self._lock)
+        self._flusher_pid = None
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = self.store.conn
+        if not getattr(self._local, 'ready', False):
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS xp_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    source TEXT NOT NULL DEFAULT '',
+                    created_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_user ON xp_events (user_id, seq)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS xp_snapshots (
+                    user_id TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            # Here rather than in the flush, whose rollback would undo it
+            activity_rollups.create_table(conn)
+            self._local.ready = True
+        return conn
+
+    def append(self, user_id: str, kind: str, amount: int, source: str = '') -> None:
+        """Record one event; it reaches the user row with the next flush (see overlay())"""
+        if kind not in KINDS:
+            raise ValueError(f"Not a ledger counter: {kind}")
+        if not isinstance(amount, int) or isinstance(amount, bool) or abs(amount) > MAX_AMOUNT:
+            raise ValueError(f"Ledger amount must be an integer within ±{MAX_AMOUNT}: {amount!r}")
+
+        with self._lock:
+            self._buffer.append((user_id, kind, amount, source, time.time()))
+            pending = self._pending.setdefault(user_id, {})
+            pending[kind] = pending.get(kind, 0) + amount
+            self._pending_events[user_id] = self._pending_events.get(user_id, 0) + 1
+            full = len(self._buffer) >= self.batch_size
+        LEDGER_EVENTS.inc(kind=kind)
+
+        if full or self.flush_seconds <= 0:
+            self.flush()
+        else:
+            self._start_flusher()
+
+    def flush(self) -> int:
+        """Write the buffered events and apply them to the user rows in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                if not batch:
+                    return 0
+                self._generation += 1
+
+            deltas: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+            for user_id, kind, amount, _, _ in batch:
+                deltas[user_id][kind] += amount
+
+            try:
+                conn = self.conn
+                with transaction(conn):
+                    conn.executemany(
+                        "INSERT INTO xp_events (user_id, kind, amount, source, created_at) VALUES (?, ?, ?, ?, ?)",
+                        batch
+                    )
+                    updated_at = datetime.now().isoformat()
+                    for user_id, by_kind in deltas.items():
+                        # kinds were checked in append(), so they are safe column names
+                        assignments = ', '.join(f'{kind} = {kind} + ?' for kind in by_kind)
+                        conn.execute(
+                            f"""UPDATE users SET {assignments}, version = version + 1, updated_at = ?
+                                WHERE user_id = ?""",
+                            (*by_kind.values(), updated_at, user_id)
+                        )
+                        self._maybe_snapshot(conn, user_id)
+                    activity_rollups.apply(conn, batch)
+            except Exception as e:
+                # Keep the events (and their pending deltas) for the next flush
+                with self._lock:
+                    self._buffer[:0] = batch
+                    self._end_flush()
+                print(f"⚠️  XP ledger flush failed, will retry: {e}")
+                return 0
+
+            with self._lock:
+                for user_id, _, _, _, _ in batch:
+                    self._pending_events[user_id] -= 1
+                for user_id, by_kind in deltas.items():
+                    if self._pending_events[user_id] == 0:
+                        del self._pending_events[user_id]
+                        del self._pending[user_id]
+                        continue
+                    pending = self._pending[user_id]
+                    for kind, amount in by_kind.items():
+                        pending[kind] -= amount
+                self._end_flush()
+            LEDGER_FLUSH_EVENTS.observe(len(batch))
+            return len(batch)
+
+    def _end_flush(self) -> None:
+        # Called holding self._lock
+        self._generation += 1
+        self._flushed.notify_all()
+
+    def _start_flusher(self) -> None:
+        # Started lazily and per process, so forked workers each get their own
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run_flusher, name='xp-ledger-flusher', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run_flusher(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  XP ledger flusher error: {e}")
+
+    def read(self, user_id: str, load: Callable[[], T]) -> Tuple[T, Dict[str, int], int]:
+        """
+        Run load() (a read of the user's row) and pair it with this worker's unflushed state
+
+        load() runs without any ledger lock held; if a flush committed meanwhile it
+        is run again, so the row and the pending deltas never both include an event.
+
+        Returns:
+            Tuple of (load() result, copy of the pending deltas {kind: amount}, pending event count)
+        """
+        while True:
+            with self._lock:
+                # Wait out a flush in progress (its commit could land during load())
+                self._flushed.wait_for(lambda: self._generation % 2 == 0)
+                generation = self._generation
+            result = load()
+            with self._lock:
+                if self._generation == generation:
+                    return (result, dict(self._pending.get(user_id, {})),
+                            self._pending_events.get(user_id, 0))
+
+    @staticmethod
+    def overlay(user_data: Dict, pending: Dict[str, int]) -> Dict:
+        """A copy of user_data with unflushed deltas (from read()) added"""
+        if not pending:
+            return user_data
+        user_data = dict(user_data)
+        for kind, amount in pending.items():
+            user_data[kind] = (user_data.get(kind) or 0) + amount
+        return user_data
+
+    def _fold(self, conn: sqlite3.Connection, user_id: str) -> Tuple[Dict[str, int], int, int]:
+        """(totals, last folded seq, events after the snapshot) from the snapshot plus the tail"""
+        row = conn.execute("SELECT seq, state FROM xp_snapshots WHERE user_id = ?", (user_id,)).fetchone()
+        seq, state = (row[0], json.loads(row[1])) if row else (0, {})
+        tail = 0
+        for kind, total, count, last in conn.execute(
+            """SELECT kind, SUM(amount), COUNT(*), MAX(seq) FROM xp_events
+               WHERE user_id = ? AND seq > ? GROUP BY kind""",
+            (user_id, seq)
+        ):
+            state[kind] = state.get(kind, 0) + total
+            tail += count
+            seq = max(seq, last)
+        return state, seq, tail
+
+    def _maybe_snapshot(self, conn: sqlite3.Connection, user_id: str) -> None:
+        state, seq, tail = self._fold(conn, user_id)
+        if tail >= self.snapshot_every:
+            self._write_snapshot(conn, user_id, seq, state)
+
+    @staticmethod
+    def _write_snapshot(conn: sqlite3.Connection, user_id: str, seq: int, state: Dict[str, int]) -> None:
+        conn.execute(
+            """INSERT INTO xp_snapshots (user_id, seq, state, created_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT (user_id) DO UPDATE SET seq = excluded.seq, state = excluded.state,
+                   created_at = excluded.created_at""",
+            (user_id, seq, json.dumps(state), time.time())
+        )
+        LEDGER_SNAPSHOTS.inc()
+
+    def state(self, user_id: str) -> Dict[str, int]:
+        """A user's flushed totals rebuilt from the ledger ({} if it has never recorded the user)"""
+        state, _, _ = self._fold(self.conn, user_id)
+        return state
+
+    def bootstrap(self) -> int:
+        """
+        Baseline snapshot for users whose totals predate the ledger (no snapshot, no events),
+        so rebuilding them from the ledger starts from their current totals
+        """
+        conn = self.conn
+        rows = conn.execute(
+            f"""SELECT user_id, {', '.join(KINDS)} FROM users
+                WHERE user_id NOT IN (SELECT user_id FROM xp_snapshots)
+                  AND user_id NOT IN (SELECT user_id FROM xp_events)"""
+        ).fetchall()
+        baselines = [(user_id, dict(zip(KINDS, totals))) for user_id, *totals in rows if any(totals)]
+        if baselines:
+            with transaction(conn):
+                for user_id, state in baselines:
+                    # seq 0: every event of the user comes after it
+                    self._write_snapshot(conn, user_id, 0, state)
+        return len(baselines)
+
+    def events(self, user_id: str, since: float = 0.0, kinds: Optional[Iterable[str]] = None,
+               limit: int = 1000) -> List[Dict]:
+        """A user's flushed events since a Unix timestamp, oldest first"""
+        kinds = [kind for kind in (kinds or KINDS) if kind in KINDS]
+        rows = self.conn.execute(
+            f"""SELECT seq, kind, amount, source, created_at FROM xp_events
+                WHERE user_id = ? AND created_at >= ? AND kind IN ({', '.join('?' * len(kinds))})
+                ORDER BY seq LIMIT ?""",
+            (user_id, since, *kinds, limit)
+        ).fetchall()
+        return [
+            {'seq': seq, 'kind': kind, 'amount': amount, 'source': source, 'created_at': created_at}
+            for seq, kind, amount, source, created_at in rows
+        ]
+
+
+# Global instance
+xp_ledger = XPLedger()
@@ -62,7 +62,18 @@ const TopicInput = () => {
           body: formData,
         });
 
-        const result = await response.json();
+        let result = await response.json();
+
+        // Uploads are ingested in the background; poll the job until it finishes
+        if (response.status === 202) {
+          let job = { state: "queued" };
+          while (job.state === "queued" || job.state === "running") {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            const poll = await fetch(`http://localhost:5000${result.status_url}`);
+            job = (await poll.json()).job || { state: "failed", error: "Job not found" };
+          }
+          result = job.result || { status: "failed", error: job.error };
+        }
 
         if (result.status === "success") {
           localStorage.setItem("currentTopic", uploadedFile.name);